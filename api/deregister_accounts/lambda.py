@@ -1,6 +1,5 @@
 import json
 import boto3
-from boto3.dynamodb.types import TypeDeserializer
 
 # 在deploy/data_collection/cdk_infra/backend_stack.py中把common/打包为
 # Lambda Layer, 导致最终的layer是没有common/这一层目录. 所以，使用
@@ -8,32 +7,19 @@ from boto3.dynamodb.types import TypeDeserializer
 try:
     # 本地开发时使用
     from common.utils import create_response, parse_event
-    from common.constants import ACCOUNTS_TABLE_NAME, USERS_TABLE_NAME
+    from common.constants import ACCOUNTS_TABLE_NAME
+    from common.batch_get import batch_get_all
+    from common.memberships import delete_account_memberships
 except ImportError:
     # 部署到 Lambda 时使用
     from utils import create_response, parse_event
-    from constants import ACCOUNTS_TABLE_NAME, USERS_TABLE_NAME
+    from constants import ACCOUNTS_TABLE_NAME
+    from batch_get import batch_get_all
+    from memberships import delete_account_memberships
 
 
 # 初始化DynamoDB客户端
-dynamodb = boto3.resource('dynamodb')
 dynamodb_client = boto3.client('dynamodb')
-accounts_table = dynamodb.Table(ACCOUNTS_TABLE_NAME)
-users_table = dynamodb.Table(USERS_TABLE_NAME)
-
-deserializer = TypeDeserializer()
-
-def deserialize_item(item):
-    """
-    反序列化DynamoDB项目
-
-    参数:
-    item (dict): 原始DynamoDB项目
-
-    返回:
-    dict: 反序列化后的项目
-    """
-    return {k: deserializer.deserialize(v) for k, v in item.items()}
 
 def get_accounts(account_ids):
     """
@@ -45,16 +31,9 @@ def get_accounts(account_ids):
     返回:
     dict: 账户信息字典，键为账户ID，值为账户详情
     """
-    keys = [{'AccountId': {'S': account_id}} for account_id in account_ids]
-    response = dynamodb_client.batch_get_item(
-        RequestItems={
-            ACCOUNTS_TABLE_NAME: {
-                'Keys': keys
-            }
-        }
-    )
-    print("Batch get item response:", response)
-    return {deserialize_item(item)['AccountId']: deserialize_item(item) for item in response['Responses'][ACCOUNTS_TABLE_NAME]}
+    items = batch_get_all(ACCOUNTS_TABLE_NAME, [{'AccountId': account_id} for account_id in account_ids])
+    print(f"Fetched {len(items)} of {len(account_ids)} accounts")
+    return {item['AccountId']: item for item in items}
 
 def prepare_transact_items(account_ids, existing_accounts):
     """
@@ -68,59 +47,40 @@ def prepare_transact_items(account_ids, existing_accounts):
     list: 事务写入项列表
     """
     transact_items = []
-    user_updates = {}
 
     for account_id in account_ids:
         if account_id in existing_accounts:
-            allowed_users = list(existing_accounts[account_id]['AllowedUsers'].keys())
-            print(f"Allowed users for account {account_id}: {allowed_users}")
-
-            # 删除管理账户表中的记录
+            # 删除管理账户表中的记录(成员关系在事务成功后另外删除)
             transact_items.append({
                 'Delete': {
                     'TableName': ACCOUNTS_TABLE_NAME,
                     'Key': {'AccountId': {'S': account_id}}
                 }
             })
-
-            # 合并对用户表的更新操作
-            for email in allowed_users:
-                if email not in user_updates:
-                    user_updates[email] = set()
-                user_updates[email].add(account_id)
         else:
             print(f"Account ID {account_id} not found.")
             # 不再返回错误响应，返回空列表
             return []
 
-    print(f"user_updates: {user_updates}")
-
-    for email, account_id_set in user_updates.items():
-        print(f"Preparing to update {email} to delete account IDs {list(account_id_set)}")
-        transact_items.append({
-            'Update': {
-                'TableName': USERS_TABLE_NAME,
-                'Key': {'UserId': {'S': email}},
-                'UpdateExpression': 'DELETE AllowedAccountIds :account_ids',
-                'ExpressionAttributeValues': {':account_ids': {'SS': list(account_id_set)}}
-            }
-        })
-
     print("Prepared transaction items:", transact_items)
     return transact_items
 
-def execute_transact_items(transact_items):
+def execute_transact_items(transact_items, account_ids):
     """
-    执行DynamoDB事务写入操作。
+    执行DynamoDB事务写入操作，成功后批量删除这些账户的成员关系。
 
     参数:
     transact_items (list): 事务写入项列表
+    account_ids (list): 注销的账户ID列表
 
     返回:
     dict: 包含状态码和处理结果的字典
     """
     try:
         dynamodb_client.transact_write_items(TransactItems=transact_items)
+        for account_id in account_ids:
+            count = delete_account_memberships(account_id)
+            print(f"Deleted {count} memberships of account {account_id}")
         return create_response(200, 'Accounts deregistered successfully.')
     except Exception as e:
         print(f"Failed to delete data: {e}")
@@ -157,4 +117,4 @@ def lambda_handler(event, context):
     if not transact_items:  # 如果事务项为空，返回找不到账户ID的响应
         return create_response(404, 'One or more Account IDs not found.')
 
-    return execute_transact_items(transact_items)
+    return execute_transact_items(transact_items, account_ids)
@@ -1,4 +1,5 @@
 import boto3
+from boto3.dynamodb.conditions import Key
 from botocore.exceptions import ClientError
 import os
 import json
@@ -11,13 +12,27 @@ import time
 try:
     # 本地开发时使用
     from common.utils import create_response, parse_event
+    from common.cache import bump_data_generation
+    from common.health_events import (convert_datetime_to_string, write_events_with_rollups,
+        get_expiration_time, get_shard_config)
+    from common.search_index import index_event_details, METADATA_FIELDS
+    from common.batch_get import batch_get_all
+    from common.entity_index import index_affected_entities, index_entity_tags
     from common.constants import  (ACCOUNTS_TABLE_NAME, HEALTH_EVENTS_TABLE_NAME,
-        EVENT_DETAILS_TABLE_NAME, AFFECTED_ACCOUNTS_TABLE_NAME, AFFECTED_ENTITIES_TABLE_NAME)            
+        EVENT_DETAILS_TABLE_NAME, AFFECTED_ACCOUNTS_TABLE_NAME, AFFECTED_ENTITIES_TABLE_NAME,
+        DATA_GENERATION_KEY)
 except ImportError:
     # 部署到 Lambda 时使用
     from utils import create_response, parse_event
+    from cache import bump_data_generation
+    from health_events import (convert_datetime_to_string, write_events_with_rollups,
+        get_expiration_time, get_shard_config)
+    from search_index import index_event_details, METADATA_FIELDS
+    from batch_get import batch_get_all
+    from entity_index import index_affected_entities, index_entity_tags
     from constants import  (ACCOUNTS_TABLE_NAME, HEALTH_EVENTS_TABLE_NAME,
-        EVENT_DETAILS_TABLE_NAME, AFFECTED_ACCOUNTS_TABLE_NAME, AFFECTED_ENTITIES_TABLE_NAME)  
+        EVENT_DETAILS_TABLE_NAME, AFFECTED_ACCOUNTS_TABLE_NAME, AFFECTED_ENTITIES_TABLE_NAME,
+        DATA_GENERATION_KEY)
         
 
 # 初始化 DynamoDB 客户端
@@ -31,9 +46,15 @@ affected_entities_table = dynamodb.Table(AFFECTED_ENTITIES_TABLE_NAME)
 
 # 初始化 STS 客户端
 sts_client = boto3.client('sts')
+sqs_client = boto3.client('sqs')
 
 LOOKBACK_DAYS = int(os.environ.get('LOOKBACK_DAYS', '90'))
 
+# 新拉取到的这些类别的事件会放入解读队列，由 query_bedrock 的 worker_handler 预先生成解读。
+# 没有配置队列时不预生成
+INTERPRETATION_QUEUE_URL = os.environ.get('INTERPRETATION_QUEUE_URL', '')
+PRE_INTERPRET_CATEGORIES = ('issue', 'accountNotification')
+
 def get_assumed_role_credentials(account_id, role_name):
     """获取指定账户的临时凭证。"""
     assumed_role = sts_client.assume_role(
@@ -128,61 +149,18 @@ def fetch_affected_entities(health_client, affected_accounts):
     cost_time = time.time() - start_time
     return affected_entities, cost_time
 
-def convert_datetime_to_string(obj):
-    """
-    递归地将 datetime 对象转换为字符串。
-    """
-    if isinstance(obj, dict):
-        for key, value in obj.items():
-            if isinstance(value, datetime):
-                obj[key] = value.isoformat()  # 转换为 ISO 格式的字符串
-            elif isinstance(value, (dict, list)):
-                convert_datetime_to_string(value)
-    elif isinstance(obj, list):
-        for index, value in enumerate(obj):
-            if isinstance(value, datetime):
-                obj[index] = value.isoformat()
-            elif isinstance(value, (dict, list)):
-                convert_datetime_to_string(value)
-    elif isinstance(obj, datetime):
-        return obj.isoformat()
-    
-    return obj
-
-def insert_events(events, account_id, expiration_time):
-    start_time = time.time()
-    events_count = 0
-    
-    # API文档
-    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/health/client/describe_events_for_organization.html
-    with events_table.batch_writer() as batch:
-        for event in events:
-            item = {
-                'AccountId': account_id, # 分区键
-                'EventArn': event['arn'], # 排序键
-                'Service': event['service'],
-                'EventTypeCode': event['eventTypeCode'],
-                'EventTypeCategory': event['eventTypeCategory'],
-                'EventScopeCode': event['eventScopeCode'],
-                'Region': event['region'],
-                'AvailabilityZone': event.get('availabilityZone', ''),
-                'StartTime': convert_datetime_to_string(event['startTime']),
-                'EndTime': convert_datetime_to_string(event.get('endTime', '')),
-                'LastUpdatedTime': convert_datetime_to_string(event['lastUpdatedTime']),
-                'StatusCode': event['statusCode'],
-                 # 表示这个item过期的时间（dynamodb会自动清除）， 通过enable_ttl注册这个字段
-                'ExpirationTime': expiration_time
-            }
-            batch.put_item(Item=item)
-            events_count += 1
-
-    cost_time = time.time() - start_time
-    print(f"Inserted {events_count} events into DynamoDB for management account {account_id} in {cost_time:.2f} seconds.")
-    return events_count
+def get_previous_details(event_arns):
+    """读取写入前的事件详情(只取全文索引需要的字段)，用于删除描述变化后不再出现的词项。"""
+    projection_names = {f'#f{index}': field for index, field in enumerate(('StartTime', 'LatestDescription') + METADATA_FIELDS)}
+    items = batch_get_all(EVENT_DETAILS_TABLE_NAME, [{'EventArn': arn} for arn in event_arns],
+                          projection=', '.join(['EventArn'] + list(projection_names)),
+                          expression_attribute_names=projection_names)
+    return {item['EventArn']: item for item in items}
 
-def insert_event_details(event_details):
+def insert_event_details(event_details, account_id, expiration_time, previous_items):
     start_time = time.time()
     event_details_count = 0
+    items = []
 
     # API文档
     # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/health/client/describe_event_details_for_organization.html
@@ -211,15 +189,21 @@ def insert_event_details(event_details):
                 'EventMetadata': event_metadata,  # 这里直接存储整个 eventMetadata 字典
             }
             batch.put_item(Item=item)
+            items.append(item)
             event_details_count += 1
 
     cost_time = time.time() - start_time
     print(f"Inserted {event_details_count} event details into DynamoDB in {cost_time:.2f} seconds.")
+
+    # 维护事件描述的全文索引(供 search_events 查询)
+    index_event_details(account_id, items, expiration_time, previous_items)
     return event_details_count
 
-def insert_affected_accounts(affected_accounts):
+def insert_affected_accounts(affected_accounts, account_id, events):
     start_time = time.time()
     affected_accounts_count = 0
+    # 反向索引(MemberAccountIndex)需要事件的开始时间和所属的管理账户
+    event_start_times = {event['arn']: convert_datetime_to_string(event['startTime']) for event in events}
 
     # API文档
     # https://boto3.amazonaws.com/v1/documentation/api/1.26.93/reference/services/health/client/describe_affected_accounts_for_organization.html
@@ -227,7 +211,9 @@ def insert_affected_accounts(affected_accounts):
         for account in affected_accounts:
             item = {
                 'EventArn': account['eventArn'], # 分区键
-                'AccountId': account['awsAccountId'] # 排序键
+                'AccountId': account['awsAccountId'], # 排序键
+                'ManagementAccountId': account_id,
+                'StartTime': event_start_times[account['eventArn']]
             }
             batch.put_item(Item=item)
             affected_accounts_count += 1
@@ -236,10 +222,39 @@ def insert_affected_accounts(affected_accounts):
     print(f"Inserted {affected_accounts_count} affected accounts into DynamoDB in {cost_time:.2f} seconds.")
     return affected_accounts_count
 
-def insert_affected_entities(affected_entities):
+def get_previous_entities(event_arns):
+    """读取写入前的受影响实体，转换成 Health API 返回的格式(用于删除旧的标签索引条目)。"""
+    entities = []
+    for event_arn in event_arns:
+        query_kwargs = {'KeyConditionExpression': Key('EventArn').eq(event_arn)}
+        while True:
+            response = affected_entities_table.query(**query_kwargs)
+            entities.extend({
+                'eventArn': item['EventArn'],
+                'awsAccountId': item.get('AccountId'),
+                'entityArn': item.get('EntityId', ''),
+                'entityValue': item.get('EntityValue', ''),
+                'tags': item.get('Tags', {})
+            } for item in response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                break
+            query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return entities
+
+def insert_affected_entities(affected_entities, account_id, events, expiration_time, previous_details):
     start_time = time.time()
     affected_entities_count = 0
 
+    # 标签索引的排序键以 StartTime 开头：StartTime 变化的事件(比如重新安排的计划内变更)，
+    # 在覆盖受影响实体之前读出旧的实体，用来删除旧 StartTime 下的标签索引条目
+    events_by_arn = {event['arn']: event for event in events}
+    previous_events_by_arn = {
+        arn: {'startTime': item['StartTime']} for arn, item in previous_details.items()
+        if arn in events_by_arn and item.get('StartTime')
+        and item['StartTime'] != convert_datetime_to_string(events_by_arn[arn]['startTime'])
+    }
+    previous_entities = get_previous_entities(previous_events_by_arn)
+
     # API文档
     # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/health/client/describe_affected_entities_for_organization.html
     with affected_entities_table.batch_writer() as batch:
@@ -260,6 +275,11 @@ def insert_affected_entities(affected_entities):
 
     cost_time = time.time() - start_time
     print(f"Inserted {affected_entities_count} affected entities into DynamoDB in {cost_time:.2f} seconds.")
+
+    # 维护资源 -> 事件的反向索引和标签索引(供 query_events_by_resource、query_events_by_tags 查询)
+    index_affected_entities(affected_entities, account_id, events_by_arn, expiration_time)
+    index_entity_tags(affected_entities, account_id, events_by_arn, expiration_time, previous_entities,
+                      previous_events_by_arn)
     return affected_entities_count
 
 def update_last_event_time(account_id, events):
@@ -270,22 +290,70 @@ def update_last_event_time(account_id, events):
         ExpressionAttributeValues={':val': latest_event_time}
     )
 
-def update_dynamodb(account_id, events, event_details, affected_accounts, affected_entities):
+def update_last_sync_time(account_id, sync_time):
+    accounts_table.update_item(
+        Key={'AccountId': account_id},
+        UpdateExpression='SET LastSyncTime = :val',
+        ExpressionAttributeValues={':val': sync_time.isoformat()}
+    )
+
+def queue_interpretations(events):
+    """
+    把新事件中需要预生成解读的事件放入解读队列。
+
+    入队失败不影响事件的写入，用户打开事件时仍然会按需生成解读。
+
+    返回:
+    int: 成功入队的事件数
+    """
+    if not INTERPRETATION_QUEUE_URL:
+        return 0
+
+    event_arns = [event['arn'] for event in events if event['eventTypeCategory'] in PRE_INTERPRET_CATEGORIES]
+    queued = 0
+    for i in range(0, len(event_arns), 10):  # SendMessageBatch 每次最多 10 条消息
+        entries = [{'Id': str(index), 'MessageBody': json.dumps({'event_arn': arn})}
+                   for index, arn in enumerate(event_arns[i:i+10])]
+        try:
+            response = sqs_client.send_message_batch(QueueUrl=INTERPRETATION_QUEUE_URL, Entries=entries)
+        except ClientError as e:
+            print(f"Failed to queue interpretations: {e}")
+            continue
+        queued += len(response.get('Successful', []))
+        for failed in response.get('Failed', []):
+            print(f"Failed to queue interpretation: {failed}")
+
+    print(f"Queued {queued} of {len(event_arns)} new events for pre-interpretation")
+    return queued
+
+def update_dynamodb(account_id, events, event_details, affected_accounts, affected_entities, shard_config=None):
     """将健康事件及其详细信息写入 DynamoDB。"""
 
     if not events:
         return 0, 0, 0, 0
 
-    expiration_time = int((datetime.now(timezone.utc) + timedelta(days=LOOKBACK_DAYS)).timestamp())
+    expiration_time = get_expiration_time()
     start_time = time.time()
 
-    events_count = insert_events(events, account_id, expiration_time)
-    event_details_count = insert_event_details(event_details)
-    affected_accounts_count = insert_affected_accounts(affected_accounts)
-    affected_entities_count = insert_affected_entities(affected_entities)
+    # 覆盖之前读出旧的事件详情，全文索引和标签索引据此删除不再有效的条目
+    previous_details = get_previous_details([detail['event']['arn'] for detail in event_details])
+
+    # 写入事件，并增量维护汇总计数
+    events_count, new_events = write_events_with_rollups(events, account_id, shard_config)
+    event_details_count = insert_event_details(event_details, account_id, expiration_time, previous_details)
+    affected_accounts_count = insert_affected_accounts(affected_accounts, account_id, events)
+    affected_entities_count = insert_affected_entities(affected_entities, account_id, events, expiration_time,
+                                                       previous_details)
+
+    # 详情和受影响实体都写入之后再入队，worker 读取的是完整的数据
+    queue_interpretations(new_events)
 
     update_last_event_time(account_id, events)
 
+    # 数据已更新，数据版本号加一，使查询侧的结果缓存失效
+    generation = bump_data_generation(accounts_table)
+    print(f"Bumped data generation to {generation}")
+
     total_cost_time = time.time() - start_time
     print(f"Updated DynamoDB for management account {account_id} in {total_cost_time:.2f} seconds. "
           f"Events: {events_count}, Details: {event_details_count}, "
@@ -296,9 +364,14 @@ def update_dynamodb(account_id, events, event_details, affected_accounts, affect
 def get_registered_accounts():
     """从 DynamoDB 中获取所有已注册的管理账户 ID 及其角色名称。"""
     response = accounts_table.scan()
-    accounts = response.get('Items', [])
+    # 跳过存放数据版本号的特殊条目
+    accounts = [item for item in response.get('Items', []) if item['AccountId'] != DATA_GENERATION_KEY]
     print(f"Retrieved {len(accounts)} registered accounts: {[account['AccountId'] for account in accounts]}")
-    return [{'AccountId': account['AccountId'], 'RoleName': account['CrossAccountRole']} for account in accounts]
+    return [{'AccountId': account['AccountId'],
+             'RoleName': account['CrossAccountRole'],
+             'ShardConfig': get_shard_config(account),
+             'LastSyncTime': datetime.fromisoformat(account['LastSyncTime']) if account.get('LastSyncTime') else None}
+            for account in accounts]
 
 def get_last_event_times():
     """获取所有账户的最后一个健康事件的时间。"""
@@ -308,6 +381,8 @@ def get_last_event_times():
 
     for item in items:
         account_id = item['AccountId']
+        if account_id == DATA_GENERATION_KEY:
+            continue
         last_event_time = item.get('LastEventTime')
         if last_event_time:
             last_event_times[account_id] = datetime.fromisoformat(last_event_time)
@@ -363,6 +438,15 @@ def fetch_and_update_health_events(accounts, start_time, end_time):
         # 拉取该管理帐号下的所有健康事件
         events = fetch_health_events(health_client, last_event_time, end_time)
         print(f"Fetched {len(events)} events for management account {account} from {last_event_time} to {end_time}")
+
+        # 开始时间早于 LastEventTime、但上次同步之后更新过的事件(比如状态变成 closed)也要重新拉取，
+        # 这样 LastSyncTime 之前的所有更新都已经写入表中，混合模式只需要从 API 拉取之后的更新
+        last_sync_time = account.get('LastSyncTime')
+        if last_sync_time:
+            updated_events = fetch_health_events(health_client, start_time, end_time,
+                                                 {'lastUpdatedTime': {'from': last_sync_time, 'to': end_time}})
+            print(f"Fetched {len(updated_events)} events updated since {last_sync_time} for management account {account_id}")
+            events = list({event['arn']: event for event in events + updated_events}.values())
         
         if events:
             event_arns = [event['arn'] for event in events]
@@ -384,7 +468,8 @@ def fetch_and_update_health_events(accounts, start_time, end_time):
             event_details_count, \
             affected_accounts_count, \
             affected_entities_count = \
-                update_dynamodb(account_id, events, event_details, affected_accounts, affected_entities)
+                update_dynamodb(account_id, events, event_details, affected_accounts, affected_entities,
+                                account.get('ShardConfig'))
             
             print(f"Fetched and stored health events, details, accounts, and entities for management account {account_id}")
 
@@ -397,6 +482,9 @@ def fetch_and_update_health_events(accounts, start_time, end_time):
             if earliest_event_time is None or account_earliest_event_time < earliest_event_time:
                 earliest_event_time = account_earliest_event_time
 
+        # 记录同步水位，query_health_events 的混合模式只需要从 API 拉取这之后更新过的事件
+        update_last_sync_time(account_id, end_time)
+
     end = time.time()
     print(f"fetch_and_update_health_events cost {end-start:.2f}s for {len(accounts)} management accounts")
 
@@ -6,50 +6,22 @@ import boto3
 # try...except... 这种技巧
 try:
     # 本地开发时使用
-    from common.utils import create_response, parse_event
-    from common.constants import ACCOUNTS_TABLE_NAME, AFFECTED_ACCOUNTS_TABLE_NAME
+    from common.utils import create_response, parse_event, etag_matches, not_modified_response
+    from common.cache import compute_etag, get_data_generation
+    from common.event_queries import get_affected_accounts
+    from common.constants import ACCOUNTS_TABLE_NAME
 except ImportError:
     # 部署到 Lambda 时使用
-    from utils import create_response, parse_event
-    from constants import ACCOUNTS_TABLE_NAME, AFFECTED_ACCOUNTS_TABLE_NAME
+    from utils import create_response, parse_event, etag_matches, not_modified_response
+    from cache import compute_etag, get_data_generation
+    from event_queries import get_affected_accounts
+    from constants import ACCOUNTS_TABLE_NAME
 
 
 # 初始化 DynamoDB 客户端
 dynamodb = boto3.resource('dynamodb')
-dynamodb_client = boto3.client('dynamodb')
 accounts_table = dynamodb.Table(ACCOUNTS_TABLE_NAME)
-affected_accounts_table = dynamodb.Table(AFFECTED_ACCOUNTS_TABLE_NAME)
 
-def get_affected_accounts(event_arns):
-    """
-    根据给定的事件ARN列表，从DynamoDB中查询相关的受影响账户。
-
-    参数:
-    event_arns (list): 事件ARN的列表
-
-    返回:
-    dict: 包含事件ARN和相关的受影响账户ID列表的字典
-    """
-    affected_accounts_dict = {}
-
-    for arn in event_arns:
-        try:
-            # 查询指定的 EventArn 相关的所有 AccountId
-            response = affected_accounts_table.query(
-                KeyConditionExpression=boto3.dynamodb.conditions.Key('EventArn').eq(arn)
-            )
-
-            # 获取所有相关的 AccountId 并存储在字典中
-            accounts = [item['AccountId'] for item in response.get('Items', [])]
-            affected_accounts_dict[arn] = accounts
-
-            print(f"Fetched {len(accounts)} accounts for EventArn: {arn}")
-
-        except Exception as e:
-            print(f"Error fetching accounts for EventArn {arn}: {str(e)}")
-            affected_accounts_dict[arn] = []
-
-    return affected_accounts_dict
 
 def lambda_handler(event, context):
     """
@@ -68,6 +40,8 @@ def lambda_handler(event, context):
         }
         
         - event_arns: (必需) 字符串列表，表示事件的唯一标识符。如果提供，则查询这些事件影响的所有账户。
+        - counts_only: (可选) 为 true 时只返回每个事件影响的账户数(放在 affected_account_counts 中)，
+          适合列表页展示"影响 N 个账户"。
         
         - 这个列表中的每个 ARN 对应 DynamoDB 表中的 EventArn 分区键。
         - 对于每个 EventArn，系统会查询相关的受影响账户（AccountId），并返回这些账户的列表。
@@ -77,7 +51,7 @@ def lambda_handler(event, context):
     返回:
     dict: 包含状态码、消息以及查询结果或错误的响应。
     """
-    # 解析事件
+    # 解析事件(event 保留原始事件，用于读取 Accept-Encoding 请求头)
     parsed_event = parse_event(event)
     print("Parsed event:", json.dumps(parsed_event, indent=2))
 
@@ -88,9 +62,20 @@ def lambda_handler(event, context):
         print("Error: 'event_arns' is empty.")
         return create_response(400, "错误: 'event_arns' 不能为空。")
 
+    counts_only = bool(parsed_event.get('counts_only', False))
+
+    # 数据没有更新且客户端已有相同的数据时，不查询数据库直接返回304
+    etag = compute_etag(get_data_generation(accounts_table), 'affected_accounts', set(event_arns), counts_only)
+    if etag_matches(event, etag):
+        print(f"ETag {etag} matched, returning 304")
+        return not_modified_response(etag)
+
     # 查询受影响的账户
-    affected_accounts = get_affected_accounts(event_arns)
+    affected_accounts, failed_event_arns = get_affected_accounts(event_arns, counts_only)
+    result_key = "affected_account_counts" if counts_only else "affected_accounts"
 
-    # 返回最终响应
+    # 返回最终响应(有查询失败的事件时不带 ETag，客户端下次重新请求)
     return create_response(200, "Affected accounts retrieved successfully.", 
-                           {"affected_accounts": affected_accounts})
\ No newline at end of file
+                           {result_key: affected_accounts, "failed_event_arns": failed_event_arns},
+                           request_event=event,
+                           etag=None if failed_event_arns else etag)
\ No newline at end of file
@@ -1,9 +1,14 @@
+import hashlib
 import json
 import os
+import random
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
-from botocore.exceptions import ClientError
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 
 
 # 在deploy/data_collection/cdk_infra/backend_stack.py中把common/打包为
@@ -12,13 +17,69 @@ from botocore.exceptions import ClientError
 try:
     # 本地开发时使用
     from common.utils import create_response, parse_event
+    from common.interpretations import get_interpretation, put_interpretation
+    from common.event_queries import fetch_event_details, query_affected_entities
+    from common.rate_limit import TokenBucket
+    from common.cache import SingleFlight
+    from common.constants import NAME_PREFIX
 except ImportError:
     # 部署到 Lambda 时使用
     from utils import create_response, parse_event
+    from interpretations import get_interpretation, put_interpretation
+    from event_queries import fetch_event_details, query_affected_entities
+    from rate_limit import TokenBucket
+    from cache import SingleFlight
+    from constants import NAME_PREFIX
 
 DEFAULT_MODEL = "anthropic.claude-3-5-sonnet-20240620-v1:0"
 aws_region = os.environ.get("AWS_REGION", "us-west-2")
 
+# Bedrock 客户端在模块级创建，热启动时复用连接。重试由 call_with_fallback 处理(带抖动，并且可以切换到备用模型)，
+# 所以关闭 botocore 自己的重试；长回答的生成时间可能超过默认 60 秒的读超时。
+# 读超时要小于函数的超时：预生成解读的 worker 一次处理多条消息，部署时设置更短的 BEDROCK_READ_TIMEOUT
+BEDROCK_READ_TIMEOUT = int(os.environ.get('BEDROCK_READ_TIMEOUT', '300'))
+bedrock = boto3.client(service_name="bedrock-runtime", region_name=aws_region,
+                       config=Config(read_timeout=BEDROCK_READ_TIMEOUT,
+                                     retries={'mode': 'standard', 'total_max_attempts': 1}))
+
+# 可重试的错误：每个模型最多重试 BEDROCK_MAX_RETRIES 次(指数退避 + 随机抖动)，
+# 仍然失败时依次尝试 BEDROCK_FALLBACK_MODELS 中的备用模型(逗号分隔，如 sonnet 之后用 haiku)
+RETRYABLE_ERROR_CODES = {'ThrottlingException', 'ServiceUnavailableException', 'ModelNotReadyException',
+                         'InternalServerException'}
+BEDROCK_MAX_RETRIES = int(os.environ.get('BEDROCK_MAX_RETRIES', '2'))
+BEDROCK_RETRY_BASE_DELAY = float(os.environ.get('BEDROCK_RETRY_BASE_DELAY', '0.5'))
+BEDROCK_RETRY_MAX_DELAY = 4.0
+BEDROCK_FALLBACK_MODELS = [model.strip() for model in
+                           os.environ.get('BEDROCK_FALLBACK_MODELS', 'anthropic.claude-3-haiku-20240307-v1:0').split(',')
+                           if model.strip()]
+
+# 同一个容器内并发的相同调用(相同模型和请求体)只调用一次模型
+model_calls = SingleFlight()
+
+# Prompt 模板或者解读的输入发生变化时加一，使 BedrockInterpretations 表中旧的解读不再命中
+PROMPT_VERSION = '2'
+
+# Prompt 的 token 预算：受影响实体部分最多使用的 token 数，以及给模型输出预留的 token 数
+ENTITY_TOKEN_BUDGET = int(os.environ.get('ENTITY_TOKEN_BUDGET', '4000'))
+MAX_OUTPUT_TOKENS = 2000
+# 没有标明上下文长度(:18k、:200k 等)的模型按 200k 计算
+DEFAULT_CONTEXT_TOKENS = 200000
+# 实体过多时按类型和区域分组，每组列出的示例数
+SAMPLES_PER_GROUP = 3
+
+# 预生成解读的 worker(worker_handler)：每个实例内并发处理的消息数，以及每个实例每分钟最多调用模型的次数。
+# Bedrock 的配额是整个账户共享的，INTERPRETATION_RATE_PER_MINUTE 应该设置为 配额 / worker 的预留并发数
+INTERPRETATION_WORKER_CONCURRENCY = int(os.environ.get('INTERPRETATION_WORKER_CONCURRENCY', '2'))
+INTERPRETATION_RATE_PER_MINUTE = float(os.environ.get('INTERPRETATION_RATE_PER_MINUTE', '10'))
+# 等待令牌的最长时间(秒)，超过后让消息回到队列稍后重试
+INTERPRETATION_TOKEN_TIMEOUT = float(os.environ.get('INTERPRETATION_TOKEN_TIMEOUT', '60'))
+interpretation_rate_limiter = TokenBucket(rate=INTERPRETATION_RATE_PER_MINUTE / 60,
+                                          capacity=INTERPRETATION_WORKER_CONCURRENCY)
+# 处理一条消息最长需要的时间(毫秒)：等待令牌，加上每次尝试的读超时和退避。
+# 函数剩下的时间不够时不再开始新的消息，直接让它回到队列，避免整批消息因为函数超时一起重试
+INTERPRETATION_MESSAGE_BUDGET_MS = int((INTERPRETATION_TOKEN_TIMEOUT + (BEDROCK_MAX_RETRIES + 1) *
+                                        (BEDROCK_READ_TIMEOUT + BEDROCK_RETRY_MAX_DELAY)) * 1000)
+
 # Prompt 模板
 HE_PROMPT = """
 你是一个AWS Health Event的解读专家。
@@ -52,22 +113,210 @@ def replace_account_in_arn(prompt):
     arn_regex = re.compile(r'(arn:aws:[a-z0-9\-]+:[a-z0-9\-]*:)([0-9]+)(:[a-z0-9\-:/]*)')
     return arn_regex.sub(r'\1ACCOUNT\3', prompt)
 
-def interpret_health_event(event_desc, affected_entities, model_id=DEFAULT_MODEL):
+def normalize_description(event_desc):
+    """合并空白、去掉 ARN 中的账户ID，内容相同的描述得到相同的缓存键。"""
+    return replace_account_in_arn(' '.join(str(event_desc or '').split()))
+
+def normalize_entities(affected_entities):
+    """
+    规整受影响实体：去掉 ARN 中的账户ID后去重、排序。
+
+    不同成员账户中的同一类资源对解读来说是一样的，去重后 Prompt 更短，也更容易命中缓存。
+    """
+    if not isinstance(affected_entities, list):
+        affected_entities = [affected_entities] if affected_entities else []
+    entities = {
+        replace_account_in_arn(entity if isinstance(entity, str) else json.dumps(entity, sort_keys=True, default=str))
+        for entity in affected_entities if entity
+    }
+    return sorted(entities)
+
+def interpretation_cache_key(event_desc, entities, model_id):
+    """解读缓存的键：规整后的描述、实体、模型和 Prompt 版本的哈希。"""
+    payload = json.dumps([event_desc, entities, model_id, PROMPT_VERSION], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def estimate_tokens(text):
+    """
+    粗略估计文本的 token 数：ASCII 字符约 4 个一个 token，中文等其它字符约 1 个一个 token。
+    只用于预算，宁可略微高估。
+    """
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+def model_context_tokens(model_id):
+    """模型ID后缀中的上下文长度(如 :18k)，没有后缀时为 DEFAULT_CONTEXT_TOKENS。"""
+    match = re.search(r':(\d+)k$', model_id)
+    return int(match.group(1)) * 1000 if match else DEFAULT_CONTEXT_TOKENS
+
+def select_model_variant(model_id, prompt_tokens):
+    """
+    选择能放下 Prompt 和输出的最小上下文的模型变体。
+
+    只在同一个模型的变体之间选择，请求的变体够用时不变；都放不下时返回上下文最大的变体。
+    """
+    base_model = re.sub(r':\d+k$', '', model_id)
+    variants = sorted((model_context_tokens(variant), variant) for variant in get_available_models()
+                      if re.sub(r':\d+k$', '', variant) == base_model)
+    required = prompt_tokens + MAX_OUTPUT_TOKENS
+    if model_context_tokens(model_id) >= required:
+        return model_id
+    for context_tokens, variant in variants:
+        if context_tokens >= required:
+            return variant
+    return variants[-1][1] if variants else model_id
+
+def entity_group(entity):
+    """
+    实体的分组：ARN 按 (服务, 资源类型, 区域)，其它标识按资源ID的前缀(如 i-0abc1234 的 i)。
+    """
+    if entity.startswith('arn:'):
+        parts = entity.split(':', 5)
+        if len(parts) == 6:
+            _, _, service, region, _, resource = parts
+            resource_type = re.split(r'[/:]', resource, 1)[0] if re.search(r'[/:]', resource) else ''
+            return ' '.join(part for part in (service, resource_type, region or 'global') if part)
+    match = re.match(r'^([a-z]+)-[0-9a-f]{8,}$', entity)
+    return match.group(1) if match else 'other'
+
+def sample_evenly(items, count):
+    """从有序的列表中均匀地取 count 个元素(包括首尾)，结果是确定的，方便缓存。"""
+    if len(items) <= count:
+        return list(items)
+    if count == 1:
+        return [items[0]]
+    step = (len(items) - 1) / (count - 1)
+    return [items[round(i * step)] for i in range(count)]
+
+def format_entity_groups(entities, samples_per_group, max_groups=None):
+    groups = {}
+    for entity in entities:
+        groups.setdefault(entity_group(entity), []).append(entity)
+    ordered = sorted(groups.items(), key=lambda group: (-len(group[1]), group[0]))
+    shown = ordered if max_groups is None else ordered[:max_groups]
+
+    lines = [f"共 {len(entities)} 个受影响资源，按类型和区域分为 {len(groups)} 组(每组列出部分示例)："]
+    for name, members in shown:
+        samples = ', '.join(sample_evenly(members, samples_per_group))
+        lines.append(f"- {name}: {len(members)} 个，例如 {samples}")
+    if len(shown) < len(ordered):
+        rest = ordered[len(shown):]
+        lines.append(f"- 其余 {len(rest)} 组共 {sum(len(members) for _, members in rest)} 个资源")
+    return '\n'.join(lines)
+
+def build_entities_text(entities, budget):
+    """
+    在 token 预算内描述受影响实体。
+
+    放得下时逐个列出；否则按类型和区域分组，列出每组的数量和均匀抽取的示例，
+    仍然放不下时依次减少示例数和分组数。
+    """
+    text = '\n'.join(entities)
+    if estimate_tokens(text) <= budget:
+        return text
+
+    for samples_per_group in range(SAMPLES_PER_GROUP, 0, -1):
+        text = format_entity_groups(entities, samples_per_group)
+        if estimate_tokens(text) <= budget:
+            return text
+
+    max_groups = len({entity_group(entity) for entity in entities})
+    while max_groups > 1:
+        max_groups //= 2
+        text = format_entity_groups(entities, 1, max_groups)
+        if estimate_tokens(text) <= budget:
+            break
+    return text
+
+def build_prompt(event_desc, entities, model_id):
+    """
+    按 token 预算生成 Prompt，并选择能放下它的模型变体。
+
+    返回:
+    tuple: (Prompt, 实际使用的模型ID)
+    """
+    resource = f"<Resources>\n{build_entities_text(entities, ENTITY_TOKEN_BUDGET)}\n</Resources>"
+    prompt = HE_PROMPT.format(health_event=event_desc, resource=resource)
+    prompt_tokens = estimate_tokens(prompt)
+    selected_model = select_model_variant(model_id, prompt_tokens)
+    print(f"Prompt: {len(entities)} entities, ~{prompt_tokens} tokens, model {selected_model}")
+    return prompt, selected_model
+
+def prepare_interpretation(event_desc, affected_entities, model_id):
+    """
+    规整解读的输入，按 token 预算生成 Prompt。
+
+    缓存键使用完整的实体列表和请求的模型，和实际选择的模型变体无关。
+
+    返回:
+    tuple: (Prompt, 缓存键, 实际使用的模型ID)
+    """
+    event_desc = normalize_description(event_desc)
+    entities = normalize_entities(affected_entities)
+    prompt, selected_model = build_prompt(event_desc, entities, model_id)
+    return prompt, interpretation_cache_key(event_desc, entities, model_id), selected_model
+
+def read_cached_interpretation(cache_key):
+    """读取缓存的解读，缓存不可用时返回 None(仍然调用模型)。"""
+    try:
+        cached = get_interpretation(cache_key)
+    except (BotoCoreError, ClientError) as e:
+        print(f"Failed to read interpretation cache: {e}")
+        return None
+    if cached is not None:
+        print(f"Interpretation cache hit: {cache_key}")
+    return cached
+
+def save_interpretation(cache_key, result, model_id):
+    try:
+        put_interpretation(cache_key, result, model_id, PROMPT_VERSION)
+    except (BotoCoreError, ClientError) as e:
+        print(f"Failed to write interpretation cache: {e}")
+
+def load_event_inputs(event_arn):
+    """
+    从数据库读取一个事件的解读输入：最新的描述和受影响实体的标识。
+
+    预生成的 worker 和带 event_arn 的请求使用同样的输入，所以会命中同一个缓存。
+
+    异常:
+    LookupError: 事件详情不存在
+    """
+    event_details, _ = fetch_event_details([event_arn])
+    if not event_details:
+        raise LookupError(f"Event details not found: {event_arn}")
+    entities = [entity['EntityValue'] for entity in query_affected_entities([{'EventArn': event_arn}])
+                if entity.get('EntityValue')]
+    return event_details[0]['latest_description'], entities
+
+def interpret_health_event(event_desc, affected_entities, model_id=DEFAULT_MODEL, refresh=False):
     """
     使用 Claude 模型生成健康事件的摘要和行动建议。
+
+    相同输入的解读保存在 BedrockInterpretations 表中，之后的请求直接返回缓存的结果。
     
     参数:
     event_desc (str): 健康事件的描述。
     affected_entities (list): 受影响的实体列表。
     model_id (str): 使用的模型ID。
+    refresh (bool): 是否忽略缓存重新生成。
 
     返回:
-    str: 模型生成的结果。
+    tuple: (模型生成的结果或错误信息, 成功与否, 是否来自缓存, 模型调用的指标(来自缓存时为空))
     """
-    prompt = HE_PROMPT.format(health_event=event_desc, resource=affected_entities)
-    prompt = replace_account_in_arn(prompt)
-    result = invoke_claude_model(prompt, model_id=model_id)
-    return result
+    model_id = model_id or DEFAULT_MODEL
+    prompt, cache_key, selected_model = prepare_interpretation(event_desc, affected_entities, model_id)
+
+    if not refresh:
+        cached = read_cached_interpretation(cache_key)
+        if cached is not None:
+            return cached, True, True, {}
+
+    result, ok, metrics = invoke_claude_model(prompt, model_id=selected_model)
+    # 备用模型生成的解读只返回给这次请求，不写入缓存
+    if ok and not metrics.get('fallback'):
+        save_interpretation(cache_key, result, selected_model)
+    return result, ok, False, metrics
 
 def get_available_models():
     """
@@ -86,11 +335,93 @@ def get_available_models():
         "anthropic.claude-3-5-sonnet-20240620-v1:0"
     ]
 
+def build_claude_body(query, max_token=2000, temperature=None, top_p=None, top_k=None):
+    """生成 Claude Messages API 的请求体。"""
+    messages = [{"role": 'user', "content": [{'type': 'text', 'text': query}]}]
+    body = {
+        "messages": messages,
+        "max_tokens": max_token,
+        "anthropic_version": "bedrock-2023-05-31",
+    }
+    if temperature is not None:
+        body['temperature'] = temperature
+    if top_p is not None:
+        body['top_p'] = top_p
+    if top_k is not None:
+        body['top_k'] = top_k
+    return body
+
+def fallback_chain(model_id, allow_fallback=True):
+    """依次尝试的模型：请求的模型，然后是不同于它的备用模型。"""
+    if not allow_fallback:
+        return [model_id]
+    return [model_id] + [model for model in BEDROCK_FALLBACK_MODELS if model != model_id]
+
+def call_with_fallback(model_id, call, allow_fallback=True):
+    """
+    按 fallback_chain 依次调用 call(模型ID)。可重试的错误带抖动重试，重试用完后换下一个模型。
+
+    返回:
+    tuple: (call 的返回值, 实际使用的模型ID, 总尝试次数)
+
+    异常:
+    ClientError: 不可重试的错误，或者所有模型都失败时的最后一个错误
+    """
+    attempts = 0
+    last_error = None
+    for model in fallback_chain(model_id, allow_fallback):
+        for retry in range(BEDROCK_MAX_RETRIES + 1):
+            attempts += 1
+            try:
+                return call(model), model, attempts
+            except ClientError as e:
+                error_code = e.response['Error']['Code']
+                if error_code not in RETRYABLE_ERROR_CODES:
+                    raise
+                last_error = e
+                print(f"{error_code} from {model}, attempt {retry + 1}")
+                if retry < BEDROCK_MAX_RETRIES:
+                    time.sleep(random.uniform(0, min(BEDROCK_RETRY_MAX_DELAY, BEDROCK_RETRY_BASE_DELAY * (2 ** retry))))
+    raise last_error
+
+def report_model_metrics(metrics):
+    """
+    以 CloudWatch 嵌入式指标格式(EMF)打印一次模型调用的指标，
+    CloudWatch 会按模型ID统计延迟、token 数、尝试次数和备用模型的使用次数。
+    """
+    print(json.dumps({
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": f"{NAME_PREFIX}/Bedrock",
+                "Dimensions": [["ModelId"]],
+                "Metrics": [
+                    {"Name": "LatencyMs", "Unit": "Milliseconds"},
+                    {"Name": "InputTokens", "Unit": "Count"},
+                    {"Name": "OutputTokens", "Unit": "Count"},
+                    {"Name": "Attempts", "Unit": "Count"},
+                    {"Name": "Fallback", "Unit": "Count"},
+                ]
+            }]
+        },
+        "ModelId": metrics['model_id'],
+        "RequestedModelId": metrics['requested_model_id'],
+        "LatencyMs": metrics['latency_ms'],
+        "InputTokens": metrics['input_tokens'],
+        "OutputTokens": metrics['output_tokens'],
+        "Attempts": metrics['attempts'],
+        "Fallback": int(metrics['fallback']),
+    }))
+
 # 主函数
-def invoke_claude_model(query, model_id=DEFAULT_MODEL, max_token=2000, temperature=None, top_p=None, top_k=None):
+def invoke_claude_model(query, model_id=DEFAULT_MODEL, max_token=2000, temperature=None, top_p=None, top_k=None,
+                        allow_fallback=True):
     """
     调用Claude模型并返回结果。
 
+    可重试的错误(限流等)带抖动重试，仍然失败时切换到备用模型(见 call_with_fallback)。
+    同一个容器内并发的相同调用只调用一次模型。
+
     参数:
     query (str): 用户输入的查询文本。
     model_id (str): 使用的模型ID，默认为DEFAULT_MODEL。
@@ -98,48 +429,123 @@ def invoke_claude_model(query, model_id=DEFAULT_MODEL, max_token=2000, temperatu
     temperature (float, optional): 生成文本时使用的温度参数。
     top_p (float, optional): nucleus采样的top-p值。
     top_k (int, optional): top-k采样的top-k值。
+    allow_fallback (bool): 是否允许切换到备用模型。
 
     返回:
     str: Claude模型生成的文本应答或错误信息
     boolen: 成功与否
+    dict: 本次调用的指标(实际使用的模型、延迟、token 数、尝试次数、是否使用了备用模型)，失败时包含 error_code
     """
-    bedrock = boto3.client(service_name="bedrock-runtime", region_name=aws_region)
+    model_id = model_id or DEFAULT_MODEL
+    body = json.dumps(build_claude_body(query, max_token, temperature, top_p, top_k))
 
-    if not model_id:
-        model_id = DEFAULT_MODEL
-
-    messages = [{"role": 'user', "content": [{'type': 'text', 'text': query}]}]
-    body = {
-        "messages": messages,
-        "max_tokens": max_token,
-        "anthropic_version": "bedrock-2023-05-31",
-    }
-    if temperature is not None:
-        body['temperature'] = temperature
-    if top_p is not None:
-        body['top_p'] = top_p
-    if top_k is not None:
-        body['top_k'] = top_k
+    def invoke():
+        start = time.monotonic()
+        try:
+            response, used_model, attempts = call_with_fallback(
+                model_id, lambda model: bedrock.invoke_model(body=body, modelId=model), allow_fallback)
+        except ClientError as e:
+            error_code = e.response['Error']['Code']
+            metrics = {'requested_model_id': model_id, 'error_code': error_code}
+            # 捕获ThrottlingException错误，并返回适当的响应
+            if error_code == 'ThrottlingException':
+                print(f"ThrottlingException: {e}")
+                return "ThrottlingException: Too many requests, please wait before trying again.", False, metrics
+            print(f"Unexpected error: {e}")
+            return f"Unexpected error: {e}", False, metrics
 
-    try:
-        response = bedrock.invoke_model(body=json.dumps(body), modelId=model_id)
         response_body = json.loads(response.get("body").read())
-        result = response_body.get("content")[0]['text']
-        print(f"Model ID: {model_id}, Prompt: {query}, Result: {result}")
-        return result, True
-    except ClientError as e:
-        # 捕获ThrottlingException错误，并返回适当的响应
-        if e.response['Error']['Code'] == 'ThrottlingException':
-            print(f"ThrottlingException: {e}")
-            return "ThrottlingException: Too many requests, please wait before trying again.", False
-        else:
-            print(f"Unexpected error: {e}")
-            return f"Unexpected error: {e}", False
+        usage = response_body.get('usage', {})
+        metrics = {
+            'model_id': used_model,
+            'requested_model_id': model_id,
+            'latency_ms': round((time.monotonic() - start) * 1000),
+            'input_tokens': usage.get('input_tokens', 0),
+            'output_tokens': usage.get('output_tokens', 0),
+            'attempts': attempts,
+            'fallback': used_model != model_id,
+        }
+        report_model_metrics(metrics)
+        return response_body.get("content")[0]['text'], True, metrics
+
+    (result, ok, metrics), coalesced = model_calls.do((model_id, body, allow_fallback), invoke)
+    if coalesced:
+        print(f"Coalesced with an in-flight invocation of {model_id}")
+        metrics = {**metrics, 'coalesced': True}
+    return result, ok, metrics
+
+def pre_interpret_event(event_arn, model_id=DEFAULT_MODEL):
+    """
+    预先生成一个事件的解读并写入缓存，已有缓存时直接返回。
+
+    调用模型前从令牌桶取令牌，保证调用速率不超过 Bedrock 的配额。
+    不切换备用模型：限流时让消息回到队列，稍后用请求的模型重新生成。
+
+    返回:
+    str: 'cached' 或 'generated'
+
+    异常:
+    RuntimeError: 等待令牌超时或者模型调用失败(消息会回到队列重试)
+    """
+    prompt, cache_key, selected_model = prepare_interpretation(*load_event_inputs(event_arn), model_id)
+    if read_cached_interpretation(cache_key) is not None:
+        return 'cached'
+
+    if not interpretation_rate_limiter.acquire(timeout=INTERPRETATION_TOKEN_TIMEOUT):
+        raise RuntimeError("Timed out waiting for the Bedrock rate limit")
+    result, ok, _ = invoke_claude_model(prompt, model_id=selected_model, allow_fallback=False)
+    if not ok:
+        raise RuntimeError(result)
+    save_interpretation(cache_key, result, selected_model)
+    return 'generated'
+
+def worker_handler(event, context):
+    """
+    SQS 触发的 Lambda 函数入口，为 fetch_health_events 放入队列的新事件预先生成解读。
+
+    消息格式：{"event_arn": "arn:aws:health:...", "model_id": "可选"}
+
+    使用部分批处理响应：失败的消息(限流、模型错误等)返回给 SQS 稍后重试，
+    重试多次仍失败的进入死信队列；事件已经不存在的消息和格式错误的消息直接丢弃。
+    函数剩下的时间不足 INTERPRETATION_MESSAGE_BUDGET_MS 时，还没开始的消息不再处理，同样返回给 SQS。
+    """
+    records = event.get('Records', [])
+
+    def process(record):
+        if context is not None and context.get_remaining_time_in_millis() < INTERPRETATION_MESSAGE_BUDGET_MS:
+            print(f"Not enough time left for message {record['messageId']}, returning it to the queue")
+            return record['messageId']
+        try:
+            body = json.loads(record['body'])
+            event_arn = body['event_arn']
+        except (ValueError, TypeError, KeyError) as e:
+            # 重试也不会成功，丢弃这条消息，不影响同一批的其他消息
+            print(f"Dropped malformed message {record.get('messageId')}: {e!r}")
+            return None
+        try:
+            status = pre_interpret_event(event_arn, body.get('model_id') or DEFAULT_MODEL)
+            print(f"Pre-interpreted {event_arn}: {status}")
+        except LookupError as e:
+            print(f"Skipped {event_arn}: {e}")
+        except (RuntimeError, BotoCoreError, ClientError) as e:
+            print(f"Failed to pre-interpret {event_arn}: {e}")
+            return record['messageId']
+        return None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(len(records), INTERPRETATION_WORKER_CONCURRENCY))) as executor:
+        failed_message_ids = [message_id for message_id in executor.map(process, records) if message_id]
+
+    print(f"Processed {len(records)} messages, {len(failed_message_ids)} failed")
+    return {"batchItemFailures": [{"itemIdentifier": message_id} for message_id in failed_message_ids]}
 
 def lambda_handler(event, context):
     """
     Lambda函数的入口，处理事件描述和受影响实体的请求。
 
+    请求中可选的 refresh 为 true 时忽略解读缓存重新生成。
+    提供 event_arn 时从数据库读取描述和受影响实体(忽略 event_desc 和 affected_entities)，
+    和预生成解读的 worker 使用同样的输入，可以直接命中预生成的结果。
+
     参数:
     event (dict): 包含事件信息的字典。
     context (object): Lambda执行上下文对象。
@@ -151,17 +557,30 @@ def lambda_handler(event, context):
     event_desc = parsed_event.get('event_desc', '')
     affected_entities = parsed_event.get('affected_entities', [])
     model_id = parsed_event.get('model_id', DEFAULT_MODEL)
+    refresh = bool(parsed_event.get('refresh', False))
 
     # 验证传入的 model_id 是否在可用模型列表中
     available_models = get_available_models()
     if model_id and model_id not in available_models:
         return create_response(400, f"Invalid model_id: {model_id}. Must be one of {available_models}")
 
+    event_arn = parsed_event.get('event_arn')
+    if event_arn:
+        try:
+            event_desc, affected_entities = load_event_inputs(event_arn)
+        except LookupError as e:
+            return create_response(404, str(e))
+
     # 调用解释健康事件的函数
-    result, ok = interpret_health_event(event_desc, affected_entities, model_id=model_id)
+    result, ok, cached, metrics = interpret_health_event(event_desc, affected_entities, model_id=model_id,
+                                                         refresh=refresh)
 
     if ok:
-        return create_response(200, "Model invocation successful", {"result": result})
+        return create_response(200, "Model invocation successful", {"result": result, "cached": cached,
+                                                                    "metrics": metrics})
+    elif metrics.get('error_code') == 'ThrottlingException':
+        # 重试和备用模型都被限流
+        return create_response(429, result)
     else:
         return create_response(400, result)
 
@@ -0,0 +1,176 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+# 在deploy/data_collection/cdk_infra/backend_stack.py中把common/打包为
+# Lambda Layer, 导致最终的layer是没有common/这一层目录. 所以，使用
+# try...except... 这种技巧
+try:
+    # 本地开发时使用
+    from common.utils import (create_response, parse_event, etag_matches, not_modified_response,
+        encode_next_token, decode_next_token)
+    from common.cache import compute_etag, get_data_generation
+    from common.event_queries import fetch_event_details, details_cache, get_affected_accounts, query_affected_entities
+    from common.constants import ACCOUNTS_TABLE_NAME
+except ImportError:
+    # 部署到 Lambda 时使用
+    from utils import (create_response, parse_event, etag_matches, not_modified_response,
+        encode_next_token, decode_next_token)
+    from cache import compute_etag, get_data_generation
+    from event_queries import fetch_event_details, details_cache, get_affected_accounts, query_affected_entities
+    from constants import ACCOUNTS_TABLE_NAME
+
+
+# 初始化 DynamoDB 客户端
+dynamodb = boto3.resource('dynamodb')
+accounts_table = dynamodb.Table(ACCOUNTS_TABLE_NAME)
+
+DEFAULT_PAGE_SIZE = 20
+# 每页的事件数上限(事件详情通过分批并发的 batch_get_all 读取，这里限制的是单次请求的工作量)
+MAX_PAGE_SIZE = 100
+
+# 可选的部分: 请求中的开关 -> 默认值
+SECTION_FLAGS = {
+    'include_details': True,
+    'include_accounts': True,
+    'include_entities': True,
+}
+
+def query_bundle(event_arns, flags, last_updated_times=None):
+    """
+    并发查询一组事件的详情、受影响账户和受影响实体。
+
+    参数:
+    event_arns (list): 事件ARN列表(一页)
+    flags (dict): SECTION_FLAGS 中各部分的开关
+    last_updated_times (dict, optional): 事件ARN -> 客户端已知的 LastUpdatedTime，用于验证事件详情的缓存
+
+    返回:
+    tuple: (每个部分的查询结果, 每个部分的耗时(秒))
+    """
+    tasks = {}
+    if flags['include_details']:
+        tasks['details'] = (lambda arns: fetch_event_details(arns, last_updated_times), event_arns)
+    if flags['include_accounts']:
+        tasks['accounts'] = (get_affected_accounts, event_arns)
+    if flags['include_entities']:
+        tasks['entities'] = (query_affected_entities, [{'EventArn': arn} for arn in event_arns])
+
+    def run(section):
+        start = time.monotonic()
+        func, arg = tasks[section]
+        return func(arg), round(time.monotonic() - start, 3)
+
+    results = {}
+    timings = {}
+    if not tasks:
+        return results, timings
+
+    with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+        futures = {section: executor.submit(run, section) for section in tasks}
+        for section, future in futures.items():
+            results[section], timings[section] = future.result()
+    return results, timings
+
+def build_bundle(event_arns, flags, results):
+    """把各部分的结果按事件ARN组合成一个文档。"""
+    details_by_arn = {}
+    failed_event_arns = []
+    if 'details' in results:
+        event_details, failed_event_arns = results['details']
+        details_by_arn = {detail['event_arn']: detail for detail in event_details}
+
+    affected_accounts, failed_account_arns = results.get('accounts', ({}, []))
+    failed_event_arns = failed_event_arns + failed_account_arns
+    entities_by_arn = {}
+    for entity in results.get('entities', []):
+        entities_by_arn.setdefault(entity['EventArn'], []).append(entity)
+
+    events = []
+    for arn in event_arns:
+        bundle = {'event_arn': arn}
+        if flags['include_details']:
+            bundle['details'] = details_by_arn.get(arn)
+        if flags['include_accounts']:
+            bundle['affected_accounts'] = affected_accounts.get(arn, [])
+        if flags['include_entities']:
+            bundle['affected_entities'] = entities_by_arn.get(arn, [])
+        events.append(bundle)
+    return events, failed_event_arns
+
+def lambda_handler(event, context):
+    """
+    Lambda函数入口，一次请求返回一组事件的详情、受影响账户和受影响实体，
+    代替分别调用 query_event_details、query_affected_accounts、query_affected_entities。
+
+    请求格式：
+    {
+        "event_arns": ["arn:aws:health:...", ...],  // 必需
+        "include_details": true,                    // 可选，是否返回事件详情，默认 true
+        "include_accounts": true,                   // 可选，是否返回受影响账户，默认 true
+        "include_entities": true,                   // 可选，是否返回受影响实体，默认 true
+        "last_updated_times": {"arn:...": "..."},   // 可选，客户端已知的 LastUpdatedTime，用于验证事件详情的缓存
+        "page_size": 20,                            // 可选，每页的事件数，最多 100
+        "next_token": "..."                         // 可选，上一页返回的 next_token
+    }
+
+    响应格式：
+    {
+        "statusCode": 200,
+        "body": {
+            "events": [
+                {
+                    "event_arn": "...",
+                    "details": {...},              // 没有找到时为 null
+                    "affected_accounts": ["..."],
+                    "affected_entities": [{...}]
+                }
+            ],
+            "failed_event_arns": [{"event_arn": "...", "reason": "..."}],
+            "timings": {"details": 0.05, "accounts": 0.04, "entities": 0.08},
+            "next_token": "下一页的token，没有下一页时为 null"
+        }
+    }
+    响应头 X-Cache-Stats 为事件详情缓存的统计(size、bytes、hits、misses、evictions)。
+    """
+    # 解析事件(event 保留原始事件，用于读取 Accept/Accept-Encoding 请求头)
+    parsed_event = parse_event(event)
+    print("Parsed event:", json.dumps(parsed_event, indent=2))
+
+    event_arns = list(dict.fromkeys(parsed_event.get('event_arns', [])))
+    if not event_arns:
+        print("Error: 'event_arns' is empty.")
+        return create_response(400, "'event_arns' is empty, no events to query.")
+
+    flags = {flag: bool(parsed_event.get(flag, default)) for flag, default in SECTION_FLAGS.items()}
+    try:
+        page_size = min(max(int(parsed_event.get('page_size', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        offset = decode_next_token(parsed_event.get('next_token'))
+    except (ValueError, TypeError, KeyError) as e:
+        return create_response(400, f"Invalid pagination parameters: {str(e)}")
+
+    page_arns = event_arns[offset:offset + page_size]
+    next_offset = offset + len(page_arns)
+
+    # 数据没有更新且客户端已有相同的数据时，不查询数据库直接返回304
+    etag = compute_etag(get_data_generation(accounts_table), 'event_bundle', page_arns, flags, len(event_arns))
+    if etag_matches(event, etag):
+        print(f"ETag {etag} matched, returning 304")
+        return not_modified_response(etag)
+
+    results, timings = query_bundle(page_arns, flags, parsed_event.get('last_updated_times'))
+    events, failed_event_arns = build_bundle(page_arns, flags, results)
+    print(f"Fetched bundle for {len(page_arns)} events, timings: {timings}, details cache: {details_cache.stats()}")
+
+    # 缓存统计每次请求都会变化，放在响应头里，不放进 ETag 覆盖的响应体
+    cache_headers = {"X-Cache-Stats": format_cache_stats(details_cache.stats())}
+    # 有失败的事件时不带 ETag，客户端下次重新请求
+    return create_response(200, "Fetched event bundle successfully.", {
+        "events": events,
+        "failed_event_arns": failed_event_arns,
+        "timings": timings,
+        "next_token": encode_next_token(next_offset) if next_offset < len(event_arns) else None
+    }, request_event=event, ndjson_key="events", etag=None if failed_event_arns else etag,
+       extra_headers=cache_headers)
@@ -6,100 +6,36 @@ import boto3
 # try...except... 这种技巧
 try:
     # 本地开发时使用
-    from common.utils import create_response, parse_event
-    from common.constants import EVENT_DETAILS_TABLE_NAME
+    from common.utils import create_response, format_cache_stats, parse_event, etag_matches, not_modified_response
+    from common.cache import compute_etag, get_data_generation
+    from common.event_queries import fetch_event_details, details_cache
+    from common.constants import ACCOUNTS_TABLE_NAME
 except ImportError:
     # 部署到 Lambda 时使用
-    from utils import create_response, parse_event
-    from constants import EVENT_DETAILS_TABLE_NAME
+    from utils import create_response, format_cache_stats, parse_event, etag_matches, not_modified_response
+    from cache import compute_etag, get_data_generation
+    from event_queries import fetch_event_details, details_cache
+    from constants import ACCOUNTS_TABLE_NAME
 
 
 # 初始化 DynamoDB 客户端
-dynamodb_client = boto3.client('dynamodb')
+dynamodb = boto3.resource('dynamodb')
+accounts_table = dynamodb.Table(ACCOUNTS_TABLE_NAME)
 
 
-def fetch_event_details(event_arns):
-    """
-    批量获取指定的事件ARN列表对应的详情。
-
-    参数:
-    event_arns (list): 事件ARN的列表
-
-    返回:
-    tuple: 包含成功结果列表和失败事件ARN列表的元组
-    """
-    result = []
-    failed_event_arns = []
-
-    try:
-        # 批量获取
-        print(f"Fetching event details for len({event_arns} ARNs:\n{event_arns}")
-        response = dynamodb_client.batch_get_item(
-            RequestItems={
-                EVENT_DETAILS_TABLE_NAME: {
-                    'Keys': [{'EventArn': {'S': arn}} for arn in event_arns]
-                }
-            }
-        )
-        # print(f"Received response from DynamoDB: {json.dumps(response, indent=2)}")
-
-        # 获取成功的项目
-        if 'Responses' in response and EVENT_DETAILS_TABLE_NAME in response['Responses']:
-            for item in response['Responses'][EVENT_DETAILS_TABLE_NAME]:
-                # 请保持跟lambda /fetch_health_events中写入event_details表的结构一样
-                event_detail = {
-                    'event_arn': item['EventArn']['S'],
-                    'event_type_category': item.get('EventTypeCategory', {}).get('S', ''),
-                    'region': item.get('Region', {}).get('S', ''),
-                    'service': item.get('Service', {}).get('S', ''),
-                    'end_time': item.get('EndTime', {}).get('S', ''),
-                    'availability_zone': item.get('AvailabilityZone', {}).get('S', ''),
-                    'status_code': item.get('StatusCode', {}).get('S', ''),
-                    'event_scope_code': item.get('EventScopeCode', {}).get('S', ''),
-                    'aws_account_id': item.get('AwsAccountId', {}).get('S', ''),
-                    'last_updated_time': item.get('LastUpdatedTime', {}).get('S', ''),
-                    'event_type_code': item.get('EventTypeCode', {}).get('S', ''),
-                    'start_time': item.get('StartTime', {}).get('S', ''),
-                    'latest_description': item.get('LatestDescription', {}).get('S', ''),
-                    'event_metadata': item.get('EventMetadata', {}).get('M', {})
-                }
-                result.append(event_detail)
-            print(f"Successfully retrieved items: {result}")
-
-        # 获取失败的项目
-        if 'UnprocessedKeys' in response and EVENT_DETAILS_TABLE_NAME in response['UnprocessedKeys']:
-            for key in response['UnprocessedKeys'][EVENT_DETAILS_TABLE_NAME]['Keys']:
-                failed_event_arns.append({
-                    'event_arn': key['EventArn']['S'],
-                    'reason': '未处理的键，可能是由于请求容量限制'
-                })
-            print(f"Unprocessed ARNs: {failed_event_arns}")
-
-        # 添加因找不到而失败的项目
-        for arn in event_arns:
-            if arn not in [item['event_arn'] for item in result]:
-                failed_event_arns.append({'event_arn': arn, 'reason': '未找到对应的项'})
-                print(f"Event ARN not found: {arn}")
-
-    except Exception as e:
-        error_message = str(e)
-        failed_event_arns.extend([{'event_arn': arn, 'reason': error_message} for arn in event_arns])
-        print(f"Exception occurred: {error_message}")
-
-    return result, failed_event_arns
-
 def lambda_handler(event, context):
     """
     Lambda函数，用于批量获取指定的事件ARN列表对应的详情。
 
     参数:
-    event (dict): 输入事件，包含一个键 'event_arns'，其值为事件ARN的列表。
+    event (dict): 输入事件，包含一个键 'event_arns'，其值为事件ARN的列表；可选的 'last_updated_times'
+        (事件ARN -> 客户端已知的 LastUpdatedTime)，用于判断未关闭事件的缓存是否还有效。
     context: AWS Lambda上下文对象（此处未使用）。
 
     返回:
     dict: 包含状态码、消息以及结果或错误的响应。
     """
-    # 解析事件
+    # 解析事件(event 保留原始事件，用于读取 Accept/Accept-Encoding 请求头)
     parsed_event = parse_event(event)
     print("Parsed event:", json.dumps(parsed_event, indent=2))
 
@@ -109,14 +45,24 @@ def lambda_handler(event, context):
         print("Error: 'event_arns' is empty.")
         return create_response(400, "'event_arns' is empty, no event details to query.")
 
+    # 数据没有更新且客户端已有相同的数据时，不查询数据库直接返回304
+    etag = compute_etag(get_data_generation(accounts_table), 'event_details', set(event_arns))
+    if etag_matches(event, etag):
+        print(f"ETag {etag} matched, returning 304")
+        return not_modified_response(etag)
+
     # 获取事件详情
-    event_details, failed_event_arns = fetch_event_details(event_arns)
+    event_details, failed_event_arns = fetch_event_details(event_arns, parsed_event.get('last_updated_times'))
 
-    # 返回最终响应
+    # 缓存统计每次请求都会变化，放在响应头里，不放进 ETag 覆盖的响应体
+    cache_headers = {"X-Cache-Stats": format_cache_stats(details_cache.stats())}
+    # 返回最终响应(有失败的事件时不带 ETag，客户端下次重新请求)
     final_response = create_response(200, "Fetched event details successfully.", {
         "event_details": event_details,
         "failed_event_arns": failed_event_arns
-    })
-    print(f"Final response: {json.dumps(final_response, ensure_ascii=False)}")
+    }, request_event=event, ndjson_key="event_details", etag=None if failed_event_arns else etag,
+       extra_headers=cache_headers)
+    print(f"Final response: {len(event_details)} event details, {len(failed_event_arns)} failed event ARNs, "
+          f"body size {len(final_response['body'])}, details cache: {details_cache.stats()}")
 
     return final_response
@@ -0,0 +1,147 @@
+import json
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import boto3
+from boto3.dynamodb.conditions import Key
+
+# 在deploy/data_collection/cdk_infra/backend_stack.py中把common/打包为
+# Lambda Layer, 导致最终的layer是没有common/这一层目录. 所以，使用
+# try...except... 这种技巧
+try:
+    # 本地开发时使用
+    from common.utils import create_response, parse_event
+    from common.permissions import resolve_account_ids
+    from common.constants import EVENT_ROLLUPS_TABLE_NAME
+except ImportError:
+    # 部署到 Lambda 时使用
+    from utils import create_response, parse_event
+    from permissions import resolve_account_ids
+    from constants import EVENT_ROLLUPS_TABLE_NAME
+
+
+# 初始化 DynamoDB 客户端
+dynamodb = boto3.resource('dynamodb')
+event_rollups_table = dynamodb.Table(EVENT_ROLLUPS_TABLE_NAME)
+
+DEFAULT_LOOKBACK_DAYS = 90
+
+# group_by 支持的维度 -> 汇总表中的字段名
+FACET_ATTRIBUTES = {
+    'account': 'AccountId',
+    'day': 'Day',
+    'service': 'Service',
+    'region': 'Region',
+    'category': 'EventTypeCategory',
+    'status': 'StatusCode',
+}
+
+# filters 中的过滤条件(和 query_health_events 的 event_filter 同名) -> 汇总表中的字段名
+FILTER_ATTRIBUTES = {
+    'services': 'Service',
+    'regions': 'Region',
+    'eventTypeCategories': 'EventTypeCategory',
+    'eventStatusCodes': 'StatusCode',
+}
+
+def query_rollups(account_id, start_day, end_day):
+    """查询某个管理账户在 [start_day, end_day] 范围内的所有汇总条目。"""
+    items = []
+    query_kwargs = {
+        # RollupKey 以日期开头，'#' 之后的部分用 '~' 截断，覆盖 end_day 当天的所有条目
+        'KeyConditionExpression': Key('AccountId').eq(account_id) &
+                                  Key('RollupKey').between(f'{start_day}#', f'{end_day}#~')
+    }
+    while True:
+        response = event_rollups_table.query(**query_kwargs)
+        items.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            break
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return items
+
+def summarize_rollups(rollups, filters, group_by):
+    """
+    对汇总条目按过滤条件筛选，并按 group_by 中的维度计算分面计数。
+
+    返回:
+    tuple: (总数, {维度: {值: 计数}})
+    """
+    total = 0
+    facets = {dimension: defaultdict(int) for dimension in group_by}
+
+    for item in rollups:
+        if any(item.get(attribute) not in filters[name] for name, attribute in FILTER_ATTRIBUTES.items() if name in filters):
+            continue
+
+        count = int(item.get('EventCount', 0))
+        if count <= 0:
+            continue
+
+        total += count
+        for dimension in group_by:
+            facets[dimension][item.get(FACET_ATTRIBUTES[dimension], '')] += count
+
+    return total, {dimension: dict(counts) for dimension, counts in facets.items()}
+
+def lambda_handler(event, context):
+    """
+    Lambda 函数入口，从汇总表中回答事件的分面计数问题，不需要访问健康事件表。
+
+    请求格式：
+    {
+        "user_id": "用户ID",
+        "account_ids": ["123456789012"],  // 可选，默认为用户允许访问的全部管理账户
+        "start_day": "2024-06-01",        // 可选，按事件 StartTime 的日期，默认为90天前
+        "end_day": "2024-08-31",          // 可选，默认为今天
+        "filters": {                      // 可选
+            "services": ["EC2"],
+            "regions": ["us-east-1"],
+            "eventTypeCategories": ["issue"],
+            "eventStatusCodes": ["open"]
+        },
+        "group_by": ["service", "region", "category", "status"]  // 可选，另外支持 "day" 和 "account"
+    }
+
+    响应格式：
+    {
+        "statusCode": 200,
+        "body": {
+            "total": 总事件数,
+            "facets": {"service": {"EC2": 10, ...}, ...}
+        }
+    }
+    """
+    # 解析事件
+    event = parse_event(event)
+    print("Parsed event:", json.dumps(event, indent=2))
+
+    user_id = event.get('user_id')
+    if not user_id:
+        return create_response(400, "'user_id' is required.")
+
+    group_by = event.get('group_by', ['service', 'region', 'category', 'status'])
+    invalid_dimensions = [dimension for dimension in group_by if dimension not in FACET_ATTRIBUTES]
+    if invalid_dimensions:
+        return create_response(400, f"Invalid group_by: {invalid_dimensions}. Must be in {list(FACET_ATTRIBUTES)}")
+
+    today = datetime.now(timezone.utc).date()
+    start_day = event.get('start_day', (today - timedelta(days=DEFAULT_LOOKBACK_DAYS)).isoformat())
+    end_day = event.get('end_day', today.isoformat())
+    filters = {name: set(values) for name, values in event.get('filters', {}).items() if name in FILTER_ATTRIBUTES}
+
+    account_ids = resolve_account_ids(user_id, event.get('account_ids'))
+
+    rollups = []
+    for account_id in account_ids:
+        rollups.extend(query_rollups(account_id, start_day, end_day))
+    print(f"Fetched {len(rollups)} rollups for {len(account_ids)} management accounts from {start_day} to {end_day}")
+
+    total, facets = summarize_rollups(rollups, filters, group_by)
+
+    return create_response(200,
+                           "Fetched event summary successfully",
+                           {
+                               "total": total,
+                               "facets": facets
+                           })
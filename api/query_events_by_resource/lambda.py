@@ -0,0 +1,124 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 在deploy/data_collection/cdk_infra/backend_stack.py中把common/打包为
+# Lambda Layer, 导致最终的layer是没有common/这一层目录. 所以，使用
+# try...except... 这种技巧
+try:
+    # 本地开发时使用
+    from common.utils import create_response, parse_event
+    from common.permissions import resolve_account_ids
+    from common.entity_index import parse_resource, query_resource
+except ImportError:
+    # 部署到 Lambda 时使用
+    from utils import create_response, parse_event
+    from permissions import resolve_account_ids
+    from entity_index import parse_resource, query_resource
+
+
+# 一次请求最多查询的资源数，以及并发查询的线程数
+MAX_RESOURCES = 100
+RESOURCE_QUERY_MAX_WORKERS = int(os.environ.get('RESOURCE_QUERY_MAX_WORKERS', '16'))
+
+def to_match(item):
+    """把索引条目转换成响应中的一条匹配结果。"""
+    return {
+        'event_arn': item['EventArn'],
+        'entity_value': item.get('EntityValue', ''),
+        'account_id': item.get('AccountId', ''),
+        'management_account_id': item.get('ManagementAccountId', ''),
+        'start_time': item.get('StartTime', ''),
+        'service': item.get('Service', ''),
+        'event_type_code': item.get('EventTypeCode', ''),
+        'event_type_category': item.get('EventTypeCategory', ''),
+        'region': item.get('Region', ''),
+        'entity_status_code': item.get('StatusCode', ''),
+    }
+
+def query_resources(resources, account_ids, exact=False, start_from=None, start_to=None):
+    """
+    并发查询一批资源标识，只保留用户有权限访问的管理账户下的结果。
+
+    返回:
+    dict: 资源标识 -> 按 StartTime 倒序的匹配结果列表
+    """
+    def run(identifier):
+        items = query_resource(identifier, exact, start_from, start_to)
+        matches = {(item['EventArn'], item.get('AccountId'), item.get('EntityValue')): to_match(item)
+                   for item in items if item.get('ManagementAccountId') in account_ids}
+        return sorted(matches.values(), key=lambda match: match['start_time'], reverse=True)
+
+    with ThreadPoolExecutor(max_workers=min(len(resources), RESOURCE_QUERY_MAX_WORKERS)) as executor:
+        return dict(zip(resources, executor.map(run, resources)))
+
+def lambda_handler(event, context):
+    """
+    Lambda 函数入口，查询一批资源(实例ID、桶名、ARN 等)受到了哪些健康事件的影响。
+
+    请求格式：
+    {
+        "user_id": "用户ID",
+        "resources": [
+            "i-0abc1234567890def",
+            "arn:aws:s3:::my-bucket",
+            "arn:aws:ec2:us-east-1:123456789012:instance/"   // ARN 默认按前缀匹配
+        ],
+        "exact": false,                     // 可选，为 true 时 ARN 也只做精确匹配
+        "account_ids": ["123456789012"],    // 可选，默认为用户允许访问的全部管理账户
+        "start_time": "2024-06-01",         // 可选，按事件 StartTime 过滤
+        "end_time": "2024-08-31T23:59:59"   // 可选
+    }
+
+    响应格式：
+    {
+        "statusCode": 200,
+        "body": {
+            "results": {
+                "i-0abc1234567890def": [{"event_arn": ..., "account_id": ..., "start_time": ..., ...}],
+                ...
+            },
+            "total": 匹配总数
+        }
+    }
+    """
+    start = time.time()
+
+    # 解析事件(event 保留原始事件，用于读取 Accept/Accept-Encoding 请求头)
+    parsed_event = parse_event(event)
+    print("Parsed event:", json.dumps(parsed_event, indent=2))
+
+    user_id = parsed_event.get('user_id')
+    if not user_id:
+        return create_response(400, "'user_id' is required.")
+
+    resources = list(dict.fromkeys(parsed_event.get('resources') or []))
+    if not resources:
+        return create_response(400, "'resources' is empty, no resources to query.")
+    if len(resources) > MAX_RESOURCES:
+        return create_response(400, f"Too many resources: {len(resources)}. At most {MAX_RESOURCES} per request.")
+
+    # 提前校验标识，不完整的 ARN 直接返回错误
+    try:
+        for identifier in resources:
+            parse_resource(identifier)
+    except ValueError as e:
+        return create_response(400, f"Invalid resource identifier: {str(e)}")
+
+    # 只给了日期的结束时间包含当天
+    start_time = parsed_event.get('start_time')
+    end_time = parsed_event.get('end_time')
+    if end_time and 'T' not in end_time:
+        end_time = f'{end_time}T23:59:59.999999'
+
+    account_ids = set(resolve_account_ids(user_id, parsed_event.get('account_ids')))
+    results = query_resources(resources, account_ids, bool(parsed_event.get('exact', False)), start_time, end_time)
+
+    total = sum(len(matches) for matches in results.values())
+    print(f"Queried {len(resources)} resources, {total} matches in {(time.time() - start) * 1000:.0f} ms")
+
+    return create_response(200, "Queried events by resource successfully", {
+        "results": results,
+        "total": total
+    }, request_event=event)
@@ -0,0 +1,155 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 在deploy/data_collection/cdk_infra/backend_stack.py中把common/打包为
+# Lambda Layer, 导致最终的layer是没有common/这一层目录. 所以，使用
+# try...except... 这种技巧
+try:
+    # 本地开发时使用
+    from common.utils import create_response, parse_event, encode_next_token, decode_next_token
+    from common.permissions import resolve_account_ids
+    from common.entity_index import parse_tag, query_tag
+except ImportError:
+    # 部署到 Lambda 时使用
+    from utils import create_response, parse_event, encode_next_token, decode_next_token
+    from permissions import resolve_account_ids
+    from entity_index import parse_tag, query_tag
+
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 200
+# 一次请求中不同标签的数量上限，以及并发查询的线程数
+MAX_TAGS = 20
+TAG_QUERY_MAX_WORKERS = int(os.environ.get('TAG_QUERY_MAX_WORKERS', '8'))
+
+def parse_tag_groups(tag_groups):
+    """
+    解析标签查询。tag_groups 是一个列表，组内的标签是 AND，组之间是 OR：
+    [["app=payments", "env=prod"], ["team=core"]] 表示 (app=payments AND env=prod) OR team=core。
+
+    返回:
+    list: 每组一个规整后的标签列表
+
+    异常:
+    ValueError: 格式不正确
+    """
+    if not tag_groups or not isinstance(tag_groups, list):
+        raise ValueError("'tag_groups' must be a non-empty list of tag lists")
+    groups = []
+    for group in tag_groups:
+        if isinstance(group, str):
+            group = [group]
+        if not group:
+            raise ValueError("Empty tag group")
+        groups.append(list(dict.fromkeys(parse_tag(tag) for tag in group)))
+    return groups
+
+def entity_key(item):
+    """同一个事件中的同一个实体。"""
+    return item['EventArn'], item.get('AccountId', ''), item.get('EntityValue', '')
+
+def match_tag_groups(groups, items_by_tag, account_ids):
+    """
+    计算满足标签查询的实体，按事件分组。
+
+    同一个实体需要同时带有组内的所有标签(AND)，满足任意一组即可(OR)。
+
+    返回:
+    list: 每个事件一个结果，按 StartTime 倒序
+    """
+    entities_by_tag = {
+        tag: {entity_key(item): item for item in items if item.get('ManagementAccountId') in account_ids}
+        for tag, items in items_by_tag.items()
+    }
+
+    matched = {}
+    for group in groups:
+        # 从最少的标签开始求交集
+        ordered = sorted(group, key=lambda tag: len(entities_by_tag[tag]))
+        keys = set(entities_by_tag[ordered[0]])
+        for tag in ordered[1:]:
+            keys &= entities_by_tag[tag].keys()
+        for key in keys:
+            matched[key] = entities_by_tag[ordered[0]][key]
+
+    events = {}
+    for (event_arn, account_id, entity_value), item in matched.items():
+        result = events.setdefault(event_arn, {
+            'event_arn': event_arn,
+            'management_account_id': item.get('ManagementAccountId', ''),
+            'start_time': item.get('StartTime', ''),
+            'service': item.get('Service', ''),
+            'event_type_code': item.get('EventTypeCode', ''),
+            'region': item.get('Region', ''),
+            'entities': []
+        })
+        result['entities'].append({'account_id': account_id, 'entity_value': entity_value})
+
+    return sorted(events.values(), key=lambda result: (result['start_time'], result['event_arn']), reverse=True)
+
+def lambda_handler(event, context):
+    """
+    Lambda 函数入口，查询影响带有指定标签的资源的健康事件。
+
+    请求格式：
+    {
+        "user_id": "用户ID",
+        "tag_groups": [["app=payments", "env=prod"], ["team=core"]],  // 组内 AND，组之间 OR
+        "account_ids": ["123456789012"],   // 可选，默认为用户允许访问的全部管理账户
+        "start_time": "2024-06-01",        // 可选，按事件 StartTime 过滤
+        "end_time": "2024-08-31",          // 可选
+        "page_size": 20,                   // 可选
+        "next_token": "..."                // 可选，上一页返回的 next_token
+    }
+
+    响应格式：
+    {
+        "statusCode": 200,
+        "body": {
+            "results": [{"event_arn": ..., "start_time": ..., "entities": [{"account_id": ..., "entity_value": ...}]}],
+            "total": 匹配的事件总数,
+            "next_token": "下一页的token，没有下一页时为 null"
+        }
+    }
+    """
+    start = time.time()
+
+    # 解析事件(event 保留原始事件，用于读取 Accept/Accept-Encoding 请求头)
+    parsed_event = parse_event(event)
+    print("Parsed event:", json.dumps(parsed_event, indent=2))
+
+    user_id = parsed_event.get('user_id')
+    if not user_id:
+        return create_response(400, "'user_id' is required.")
+
+    try:
+        groups = parse_tag_groups(parsed_event.get('tag_groups'))
+        page_size = min(max(int(parsed_event.get('page_size', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        offset = decode_next_token(parsed_event.get('next_token'))
+    except (ValueError, TypeError, KeyError) as e:
+        return create_response(400, f"Invalid parameter: {str(e)}")
+
+    tags = list(dict.fromkeys(tag for group in groups for tag in group))
+    if len(tags) > MAX_TAGS:
+        return create_response(400, f"Too many tags: {len(tags)}. At most {MAX_TAGS} per request.")
+
+    start_time = parsed_event.get('start_time')
+    end_time = parsed_event.get('end_time')
+    account_ids = set(resolve_account_ids(user_id, parsed_event.get('account_ids')))
+
+    # 每个标签一个 Query，并发执行
+    with ThreadPoolExecutor(max_workers=min(len(tags), TAG_QUERY_MAX_WORKERS)) as executor:
+        items_by_tag = dict(zip(tags, executor.map(lambda tag: query_tag(tag, start_time, end_time), tags)))
+
+    results = match_tag_groups(groups, items_by_tag, account_ids)
+    page = results[offset:offset + page_size]
+    next_offset = offset + page_size
+    print(f"Tag query {groups} matched {len(results)} events in {(time.time() - start) * 1000:.0f} ms")
+
+    return create_response(200, "Queried events by tags successfully", {
+        "results": page,
+        "total": len(results),
+        "next_token": encode_next_token(next_offset) if next_offset < len(results) else None
+    }, request_event=event, ndjson_key="results")
@@ -1,76 +1,77 @@
 import boto3
-from botocore.exceptions import BotoCoreError, ClientError
+from boto3.dynamodb.conditions import Attr, ConditionExpressionBuilder, Key
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.config import Config
+import heapq
+import itertools
 import json
-from datetime import datetime, timezone
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
 
 # 在deploy/data_collection/cdk_infra/backend_stack.py中把common/打包为
 # Lambda Layer, 导致最终的layer是没有common/这一层目录. 所以，使用
 # try...except... 这种技巧
 try:
     # 本地开发时使用
-    from common.utils import create_response, parse_event
-    from common.constants import NAME_PREFIX, HEALTH_EVENTS_TABLE_NAME, USERS_TABLE_NAME
+    from common.utils import create_response, parse_event, convert_decimals, etag_matches, not_modified_response
+    from common.cache import TTLCache, make_cache_key, compute_etag, get_data_generation
+    from common.health_events import (LOOKBACK_DAYS, build_event_item, convert_datetime_to_string,
+        get_shard_config, event_partition_key, event_partition_keys, to_management_item)
+    from common.permissions import get_allowed_accounts
+    from common.batch_get import batch_get_all
+    from common.constants import (ACCOUNTS_TABLE_NAME, HEALTH_EVENTS_TABLE_NAME, AFFECTED_ACCOUNTS_TABLE_NAME,
+        MEMBER_ACCOUNT_INDEX_NAME)
 except ImportError:
     # 部署到 Lambda 时使用
-    from utils import create_response, parse_event
-    from constants import NAME_PREFIX, HEALTH_EVENTS_TABLE_NAME, USERS_TABLE_NAME
+    from utils import create_response, parse_event, convert_decimals, etag_matches, not_modified_response
+    from cache import TTLCache, make_cache_key, compute_etag, get_data_generation
+    from health_events import (LOOKBACK_DAYS, build_event_item, convert_datetime_to_string,
+        get_shard_config, event_partition_key, event_partition_keys, to_management_item)
+    from permissions import get_allowed_accounts
+    from batch_get import batch_get_all
+    from constants import (ACCOUNTS_TABLE_NAME, HEALTH_EVENTS_TABLE_NAME, AFFECTED_ACCOUNTS_TABLE_NAME,
+        MEMBER_ACCOUNT_INDEX_NAME)
 
 
 # 初始化 DynamoDB 客户端
 dynamodb = boto3.resource('dynamodb')
 dynamodb_client = boto3.client('dynamodb')
-events_table = dynamodb.Table(HEALTH_EVENTS_TABLE_NAME)
-users_table = dynamodb.Table(USERS_TABLE_NAME)
+accounts_table = dynamodb.Table(ACCOUNTS_TABLE_NAME)
+
+# 低级客户端返回的是带类型的属性值，需要自己序列化/反序列化
+type_serializer = TypeSerializer()
+type_deserializer = TypeDeserializer()
+
+# 数据库查询时并发查询的分区数上限(每个管理账户至少一个分区，分片后每个分片一个)
+DB_QUERY_MAX_WORKERS = int(os.environ.get('DB_QUERY_MAX_WORKERS', '16'))
+
+# 查询结果缓存(模块级，热启动的容器之间复用)，通过数据版本号判断是否失效
+query_cache = TTLCache(
+    max_size=int(os.environ.get('QUERY_CACHE_MAX_ENTRIES', '64')),
+    ttl=int(os.environ.get('QUERY_CACHE_TTL_SECONDS', '300'))
+)
 
 # 初始化 STS 客户端
 sts_client = boto3.client('sts')
 
-ALLOW_ACCOUNTS_LAMBDA_FUNC_NAME = f'{NAME_PREFIX}GetAllowedAccounts'
-def get_allowed_accounts(user_id):
-    """调用另一个Lambda函数获取当前用户允许访问的账户，并进行错误处理。"""
-    lambda_client = boto3.client('lambda')
-    
-    try:
-        response = lambda_client.invoke(
-            FunctionName=ALLOW_ACCOUNTS_LAMBDA_FUNC_NAME,
-            InvocationType='RequestResponse',
-            Payload=json.dumps({'user_id': user_id})
-        )
-        
-        # 检查调用Lambda的HTTP状态码
-        status_code = response.get('StatusCode')
-        if status_code != 200:
-            raise Exception(f"Failed to invoke Lambda function. StatusCode: {status_code}")
-
-        # 读取并解析响应负载
-        payload = response['Payload'].read()
-        result = json.loads(payload)
-        print(f"Invoke lambda ALLOW_ACCOUNTS_LAMBDA_FUNC_NAME result: {result}")
-
-        body = json.loads(result['body'])
-
-        # 检查响应中是否包含错误信息
-        if 'FunctionError' in response:
-            raise Exception(f"Lambda function error: {result.get('errorMessage', 'Unknown error')}")
-
-        # 检查响应是否包含预期的字段
-        if 'allowed_accounts' not in body:
-            raise Exception("Unexpected response format: 'allowed_accounts' not found")
-
-        return body['allowed_accounts']
-
-    except (BotoCoreError, ClientError) as e:
-        # 处理调用Lambda API时的Boto3客户端错误
-        print(f"Error invoking Lambda function: {str(e)}")
-        raise Exception(f"Error invoking Lambda function: {str(e)}")
-    except json.JSONDecodeError as e:
-        # 处理JSON解析错误
-        print(f"Error parsing Lambda function response: {str(e)}")
-        raise Exception(f"Error parsing Lambda function response: {str(e)}")
-    except Exception as e:
-        # 处理其他所有错误
-        print(f"An error occurred: {str(e)}")
-        raise Exception(f"An error occurred: {str(e)}")
+# 实时查询(from_db=false)时，每个管理账户的默认超时时间(秒)和最大并发数
+API_ACCOUNT_DEADLINE_SECONDS = float(os.environ.get('API_ACCOUNT_DEADLINE_SECONDS', '20'))
+# 请求中的 deadline_seconds 的上限：API Gateway 的集成超时是 29 秒，等待线程时还会多等 5 秒
+API_MAX_DEADLINE_SECONDS = float(os.environ.get('API_MAX_DEADLINE_SECONDS', '23'))
+API_MAX_WORKERS = int(os.environ.get('API_MAX_WORKERS', '16'))
+
+# 凭证在过期前这么久就刷新
+CREDENTIALS_REFRESH_MARGIN = timedelta(minutes=5)
+
+# 模块级的凭证和 Health 客户端缓存，热启动的容器之间复用。
+# boto3 创建客户端不是线程安全的，所以创建时要加锁
+credentials_cache = {}
+health_clients = {}
+clients_lock = threading.Lock()
 
 def assume_role(account_id, role_name):
     """获取指定账户的临时凭证。"""
@@ -80,109 +81,176 @@ def assume_role(account_id, role_name):
     )
     return assumed_role['Credentials']
 
-def fetch_health_events_from_api(credentials, event_filters):
-    """从 AWS Health API 拉取指定过滤条件的健康事件。"""
-    health_client = boto3.client(
-        'health',
-        aws_access_key_id=credentials['AccessKeyId'],
-        aws_secret_access_key=credentials['SecretAccessKey'],
-        aws_session_token=credentials['SessionToken']
-    )
+def get_health_client(account_id, role_name):
+    """
+    获取指定账户的 Health 客户端，临时凭证在快过期之前会一直复用。
+    """
+    cache_key = (account_id, role_name)
+    with clients_lock:
+        credentials = credentials_cache.get(cache_key)
+        if credentials and credentials['Expiration'] - CREDENTIALS_REFRESH_MARGIN > datetime.now(timezone.utc):
+            return health_clients[cache_key]
+
+    credentials = assume_role(account_id, role_name)
+    with clients_lock:
+        health_clients[cache_key] = boto3.client(
+            'health',
+            aws_access_key_id=credentials['AccessKeyId'],
+            aws_secret_access_key=credentials['SecretAccessKey'],
+            aws_session_token=credentials['SessionToken'],
+            config=Config(connect_timeout=5, read_timeout=15, retries={'max_attempts': 2})
+        )
+        credentials_cache[cache_key] = credentials
+        return health_clients[cache_key]
+
+def fetch_health_events_from_api(health_client, event_filters, deadline=None):
+    """
+    从 AWS Health API 拉取指定过滤条件的健康事件。
+
+    参数:
+    health_client: Health 客户端
+    event_filters (dict): 过滤条件
+    deadline (float, optional): time.monotonic() 的截止时间，超过后停止翻页
+
+    返回:
+    tuple: (事件列表, 是否因为超时而只拿到了部分结果)
+    """
     events = []
     paginator = health_client.get_paginator('describe_events_for_organization')
 
     for page in paginator.paginate(filter=event_filters):
         events.extend(page['events'])
-    return events
+        if deadline is not None and time.monotonic() > deadline and page.get('nextToken'):
+            return events, True
+    return events, False
+
+# 列表类的过滤条件: 请求中的字段 -> 表中的属性
+LIST_FILTER_ATTRIBUTES = [
+    ('eventTypeCodes', 'EventTypeCode'),
+    ('services', 'Service'),
+    ('regions', 'Region'),
+    ('entityArns', 'EventArn'),
+    ('eventTypeCategories', 'EventTypeCategory'),
+    ('eventStatusCodes', 'StatusCode'),
+]
+
+# 时间范围类的过滤条件: 请求中的字段 -> 表中的属性
+TIME_FILTER_ATTRIBUTES = [
+    ('startTime', 'StartTime'),
+    ('endTime', 'EndTime'),
+    ('lastUpdatedTime', 'LastUpdatedTime'),
+]
+
+def to_time_string(value):
+    """时间过滤条件既可能是 datetime 也可能是 JSON 里的字符串，统一成 ISO 格式字符串。"""
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+def get_time_range(event_filters, filter_name):
+    """返回过滤条件中某个时间范围的 (from, to) 字符串，没有指定的一端为 None。"""
+    time_range = event_filters.get(filter_name) or {}
+    from_time = to_time_string(time_range['from']) if time_range.get('from') else None
+    to_time = to_time_string(time_range['to']) if time_range.get('to') else None
+    return from_time, to_time
+
+def build_dynamodb_filter_expression(event_filters, key_filters=()):
+    """
+    构建 DynamoDB 查询的过滤表达式。
 
-def build_dynamodb_filter_expression(event_filters):
-    """构建 DynamoDB 查询的过滤表达式。"""
+    awsAccountIds(成员账户)通过受影响账户表的反向索引处理，key_filters 中的过滤条件已经作为键条件，
+    都不再出现在过滤表达式里。
+    """
     if not event_filters:
-        return None, {}
+        return None
 
     filter_expression = None
-    expression_attribute_values = {}
-
-    # 处理 awsAccountIds 过滤器
-    if 'awsAccountIds' in event_filters:
-        filter_expression = boto3.dynamodb.conditions.Attr('AccountId').is_in(event_filters['awsAccountIds'])
-    
-    # 处理其他过滤器
-    if 'eventTypeCodes' in event_filters:
-        condition = boto3.dynamodb.conditions.Attr('EventTypeCode').is_in(event_filters['eventTypeCodes'])
-        filter_expression = condition if not filter_expression else filter_expression & condition
-    
-    if 'services' in event_filters:
-        condition = boto3.dynamodb.conditions.Attr('Service').is_in(event_filters['services'])
-        filter_expression = condition if not filter_expression else filter_expression & condition
-    
-    if 'regions' in event_filters:
-        condition = boto3.dynamodb.conditions.Attr('Region').is_in(event_filters['regions'])
-        filter_expression = condition if not filter_expression else filter_expression & condition
-    
-    if 'startTime' in event_filters:
-        from_time = event_filters['startTime']['from'].isoformat()
-        to_time = event_filters['startTime'].get('to', datetime.now(timezone.utc)).isoformat()
-        condition = boto3.dynamodb.conditions.Attr('StartTime').between(from_time, to_time)
-        filter_expression = condition if not filter_expression else filter_expression & condition
-        expression_attribute_values[':start_time_from'] = from_time
-        expression_attribute_values[':start_time_to'] = to_time
-    
-    if 'endTime' in event_filters:
-        from_time = event_filters['endTime']['from'].isoformat()
-        to_time = event_filters['endTime'].get('to', datetime.now(timezone.utc)).isoformat()
-        condition = boto3.dynamodb.conditions.Attr('EndTime').between(from_time, to_time)
-        filter_expression = condition if not filter_expression else filter_expression & condition
-        expression_attribute_values[':end_time_from'] = from_time
-        expression_attribute_values[':end_time_to'] = to_time
-    
-    if 'lastUpdatedTime' in event_filters:
-        from_time = event_filters['lastUpdatedTime']['from'].isoformat()
-        to_time = event_filters['lastUpdatedTime'].get('to', datetime.now(timezone.utc)).isoformat()
-        condition = boto3.dynamodb.conditions.Attr('LastUpdatedTime').between(from_time, to_time)
-        filter_expression = condition if not filter_expression else filter_expression & condition
-        expression_attribute_values[':last_updated_time_from'] = from_time
-        expression_attribute_values[':last_updated_time_to'] = to_time
-    
-    if 'entityArns' in event_filters:
-        condition = boto3.dynamodb.conditions.Attr('EventArn').is_in(event_filters['entityArns'])
-        filter_expression = condition if not filter_expression else filter_expression & condition
-    
-    if 'eventTypeCategories' in event_filters:
-        condition = boto3.dynamodb.conditions.Attr('EventTypeCategory').is_in(event_filters['eventTypeCategories'])
-        filter_expression = condition if not filter_expression else filter_expression & condition
-    
-    if 'eventStatusCodes' in event_filters:
-        condition = boto3.dynamodb.conditions.Attr('StatusCode').is_in(event_filters['eventStatusCodes'])
-        filter_expression = condition if not filter_expression else filter_expression & condition
-    
-    return filter_expression, expression_attribute_values
-
-def fetch_health_events_from_db(event_filter):
-    """从 DynamoDB 中获取指定过滤条件的健康事件。"""
-    
-    # 如果 event_filter 为空，直接查询所有记录
-    if not event_filter:
-        print("No filter provided, scanning all items in the table.")
-        response = events_table.scan()  # 不使用 FilterExpression，扫描整个表
-        return response.get('Items', [])
-    
-    # 构建 FilterExpression
-    filter_expression, expression_attribute_values = build_dynamodb_filter_expression(event_filter)
-    
-    if not filter_expression:
-        print("No filter expression generated. Returning empty list.")
-        return []  # 如果没有生成有效的过滤条件，返回空列表
-
-    print(f"Scan events_table using \nfilter expression: {filter_expression}\nexpression attribute values: {expression_attribute_values}")
-    response = events_table.scan(
-        FilterExpression=filter_expression,
-        ExpressionAttributeValues=expression_attribute_values
-    )
-    return response.get('Items', [])
+    for filter_name, attribute in LIST_FILTER_ATTRIBUTES:
+        if filter_name in event_filters:
+            condition = Attr(attribute).is_in(event_filters[filter_name])
+            filter_expression = condition if filter_expression is None else filter_expression & condition
+
+    for filter_name, attribute in TIME_FILTER_ATTRIBUTES:
+        if filter_name not in event_filters or filter_name in key_filters:
+            continue
+        from_time, to_time = get_time_range(event_filters, filter_name)
+        to_time = to_time or datetime.now(timezone.utc).isoformat()
+        condition = Attr(attribute).between(from_time, to_time) if from_time else Attr(attribute).lte(to_time)
+        filter_expression = condition if filter_expression is None else filter_expression & condition
+
+    return filter_expression
+
+def build_partition_query(partition_key, start_from=None, start_to=None, filter_expression=None,
+                          descending=False, page_limit=None):
+    """
+    构建 GSI1(分区键 AccountId, 排序键 StartTime) 上查询一个分区的请求参数。
+
+    descending 为 true 时按 StartTime 倒序读取(ScanIndexForward=False)，
+    page_limit 限制每页读取的条目数，只要最新的几条时只需要读很少的数据。
+    """
+    key_condition = Key('AccountId').eq(partition_key)
+    if start_from and start_to:
+        key_condition = key_condition & Key('StartTime').between(start_from, start_to)
+    elif start_from:
+        key_condition = key_condition & Key('StartTime').gte(start_from)
+    elif start_to:
+        key_condition = key_condition & Key('StartTime').lte(start_to)
+
+    # 同一个 builder 生成的占位符不会重复，键条件和过滤条件可以共用一组名称和值
+    builder = ConditionExpressionBuilder()
+    key_expression = builder.build_expression(key_condition, is_key_condition=True)
+    params = {
+        'TableName': HEALTH_EVENTS_TABLE_NAME,
+        'IndexName': 'GSI1',
+        'KeyConditionExpression': key_expression.condition_expression,
+        'ScanIndexForward': not descending,
+    }
+    names = dict(key_expression.attribute_name_placeholders)
+    values = dict(key_expression.attribute_value_placeholders)
+    if filter_expression is not None:
+        expression = builder.build_expression(filter_expression)
+        params['FilterExpression'] = expression.condition_expression
+        names.update(expression.attribute_name_placeholders)
+        values.update(expression.attribute_value_placeholders)
+    params['ExpressionAttributeNames'] = names
+    params['ExpressionAttributeValues'] = {k: type_serializer.serialize(v) for k, v in values.items()}
+    if page_limit:
+        params['Limit'] = page_limit
+    return params
+
+def query_page(params, exclusive_start_key=None):
+    """
+    读取一页查询结果。使用低级客户端(线程安全)，可以在线程池中并发查询多个分区。
+
+    返回:
+    tuple: (条目列表, LastEvaluatedKey，没有下一页时为 None)
+    """
+    if exclusive_start_key:
+        params = {**params, 'ExclusiveStartKey': exclusive_start_key}
+    response = dynamodb_client.query(**params)
+    items = [{k: type_deserializer.deserialize(v) for k, v in item.items()} for item in response['Items']]
+    return items, response.get('LastEvaluatedKey')
+
+def query_partition_events(params):
+    """查询一个分区的全部事件(自动翻页)，结果按 StartTime 有序。"""
+    items, last_key = query_page(params)
+    while last_key:
+        page_items, last_key = query_page(params, last_key)
+        items.extend(page_items)
+    return items
+
+def iter_partition_events(params, first_page):
+    """从已经读取的第一页开始，按需继续翻页，逐条产出一个分区的事件。"""
+    items, last_key = first_page
+    yield from items
+    while last_key:
+        items, last_key = query_page(params, last_key)
+        yield from items
 
 def check_update_allowed_accounts(user_id, accounts):
-    """检查用户是否有权限访问指定的账户，并合并过滤条件中的 awsAccountIds。"""
+    """
+    检查用户是否有权限访问指定的管理账户，去掉没有权限的管理账户。
+
+    过滤条件中的 awsAccountIds 和 AWS Health API 一样表示成员账户，不再用来限制管理账户。
+    """
     allowed_accounts = get_allowed_accounts(user_id)
 
     if not allowed_accounts:
@@ -191,69 +259,335 @@ def check_update_allowed_accounts(user_id, accounts):
     else:
         allowed_account_ids = {acc['AccountId'] for acc in allowed_accounts}
 
-    unauthorized_accounts = []
+    unauthorized_accounts = [account_id for account_id in accounts if account_id not in allowed_account_ids]
+    if unauthorized_accounts:
+        print(f"Warning: Skipped {unauthorized_accounts}. Because User {user_id} is not authorized to access these accounts.")
+
+    accounts = {account_id: account_info for account_id, account_info in accounts.items()
+                if account_id in allowed_account_ids}
+    return accounts, allowed_account_ids
+
+def get_account_settings(account_ids):
+    """
+    批量读取管理账户表中查询需要的设置：同步水位和事件分片配置。
+
+    返回:
+    dict: 键为管理账户ID，值为管理账户表中的条目(只包含上述字段)
+    """
+    items = batch_get_all(ACCOUNTS_TABLE_NAME, [{'AccountId': account_id} for account_id in account_ids],
+                          projection='AccountId, LastSyncTime, EventShardCount, EventShardStrategy')
+    return {item['AccountId']: item for item in items}
+
+def plan_db_queries(accounts, account_settings, descending=False, page_limit=None):
+    """
+    为每个要查询的管理账户生成分区查询的请求参数(指定了成员账户的管理账户除外，见 query_member_account_events)。
+
+    一个管理账户按它的分片配置展开成一个或多个分区键；StartTime 范围作为键条件，
+    按月分片时还用来裁剪需要读取的月份。
+
+    返回:
+    list: 每个分区一个 build_partition_query 生成的请求参数
+    """
+    queries = []
     for account_id, account_info in accounts.items():
-        if account_id not in allowed_account_ids:
-            unauthorized_accounts.append(account_id)
+        event_filter = account_info.get('event_filter') or {}
+        if event_filter.get('awsAccountIds'):
+            continue
 
-        if 'event_filter' not in account_info:
+        shard_config = get_shard_config(account_settings.get(account_id))
+        start_from, start_to = get_time_range(event_filter, 'startTime')
+        filter_expression = build_dynamodb_filter_expression(event_filter, key_filters=('startTime',))
+        for partition_key in event_partition_keys(account_id, shard_config, start_from, start_to):
+            queries.append(build_partition_query(partition_key, start_from, start_to, filter_expression,
+                                                 descending, page_limit))
+    return queries
+
+def event_matches_filter(item, event_filters, key_filters=()):
+    """在内存中判断一个事件条目是否满足过滤条件(和 build_dynamodb_filter_expression 的语义一致)。"""
+    for filter_name, attribute in LIST_FILTER_ATTRIBUTES:
+        if filter_name in event_filters and item.get(attribute) not in event_filters[filter_name]:
+            return False
+
+    for filter_name, attribute in TIME_FILTER_ATTRIBUTES:
+        if filter_name not in event_filters or filter_name in key_filters:
             continue
-        
-        event_filters = account_info['event_filter']
-        if 'awsAccountIds' in event_filters:
-            disallowed_account_ids = set(event_filters['awsAccountIds']) - allowed_account_ids
-            if disallowed_account_ids:
-                print(f"Warning: User {user_id} is not authorized to access awsAccountIds: {disallowed_account_ids}")
-            event_filters['awsAccountIds'] = list(set(event_filters['awsAccountIds']) & allowed_account_ids)
-        else:
-            event_filters['awsAccountIds'] = list(allowed_account_ids)
-        account_info['event_filter'] = event_filters
+        value = item.get(attribute)
+        from_time, to_time = get_time_range(event_filters, filter_name)
+        to_time = to_time or datetime.now(timezone.utc).isoformat()
+        if value is None or (from_time and value < from_time) or value > to_time:
+            return False
+    return True
+
+def query_member_account_index(management_account_id, member_account_id, start_from=None, start_to=None,
+                               descending=False):
+    """
+    在受影响账户表的反向索引上查询影响某个成员账户的事件(自动翻页)。
 
-    if unauthorized_accounts:
-        print(f"Warning: Skipped {unauthorized_accounts}. Because User {user_id} is not authorized to access these accounts.")
+    返回:
+    list: [(StartTime, EventArn), ...]，按 StartTime 有序
+    """
+    key_condition = 'AccountId = :member'
+    values = {':member': {'S': member_account_id}, ':management': {'S': management_account_id}}
+    if start_from and start_to:
+        key_condition += ' AND StartTime BETWEEN :start_from AND :start_to'
+    elif start_from:
+        key_condition += ' AND StartTime >= :start_from'
+    elif start_to:
+        key_condition += ' AND StartTime <= :start_to'
+    if start_from:
+        values[':start_from'] = {'S': start_from}
+    if start_to:
+        values[':start_to'] = {'S': start_to}
+
+    refs = []
+    for page in dynamodb_client.get_paginator('query').paginate(
+        TableName=AFFECTED_ACCOUNTS_TABLE_NAME,
+        IndexName=MEMBER_ACCOUNT_INDEX_NAME,
+        KeyConditionExpression=key_condition,
+        FilterExpression='ManagementAccountId = :management',
+        ExpressionAttributeValues=values,
+        ScanIndexForward=not descending
+    ):
+        refs.extend((item['StartTime']['S'], item['EventArn']['S']) for item in page['Items'])
+    return refs
+
+def batch_get_events(keys):
+    """批量读取 HealthEvents 表中的事件，返回 {EventArn: 条目}。"""
+    return {item['EventArn']: item for item in batch_get_all(HEALTH_EVENTS_TABLE_NAME, keys)}
+
+def query_member_account_events(account_id, event_filter, shard_config, descending=False):
+    """
+    查询一个管理账户下影响指定成员账户(event_filter 中的 awsAccountIds)的事件。
 
-    return accounts
+    先在反向索引上按成员账户 Query 出 (StartTime, EventArn)，再按 StartTime 的顺序
+    分批读取事件条目并在内存中应用其它过滤条件。这是一个惰性的生成器，
+    和分区查询的结果一起归并，只取前 limit 条时不会读取多余的事件。
+    """
+    start_from, start_to = get_time_range(event_filter, 'startTime')
+    member_account_ids = list(dict.fromkeys(event_filter['awsAccountIds']))
+    with ThreadPoolExecutor(max_workers=min(len(member_account_ids), DB_QUERY_MAX_WORKERS)) as executor:
+        member_refs = executor.map(
+            lambda member: query_member_account_index(account_id, member, start_from, start_to, descending),
+            member_account_ids)
+        # 一个事件可能影响多个成员账户，去重
+        refs = dict((event_arn, start_time) for refs in member_refs for start_time, event_arn in refs)
+
+    ordered_refs = sorted(refs.items(), key=lambda ref: ref[1], reverse=descending)
+    for i in range(0, len(ordered_refs), 100):
+        chunk = ordered_refs[i:i+100]
+        events = batch_get_events([
+            {'AccountId': event_partition_key(account_id, event_arn, start_time, shard_config), 'EventArn': event_arn}
+            for event_arn, start_time in chunk
+        ])
+        for event_arn, _ in chunk:
+            item = events.get(event_arn)
+            if item and event_matches_filter(item, event_filter, key_filters=('startTime',)):
+                yield item
+
+def query_events_from_db(accounts, account_settings=None, order='asc', limit=None):
+    """
+    从数据库中查询健康事件。
 
+    所有管理账户(以及分片后的各个分区)并发查询，每个分区的结果按 StartTime 有序，
+    最后多路归并成一个按 StartTime 排序的列表，AccountId 统一还原成管理账户ID。
+    过滤条件中指定了成员账户(awsAccountIds)的管理账户走反向索引，不读取整个分区。
 
-def query_events_from_db(accounts):
-    """从数据库中查询健康事件。"""
-    all_events = []
-    for account_id, account_info in accounts.items():
-        event_filter = account_info['event_filter']
-        events = fetch_health_events_from_db(event_filter)
-        all_events.extend(events)
+    指定 limit 时(例如"最新的 50 条")，每个分区只并发读取第一页(每页最多 limit 条)，
+    归并时某个分区的第一页用完了才继续读它的下一页，读取量和 limit 成正比，和总数据量无关。
+    """
+    if account_settings is None:
+        account_settings = get_account_settings(accounts.keys())
+
+    descending = order == 'desc'
+    queries = plan_db_queries(accounts, account_settings, descending, limit)
+    member_events = [
+        query_member_account_events(account_id, account_info['event_filter'],
+                                    get_shard_config(account_settings.get(account_id)), descending)
+        for account_id, account_info in accounts.items()
+        if (account_info.get('event_filter') or {}).get('awsAccountIds')
+    ]
+    if not queries and not member_events:
+        return []
+
+    start = time.monotonic()
+    partition_events = []
+    if queries:
+        with ThreadPoolExecutor(max_workers=min(len(queries), DB_QUERY_MAX_WORKERS)) as executor:
+            if limit:
+                first_pages = list(executor.map(query_page, queries))
+                partition_events = [iter_partition_events(params, page) for params, page in zip(queries, first_pages)]
+            else:
+                partition_events = list(executor.map(query_partition_events, queries))
+
+    merged = heapq.merge(*partition_events, *member_events,
+                         key=lambda item: item.get('StartTime', ''), reverse=descending)
+    all_events = [to_management_item(item) for item in itertools.islice(merged, limit)]
+    print(f"Queried {len(all_events)} events from {len(queries)} partitions and "
+          f"{len(member_events)} member account lookups in {time.monotonic() - start:.2f}s")
     return all_events
 
-def query_events_from_api(accounts):
-    """从 API 查询健康事件。"""
-    all_events = []
-    for account_id, account_info in accounts.items():
-        role_name = account_info['cross_account_role']
-        event_filters = account_info['event_filter']
-        credentials = assume_role(account_id, role_name)
-        events = fetch_health_events_from_api(credentials, event_filters)
-        all_events.extend(events)
+def query_events_from_db_cached(accounts, allowed_account_ids, generation, projection=None, account_settings=None,
+                                order='asc', limit=None):
+    """
+    带结果缓存的数据库查询。
+
+    缓存键由 (用户允许访问的账户集合, 规整后的过滤条件, 投影字段, 排序, 条数) 组成，
+    调用方每次查询先读一次数据版本号，版本号没变就直接返回内存中的结果。
+    """
+    cache_key = make_cache_key(allowed_account_ids, accounts, projection, order, limit)
+
+    cached_events = query_cache.get(cache_key, generation)
+    if cached_events is not None:
+        print(f"Query cache hit (generation {generation}), stats: {query_cache.stats()}")
+        return cached_events
+
+    all_events = query_events_from_db(accounts, account_settings, order, limit)
+    if projection:
+        all_events = [{k: e[k] for k in projection if k in e} for e in all_events]
+
+    # 缓存前一次性转换 Decimal，之后命中缓存时编码不再经过 default 钩子
+    all_events = convert_decimals(all_events)
+    query_cache.put(cache_key, all_events, generation)
+    print(f"Query cache miss (generation {generation}), stats: {query_cache.stats()}")
     return all_events
 
-def parse_event(event):
+def query_account_events_from_api(account_id, account_info, deadline):
+    """查询单个管理账户的健康事件，返回 (事件列表, 状态)。"""
+    start = time.monotonic()
+    try:
+        health_client = get_health_client(account_id, account_info['cross_account_role'])
+        events, truncated = fetch_health_events_from_api(health_client, account_info['event_filter'], deadline)
+        status = {'status': 'partial' if truncated else 'ok', 'event_count': len(events)}
+    except Exception as e:
+        print(f"Error querying health events for management account {account_id}: {str(e)}")
+        events = []
+        status = {'status': 'error', 'event_count': 0, 'error': str(e)}
+    status['elapsed_seconds'] = round(time.monotonic() - start, 3)
+    return events, status
+
+def query_events_from_api(accounts, deadline_seconds=API_ACCOUNT_DEADLINE_SECONDS):
     """
-    解析事件，根据不同来源进行解析。
+    从 API 并发查询所有管理账户的健康事件。
 
-    参数:
-    event (dict): 原始事件字典
+    返回:
+    tuple: (所有事件列表, {管理账户ID: 状态})
+    """
+    events_by_account, account_status = query_events_from_api_by_account(accounts, deadline_seconds)
+    all_events = [event for events in events_by_account.values() for event in events]
+    return all_events, account_status
+
+def query_events_from_api_by_account(accounts, deadline_seconds=API_ACCOUNT_DEADLINE_SECONDS):
+    """
+    从 API 并发查询所有管理账户的健康事件，按管理账户分组返回。
+
+    每个账户有独立的截止时间：到期时停止翻页并返回已拿到的部分结果，
+    完全没有返回的账户标记为 timeout，不会让整个请求失败或超时。
+
+    返回:
+    tuple: ({管理账户ID: 事件列表}, {管理账户ID: 状态})
+    """
+    events_by_account = {}
+    account_status = {}
+    if not accounts:
+        return events_by_account, account_status
+
+    deadline = time.monotonic() + deadline_seconds
+    executor = ThreadPoolExecutor(max_workers=min(len(accounts), API_MAX_WORKERS))
+    futures = {
+        executor.submit(query_account_events_from_api, account_id, account_info, deadline): account_id
+        for account_id, account_info in accounts.items()
+    }
+    # 给最后一页的请求留一点返回的时间
+    done, not_done = wait(futures, timeout=deadline_seconds + 5)
+    # 不等待超时的线程结束，直接返回
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    for future in done:
+        events, status = future.result()
+        events_by_account[futures[future]] = events
+        account_status[futures[future]] = status
+    for future in not_done:
+        account_id = futures[future]
+        print(f"Querying health events for management account {account_id} timed out after {deadline_seconds}s")
+        account_status[account_id] = {'status': 'timeout', 'event_count': 0, 'elapsed_seconds': deadline_seconds}
+
+    return events_by_account, account_status
+
+def get_sync_watermarks(account_settings):
+    """
+    从管理账户设置中取出各管理账户的同步水位(fetch_health_events 最后一次成功同步的时间)。
+
+    返回:
+    dict: 键为管理账户ID，值为 LastSyncTime 字符串(没有同步过的账户不在结果中)
+    """
+    return {account_id: item['LastSyncTime'] for account_id, item in account_settings.items()
+            if item.get('LastSyncTime')}
+
+def parse_time(value):
+    """把 ISO 格式的时间字符串(或 datetime)解析成带时区的 datetime，没有时区的按 UTC 处理。"""
+    parsed = value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def build_delta_accounts(accounts, watermarks):
+    """
+    为每个管理账户构造只拉取水位之后更新过的事件的过滤条件。
+    没有水位(从未同步过)的账户拉取全部匹配的事件。
+    开始时间限制在数据库的保留窗口(LOOKBACK_DAYS)内，和数据库部分覆盖的事件范围一致。
+    """
+    lookback_start = datetime.now(timezone.utc) - timedelta(days=LOOKBACK_DAYS)
+    delta_accounts = {}
+    for account_id, account_info in accounts.items():
+        event_filter = dict(account_info.get('event_filter', {}))
+        start_time = dict(event_filter.get('startTime', {}))
+        if not start_time.get('from') or parse_time(start_time['from']) < lookback_start:
+            start_time['from'] = lookback_start.isoformat()
+        event_filter['startTime'] = start_time
+        watermark = watermarks.get(account_id)
+        if watermark:
+            last_updated = dict(event_filter.get('lastUpdatedTime', {}))
+            requested_from = last_updated.get('from')
+            if not requested_from or parse_time(requested_from) < parse_time(watermark):
+                last_updated['from'] = watermark
+            event_filter['lastUpdatedTime'] = last_updated
+        delta_accounts[account_id] = {**account_info, 'event_filter': event_filter}
+    return delta_accounts
+
+def sort_and_limit(events, time_key, order='asc', limit=None):
+    """按开始时间排序并截取前 limit 条(用于 API 和混合模式，数据库模式在查询时已经完成)。"""
+    events = sorted(events, key=lambda e: convert_datetime_to_string(e.get(time_key) or ''), reverse=order == 'desc')
+    return events[:limit] if limit else events
+
+def query_events_hybrid(accounts, allowed_account_ids, generation, deadline_seconds, order='asc', limit=None):
+    """
+    混合模式：数据库中已有的事件 + 每个管理账户同步水位之后在 API 中更新过的事件。
+
+    API 拉取到的事件转换成和数据库一致的结构，按 (AccountId, EventArn) 覆盖数据库中的旧版本。
+    增量事件只用于本次响应，不写回数据库：事件的详情、受影响账户和各个索引只由 fetch_health_events 写入。
+    指定 limit 时，数据库部分只读最新(或最早)的 limit 条，和增量合并后再截取。
 
     返回:
-    dict: 解析后的事件字典
-    """
-    if 'body' in event:
-        try:
-            body = json.loads(event['body'])
-            if 'body' in body:
-                body = json.loads(body['body'])
-            return body
-        except json.JSONDecodeError:
-            return {}
-    return event
+    tuple: (合并后的事件列表, {管理账户ID: 状态})
+    """
+    account_settings = get_account_settings(accounts.keys())
+    db_events = query_events_from_db_cached(accounts, allowed_account_ids, generation,
+                                            account_settings=account_settings, order=order, limit=limit)
+
+    watermarks = get_sync_watermarks(account_settings)
+    delta_accounts = build_delta_accounts(accounts, watermarks)
+    delta_events_by_account, account_status = query_events_from_api_by_account(delta_accounts, deadline_seconds)
+
+    merged_events = {(e['AccountId'], e['EventArn']): e for e in db_events}
+    delta_count = 0
+    for account_id, events in delta_events_by_account.items():
+        account_status[account_id]['watermark'] = watermarks.get(account_id)
+        for event in events:
+            item = build_event_item(event, account_id)
+            merged_events[(account_id, item['EventArn'])] = item
+            delta_count += 1
+
+    print(f"Hybrid query: {len(db_events)} events from DB, {delta_count} updated events from API")
+
+    return sort_and_limit(merged_events.values(), 'StartTime', order, limit), account_status
 
 def lambda_handler(event, context):
     """
@@ -271,7 +605,12 @@ def lambda_handler(event, context):
             },
             "management_account2": { ... }
         },
-        "from_db": true 或 false
+        "from_db": true 或 false,
+        "mode": "db" | "api" | "hybrid",  // 可选，优先于 from_db；hybrid 为数据库 + 上次同步后的实时增量
+        "deadline_seconds": 20,  // 可选，from_db 为 false 时每个管理账户的超时时间，正数，超过 API_MAX_DEADLINE_SECONDS 时取上限
+        "projection": ["EventArn", "StartTime", ...],  // 可选，只返回这些字段(对 db 和 hybrid 模式生效)
+        "order": "asc" | "desc",  // 可选，按 StartTime 排序的方向，默认 asc
+        "limit": 50               // 可选，只返回排序后的前 limit 条，例如 desc + 50 即最新的 50 条
     }
 
     响应格式：
@@ -280,28 +619,73 @@ def lambda_handler(event, context):
         "body": "事件列表的 JSON 字符串"
     }
     """
-    # 解析事件
+    # 解析事件(保留原始事件，用于读取 Accept/Accept-Encoding 请求头)
+    request_event = event
     event = parse_event(event)
     print("Parsed event:", json.dumps(event, indent=2))
 
     user_id = event['user_id']
     accounts = event['accounts']
     from_db = event.get('from_db', True)
+    mode = event.get('mode') or ('db' if from_db else 'api')
+    projection = event.get('projection')
+    deadline_seconds = event.get('deadline_seconds', API_ACCOUNT_DEADLINE_SECONDS)
+    try:
+        if isinstance(deadline_seconds, bool):
+            raise ValueError(deadline_seconds)
+        deadline_seconds = float(deadline_seconds)
+    except (ValueError, TypeError):
+        deadline_seconds = None
+    if deadline_seconds is None or not math.isfinite(deadline_seconds) or deadline_seconds <= 0:
+        return create_response(400, f"Invalid deadline_seconds: {event.get('deadline_seconds')}. "
+                                    f"Must be a positive number")
+    deadline_seconds = min(deadline_seconds, API_MAX_DEADLINE_SECONDS)
+    order = event.get('order', 'asc')
+    limit = event.get('limit')
+    if order not in ('asc', 'desc'):
+        return create_response(400, f"Invalid order: {order}. Must be one of ['asc', 'desc']")
+    if limit is not None and (not isinstance(limit, int) or isinstance(limit, bool) or limit <= 0):
+        return create_response(400, f"Invalid limit: {limit}. Must be a positive integer")
 
     # 检查用户权限，并合并过滤条件
-    accounts = check_update_allowed_accounts(user_id, accounts)
+    accounts, allowed_account_ids = check_update_allowed_accounts(user_id, accounts)
     print(f"Fetching events for {accounts}")
 
-    if from_db:
-        # 从数据库中查询健康事件
-        all_events = query_events_from_db(accounts)
+    etag = None
+    account_status = None
+    if mode == 'db':
+        # 数据版本号+规整后的请求决定了响应内容，客户端已有相同的数据时直接返回304
+        generation = get_data_generation(accounts_table)
+        etag = compute_etag(generation, allowed_account_ids, accounts, projection, order, limit)
+        if etag_matches(request_event, etag):
+            print(f"ETag {etag} matched, returning 304")
+            return not_modified_response(etag)
+
+        # 从数据库中查询健康事件(数据没有更新时直接使用缓存结果)
+        all_events = query_events_from_db_cached(accounts, allowed_account_ids, generation, projection,
+                                                 order=order, limit=limit)
+    elif mode == 'hybrid':
+        # 数据库 + 上次同步后在 API 中更新过的事件
+        generation = get_data_generation(accounts_table)
+        all_events, account_status = query_events_hybrid(accounts, allowed_account_ids, generation,
+                                                         deadline_seconds, order, limit)
+        if projection:
+            all_events = [{k: e[k] for k in projection if k in e} for e in all_events]
+    elif mode == 'api':
+        # 从 API 并发查询健康事件，超时的账户返回部分结果
+        all_events, account_status = query_events_from_api(accounts, deadline_seconds)
+        if 'order' in event or limit:
+            all_events = sort_and_limit(all_events, 'startTime', order, limit)
     else:
-        # 从 API 查询健康事件
-        all_events = query_events_from_api(accounts)
+        return create_response(400, f"Invalid mode: {mode}. Must be one of ['db', 'api', 'hybrid']")
 
     print(f"Fetched {len(all_events)} health events")
+    data = {"all_events": all_events}
+    if account_status is not None:
+        data["account_status"] = account_status
     return create_response(200, 
                            "Fetched health events data successfully",
-                           {
-                            "all_events": all_events
-                           })
\ No newline at end of file
+                           data,
+                           request_event=request_event,
+                           ndjson_key="all_events",
+                           etag=etag)
\ No newline at end of file
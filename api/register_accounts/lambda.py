@@ -1,7 +1,6 @@
 import json
 import boto3
 import re
-from collections import defaultdict
 
 # 在deploy/data_collection/cdk_infra/backend_stack.py中把common/打包为
 # Lambda Layer, 导致最终的layer是没有common/这一层目录. 所以，使用
@@ -10,19 +9,27 @@ try:
     # 本地开发时使用
     from common.utils import create_response, parse_event
     from common.constants import ACCOUNTS_TABLE_NAME, USERS_TABLE_NAME, LAMBDA_ROLE
+    from common.batch_get import batch_get_all
+    from common.memberships import write_memberships
 except ImportError:
     # 部署到 Lambda 时使用
     from utils import create_response, parse_event
     from constants import ACCOUNTS_TABLE_NAME, USERS_TABLE_NAME, LAMBDA_ROLE
+    from batch_get import batch_get_all
+    from memberships import write_memberships
 
 
 iam_client = boto3.client('iam')
 
 # 初始化DynamoDB客户端
-dynamodb = boto3.resource('dynamodb')
 dynamodb_client = boto3.client('dynamodb')
-accounts_table = dynamodb.Table(ACCOUNTS_TABLE_NAME)
-users_table = dynamodb.Table(USERS_TABLE_NAME)
+
+# Lambda 角色中允许 sts:AssumeRole 到各管理账户跨账户角色的内联策略。
+# 一个角色的所有内联策略合计不能超过 10,240 个字符(不含空白)，CDK 创建的 DefaultPolicy 也计算在内
+ASSUME_ROLE_POLICY_NAME = 'AssumeRolePolicy'
+IAM_INLINE_POLICY_LIMIT = 10240
+# 并发注册会覆盖彼此对策略的写入：写入后重新读取校验，缺少的角色再合并写入
+ASSUME_ROLE_POLICY_RETRIES = 3
 
 # 邮箱格式校验的正则表达式
 email_regex = re.compile(r"[^@]+@[^@]+\.[^@]+")
@@ -39,28 +46,32 @@ def validate_email(email):
     """
     return email_regex.match(email) is not None
 
-def account_exists(account_id):
+def get_existing_account_ids(account_ids):
     """
-    检查账户是否已存在。
+    批量检查账户是否已存在。
 
     参数:
-    account_id (str): 账户ID
+    account_ids (list): 账户ID列表
 
     返回:
-    bool: 如果账户已存在则返回True，否则返回False
+    set: 已存在的账户ID
     """
-    response = accounts_table.get_item(Key={'AccountId': account_id})
-    return 'Item' in response
+    items = batch_get_all(ACCOUNTS_TABLE_NAME, [{'AccountId': account_id} for account_id in account_ids],
+                          projection='AccountId')
+    return {item['AccountId'] for item in items}
 
-def prepare_transact_items(account_id, cross_account_role, valid_emails, user_updates):
+def prepare_transact_items(account_id, cross_account_role, valid_emails, user_names, memberships):
     """
     准备DynamoDB的事务写入项。
 
+    成员关系不放在管理账户条目中，收集到 memberships 里，之后批量写入成员关系表。
+
     参数:
     account_id (str): 账户ID
     cross_account_role (str): 跨账户角色名称
     valid_emails (dict): 有效的邮箱信息
-    user_updates (dict): 用户更新信息
+    user_names (dict): 用户ID -> 用户名，用于创建用户条目
+    memberships (list): (账户ID, 用户ID, 用户名) 的列表
 
     返回:
     list: 事务写入项列表
@@ -71,8 +82,7 @@ def prepare_transact_items(account_id, cross_account_role, valid_emails, user_up
                 'TableName': ACCOUNTS_TABLE_NAME,
                 'Item': {
                     'AccountId': {'S': account_id},
-                    'CrossAccountRole': {'S': cross_account_role},
-                    'AllowedUsers': {'M': {email: {'S': name} for email, name in valid_emails.items()}}
+                    'CrossAccountRole': {'S': cross_account_role}
                 },
                 'ConditionExpression': 'attribute_not_exists(AccountId)'
             }
@@ -80,55 +90,157 @@ def prepare_transact_items(account_id, cross_account_role, valid_emails, user_up
     ]
     
     for email, name in valid_emails.items():
-        if email not in user_updates:
-            user_updates[email] = {'account_ids': set(), 'name': name}
-        user_updates[email]['account_ids'].add(account_id)
+        user_names.setdefault(email, name)
+        memberships.append((account_id, email, name))
     
     return transact_items
 
-def update_lambda_assume_role_policy(account_id, cross_account_role):
-    try:
-        role_arn = f"arn:aws:iam::{account_id}:role/{cross_account_role}"
-        
-        policy_document = {
-            "Version": "2012-10-17",
-            "Statement": [
-                {
-                    "Effect": "Allow",
-                    "Action": "sts:AssumeRole",
-                    "Resource": [role_arn]
-                }
-            ]
-        }
+def compact_json(document):
+    """IAM 计算策略大小时不算空白，写入和计算大小都使用紧凑格式。"""
+    return json.dumps(document, separators=(',', ':'))
+
+def split_role_arn(role_arn):
+    """arn:aws:iam::123456789012:role/Name -> (('aws', 'role/Name'), '123456789012')"""
+    _, partition, _, _, account_id, resource = role_arn.split(':', 5)
+    return (partition, resource), account_id
+
+def add_grant(grants, role, account_ids):
+    """account_ids 为 None 表示该角色名在所有账户中都允许(通配符)。"""
+    if account_ids is None or grants.get(role, set()) is None:
+        grants[role] = None
+    else:
+        grants.setdefault(role, set()).update(account_ids)
+
+def grant_covers(grants, role_arn):
+    role, account_id = split_role_arn(role_arn)
+    if role not in grants:
+        return False
+    return grants[role] is None or account_id in grants[role]
 
-        existing_policies = iam_client.list_role_policies(RoleName=LAMBDA_ROLE)
-        print(f"Existing policy for role {LAMBDA_ROLE}: {existing_policies}")
-        
-        if 'AssumeRolePolicy' in existing_policies['PolicyNames']:
-            existing_policy = iam_client.get_role_policy(
+def read_assume_role_grants(document):
+    """
+    从策略文档中读出已允许的角色：{(partition, 'role/Name'): 账户ID集合，或 None 表示所有账户}。
+
+    兼容 render_assume_role_policy 生成的三种格式。
+    """
+    grants = {}
+    for statement in document.get('Statement', []):
+        actions = statement.get('Action')
+        actions = [actions] if isinstance(actions, str) else actions or []
+        if statement.get('Effect') != 'Allow' or 'sts:AssumeRole' not in actions:
+            continue
+        resources = statement.get('Resource', [])
+        resources = [resources] if isinstance(resources, str) else resources
+        condition_accounts = statement.get('Condition', {}).get('StringEquals', {}).get('aws:ResourceAccount')
+        if isinstance(condition_accounts, str):
+            condition_accounts = [condition_accounts]
+        for resource in resources:
+            role, account_id = split_role_arn(resource)
+            if account_id != '*':
+                add_grant(grants, role, [account_id])
+            else:
+                add_grant(grants, role, condition_accounts)
+    return grants
+
+def render_assume_role_policy(grants, budget):
+    """
+    生成策略文档，依次尝试三种格式，返回第一个不超过 budget 个字符的：
+    1. 每个角色一个完整的 ARN(每个账户约 45 个字符，和之前的格式相同)；
+    2. 同名的角色合并成 arn:aws:iam::*:role/Name，用 aws:ResourceAccount 条件限定账户(每个账户约 15 个字符)；
+    3. 只保留 arn:aws:iam::*:role/Name。管理账户中的跨账户角色只信任 Lambda 角色，
+       所以 AssumeRole 仍然只能用于已经部署了跨账户角色的账户。
+
+    异常:
+    ValueError: 三种格式都超过了 budget
+    """
+    def wildcard_arn(role):
+        partition, resource = role
+        return f"arn:{partition}:iam::*:{resource}"
+
+    def explicit_arns(role, account_ids):
+        partition, resource = role
+        return [f"arn:{partition}:iam::{account_id}:{resource}" for account_id in sorted(account_ids)]
+
+    def document(statements):
+        return {"Version": "2012-10-17", "Statement": statements}
+
+    roles = sorted(grants)
+    wildcard_roles = [wildcard_arn(role) for role in roles if grants[role] is None]
+    scoped_roles = [role for role in roles if grants[role] is not None]
+
+    explicit = [{
+        "Effect": "Allow",
+        "Action": "sts:AssumeRole",
+        "Resource": wildcard_roles + [arn for role in scoped_roles for arn in explicit_arns(role, grants[role])]
+    }]
+    conditioned = ([{"Effect": "Allow", "Action": "sts:AssumeRole", "Resource": wildcard_roles}] if wildcard_roles else []) + [{
+        "Effect": "Allow",
+        "Action": "sts:AssumeRole",
+        "Resource": wildcard_arn(role),
+        "Condition": {"StringEquals": {"aws:ResourceAccount": sorted(grants[role])}}
+    } for role in scoped_roles]
+    wildcard = [{"Effect": "Allow", "Action": "sts:AssumeRole", "Resource": [wildcard_arn(role) for role in roles]}]
+
+    for statements in (explicit, conditioned, wildcard):
+        candidate = document(statements)
+        if len(compact_json(candidate)) <= budget:
+            return candidate
+    raise ValueError(f"{ASSUME_ROLE_POLICY_NAME} does not fit in {budget} characters even with wildcards")
+
+def load_assume_role_grants():
+    """
+    读取 Lambda 角色的内联策略。
+
+    返回:
+    tuple: (AssumeRolePolicy 中已允许的角色, AssumeRolePolicy 可以使用的字符数)
+    """
+    grants = {}
+    other_policies_size = 0
+    for policy_name in iam_client.list_role_policies(RoleName=LAMBDA_ROLE)['PolicyNames']:
+        document = iam_client.get_role_policy(RoleName=LAMBDA_ROLE, PolicyName=policy_name)['PolicyDocument']
+        if policy_name == ASSUME_ROLE_POLICY_NAME:
+            grants = read_assume_role_grants(document)
+        else:
+            other_policies_size += len(compact_json(document))
+    return grants, IAM_INLINE_POLICY_LIMIT - other_policies_size
+
+def update_lambda_assume_role_policy(role_arns):
+    """
+    允许 Lambda 角色 AssumeRole 到一批跨账户角色：合并到现有的策略中，一次写入。
+
+    写入后重新读取校验，被并发注册覆盖掉的角色在下一轮重新合并写入。
+
+    参数:
+    role_arns (list): 跨账户角色的ARN列表
+
+    返回:
+    bool: 成功与否
+    """
+    try:
+        for attempt in range(ASSUME_ROLE_POLICY_RETRIES + 1):
+            grants, budget = load_assume_role_grants()
+            missing = [role_arn for role_arn in role_arns if not grant_covers(grants, role_arn)]
+            if not missing:
+                print(f"{ASSUME_ROLE_POLICY_NAME} includes all {len(role_arns)} roles")
+                return True
+            if attempt == ASSUME_ROLE_POLICY_RETRIES:
+                break
+
+            for role_arn in missing:
+                role, account_id = split_role_arn(role_arn)
+                add_grant(grants, role, [account_id])
+            policy_document = render_assume_role_policy(grants, budget)
+            iam_client.put_role_policy(
                 RoleName=LAMBDA_ROLE,
-                PolicyName='AssumeRolePolicy'
+                PolicyName=ASSUME_ROLE_POLICY_NAME,
+                PolicyDocument=compact_json(policy_document)
             )
-            existing_policy_document = existing_policy['PolicyDocument']
-            print(f"Existing policy document: {existing_policy_document}")
-            
-            for statement in existing_policy_document['Statement']:
-                if statement['Action'] == "sts:AssumeRole" and role_arn in statement['Resource']:
-                    print(f"AssumeRole policy already includes {role_arn}")
-                    return True
-
-            existing_policy_document['Statement'][0]['Resource'].append(role_arn)
-            policy_document = existing_policy_document
-        
-        print(f"New policy document: {policy_document}")
-
-        iam_client.put_role_policy(
-            RoleName=LAMBDA_ROLE,
-            PolicyName='AssumeRolePolicy',
-            PolicyDocument=json.dumps(policy_document)
-        )
-        print(f"Successfully updated policy to allow {LAMBDA_ROLE} to assume {role_arn}")
-        return True
+            print(f"Added {len(missing)} roles to {ASSUME_ROLE_POLICY_NAME} "
+                  f"({len(compact_json(policy_document))}/{budget} characters)")
+
+        print(f"{ASSUME_ROLE_POLICY_NAME} is still missing {len(missing)} roles after "
+              f"{ASSUME_ROLE_POLICY_RETRIES} attempts: {missing}")
+        return False
     except Exception as e:
         print(f"Failed to update Lambda assume role policy. Reason: {str(e)}")
         return False
@@ -169,7 +281,8 @@ def lambda_handler(event, context):
 
     transact_items = []
     assume_roles = {}
-    user_updates = defaultdict(lambda: {'account_ids': set(), 'name': ''})
+    user_names = {}
+    memberships = []
 
     for account_id, account_info in event.items():
         print(f"Processing account_id: {account_id}")
@@ -180,12 +293,6 @@ def lambda_handler(event, context):
             print(message)
             return create_response(400, message)
 
-        # 检查AccountId是否已存在
-        if account_exists(account_id):
-            message = f'AccountId already exists: {account_id}'
-            print(message)
-            return create_response(400, message)
-
         cross_account_role = account_info.get('cross_account_role')
         if not cross_account_role:
             message = f'Missing cross_account_role for AccountId: {account_id}'
@@ -202,25 +309,30 @@ def lambda_handler(event, context):
                 print(message)
                 return create_response(400, message)
 
-        transact_items.extend(prepare_transact_items(account_id, cross_account_role, valid_emails, user_updates))
+        transact_items.extend(prepare_transact_items(account_id, cross_account_role, valid_emails, user_names, memberships))
         assume_roles[account_id] = cross_account_role
 
-    # 先更新IAM assume role policy，失败了提前退出, 不做后面的注册动作
-    for account_id, cross_account_role in assume_roles.items():
-        if not update_lambda_assume_role_policy(account_id, cross_account_role):
-            return create_response(500, f"Failed to update IAM assume_role policy for account {account_id}'s role {cross_account_role}.")
+    # 批量检查AccountId是否已存在
+    existing_account_ids = get_existing_account_ids(list(assume_roles))
+    if existing_account_ids:
+        message = f"AccountId already exists: {', '.join(sorted(existing_account_ids))}"
+        print(message)
+        return create_response(400, message)
+
+    # 先更新IAM assume role policy(所有账户合并后一次写入)，失败了提前退出, 不做后面的注册动作
+    role_arns = [f"arn:aws:iam::{account_id}:role/{cross_account_role}"
+                 for account_id, cross_account_role in assume_roles.items()]
+    if role_arns and not update_lambda_assume_role_policy(role_arns):
+        return create_response(500, f"Failed to update IAM assume_role policy for {len(role_arns)} accounts.")
         
     # 添加用户更新项到事务中
-    for email, data in user_updates.items():
-        account_ids = list(data['account_ids'])
-        user_name = data['name']
+    for email, user_name in user_names.items():
         transact_items.append({
             'Update': {
                 'TableName': USERS_TABLE_NAME,
                 'Key': {'UserId': {'S': email}}, # 这个key必须与backend_stack.py中创建表时的key一致
-                'UpdateExpression': 'ADD AllowedAccountIds :account_ids SET UserName = if_not_exists(UserName, :user_name)',
+                'UpdateExpression': 'SET UserName = if_not_exists(UserName, :user_name)',
                 'ExpressionAttributeValues': {
-                    ':account_ids': {'SS': account_ids},  # 确保 AllowedAccountIds 是 String Set 类型
                     ':user_name': {'S': user_name}
                 }
             }
@@ -239,4 +351,12 @@ def lambda_handler(event, context):
             print(f"Failed to store data. Reason: {str(e)}")
             return create_response(500, 'Failed to store data.')
 
+    # 账户注册成功后，批量写入成员关系
+    try:
+        count = write_memberships(puts=memberships)
+        print(f"Stored {count} account memberships.")
+    except Exception as e:
+        print(f"Failed to store account memberships. Reason: {str(e)}")
+        return create_response(500, 'Failed to store account memberships.')
+
     return create_response(200, 'Accounts registered successfully.')
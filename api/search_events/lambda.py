@@ -0,0 +1,184 @@
+import json
+import math
+import re
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+
+# 在deploy/data_collection/cdk_infra/backend_stack.py中把common/打包为
+# Lambda Layer, 导致最终的layer是没有common/这一层目录. 所以，使用
+# try...except... 这种技巧
+try:
+    # 本地开发时使用
+    from common.utils import create_response, parse_event, encode_next_token, decode_next_token
+    from common.permissions import resolve_account_ids
+    from common.search_index import tokenize, query_term
+except ImportError:
+    # 部署到 Lambda 时使用
+    from utils import create_response, parse_event, encode_next_token, decode_next_token
+    from permissions import resolve_account_ids
+    from search_index import tokenize, query_term
+
+
+DEFAULT_LOOKBACK_DAYS = 90
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 200
+# 并发查询词项的线程数
+TERM_QUERY_MAX_WORKERS = int(os.environ.get('TERM_QUERY_MAX_WORKERS', '8'))
+
+# 双引号括起来的是短语，其它是单个词
+QUERY_REGEX = re.compile(r'"([^"]+)"|(\S+)')
+
+# 短语完整匹配时的额外得分
+PHRASE_BOOST = 2.0
+
+def parse_query(query):
+    """
+    解析查询字符串。
+
+    返回:
+    tuple: (所有词项集合, 短语列表)，短语是 [(相对位置, 词项), ...]，用于校验词项是否相邻
+    """
+    terms = set()
+    phrases = []
+    for phrase, word in QUERY_REGEX.findall(query or ''):
+        tokens = tokenize(phrase or word)
+        terms.update(token for _, token in tokens)
+        if phrase and len(tokens) > 1:
+            first_position = tokens[0][0]
+            phrases.append([(position - first_position, token) for position, token in tokens])
+    return terms, phrases
+
+def parse_day(value, default):
+    """把请求中的时间(ISO 格式的日期或时间)转成日期。"""
+    if not value:
+        return default
+    return datetime.fromisoformat(str(value)).date() if 'T' in str(value) else date.fromisoformat(str(value))
+
+def load_postings(terms, start_day, end_day):
+    """
+    并发查询所有词项在时间范围内的倒排项(每个词项一次 Query，日期作为排序键的范围条件)。
+
+    返回:
+    dict: {词项: {事件ARN: [StartTime, 管理账户ID, 位置列表]}}
+    """
+    terms = list(terms)
+    with ThreadPoolExecutor(max_workers=min(len(terms), TERM_QUERY_MAX_WORKERS)) as executor:
+        return dict(zip(terms, executor.map(
+            lambda term: query_term(term, start_day.isoformat(), end_day.isoformat()), terms)))
+
+def matches_phrase(postings, event_arn, phrase):
+    """判断短语中的词项在事件中是否按顺序相邻出现。"""
+    first_offset, first_term = phrase[0]
+    for start in postings[first_term][event_arn][2]:
+        base = start - first_offset
+        if all(base + offset in set(postings[term][event_arn][2]) for offset, term in phrase[1:]):
+            return True
+    return False
+
+def search(terms, phrases, postings, account_ids, start_time, end_time):
+    """
+    在倒排表中检索同时包含所有词项的事件，按 TF-IDF 打分排序。
+
+    返回:
+    list: 按得分从高到低排序的结果列表
+    """
+    if not terms or any(not postings[term] for term in terms):
+        return []
+
+    # 从文档频率最低的词项开始求交集，候选集最小
+    ordered_terms = sorted(terms, key=lambda term: len(postings[term]))
+    candidates = set(postings[ordered_terms[0]])
+    for term in ordered_terms[1:]:
+        candidates &= postings[term].keys()
+
+    total_docs = len(set().union(*(postings[term].keys() for term in terms)))
+    idf = {term: math.log(1 + total_docs / len(postings[term])) for term in terms}
+
+    results = []
+    for event_arn in candidates:
+        event_start_time, account_id, _ = postings[ordered_terms[0]][event_arn]
+        if account_ids is not None and account_id not in account_ids:
+            continue
+        if (start_time and event_start_time < start_time) or (end_time and event_start_time > end_time):
+            continue
+        if not all(matches_phrase(postings, event_arn, phrase) for phrase in phrases):
+            continue
+
+        score = sum((1 + math.log(len(postings[term][event_arn][2]))) * idf[term] for term in terms)
+        score += PHRASE_BOOST * len(phrases)
+        results.append({
+            'event_arn': event_arn,
+            'account_id': account_id,
+            'start_time': event_start_time,
+            'score': round(score, 4)
+        })
+
+    results.sort(key=lambda result: (-result['score'], result['start_time']))
+    return results
+
+def lambda_handler(event, context):
+    """
+    Lambda 函数入口，在事件描述的全文索引中检索健康事件。
+
+    请求格式：
+    {
+        "user_id": "用户ID",
+        "query": "RDS certificate \"rotation required\"",  // 双引号中为短语
+        "account_ids": ["123456789012"],   // 可选，默认为用户允许访问的全部管理账户
+        "start_time": "2024-06-01",        // 可选，按事件 StartTime 过滤，默认为90天前
+        "end_time": "2024-08-31T23:59:59", // 可选，默认为现在
+        "page_size": 20,                   // 可选
+        "next_token": "..."                // 可选，上一页返回的 next_token
+    }
+
+    响应格式：
+    {
+        "statusCode": 200,
+        "body": {
+            "results": [{"event_arn": ..., "account_id": ..., "start_time": ..., "score": ...}],
+            "total": 匹配总数,
+            "next_token": "下一页的token，没有下一页时为 null"
+        }
+    }
+    """
+    start = time.time()
+
+    # 解析事件
+    parsed_event = parse_event(event)
+    print("Parsed event:", json.dumps(parsed_event, indent=2))
+
+    user_id = parsed_event.get('user_id')
+    if not user_id:
+        return create_response(400, "'user_id' is required.")
+
+    terms, phrases = parse_query(parsed_event.get('query'))
+    if not terms:
+        return create_response(400, "'query' contains no searchable terms.")
+
+    try:
+        today = datetime.now(timezone.utc).date()
+        start_day = parse_day(parsed_event.get('start_time'), today - timedelta(days=DEFAULT_LOOKBACK_DAYS))
+        end_day = parse_day(parsed_event.get('end_time'), today)
+        offset = decode_next_token(parsed_event.get('next_token'))
+        page_size = min(max(int(parsed_event.get('page_size', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except (ValueError, TypeError, KeyError) as e:
+        return create_response(400, f"Invalid parameter: {str(e)}")
+    account_ids = set(resolve_account_ids(user_id, parsed_event.get('account_ids')))
+
+    postings = load_postings(terms, start_day, end_day)
+    # 只给了日期时，按天的分块已经限定了范围；给了具体时间时再精确过滤
+    start_time = parsed_event.get('start_time') if 'T' in str(parsed_event.get('start_time')) else None
+    end_time = parsed_event.get('end_time') if 'T' in str(parsed_event.get('end_time')) else None
+    results = search(terms, phrases, postings, account_ids, start_time, end_time)
+
+    page = results[offset:offset + page_size]
+    next_offset = offset + page_size
+    print(f"Search {sorted(terms)} matched {len(results)} events in {(time.time() - start) * 1000:.0f} ms")
+
+    return create_response(200, "Searched events successfully", {
+        "results": page,
+        "total": len(results),
+        "next_token": encode_next_token(next_offset) if next_offset < len(results) else None
+    }, request_event=event, ndjson_key="results")
@@ -1,7 +1,6 @@
 import json
 import boto3
 import re
-from boto3.dynamodb.conditions import Key
 
 # 在deploy/data_collection/cdk_infra/backend_stack.py中把common/打包为
 # Lambda Layer, 导致最终的layer是没有common/这一层目录. 所以，使用
@@ -10,16 +9,17 @@ try:
     # 本地开发时使用
     from common.utils import create_response, parse_event
     from common.constants import ACCOUNTS_TABLE_NAME, USERS_TABLE_NAME
+    from common.memberships import get_memberships, write_memberships
 except ImportError:
     # 部署到 Lambda 时使用
     from utils import create_response, parse_event
     from constants import ACCOUNTS_TABLE_NAME, USERS_TABLE_NAME
+    from memberships import get_memberships, write_memberships
 
 # 初始化DynamoDB客户端
 dynamodb_resource = boto3.resource('dynamodb')
 dynamodb_client = boto3.client('dynamodb')
 accounts_table = dynamodb_resource.Table(ACCOUNTS_TABLE_NAME)
-users_table = dynamodb_resource.Table(USERS_TABLE_NAME)
 
 # 邮箱格式校验的正则表达式
 email_regex = re.compile(r"[^@]+@[^@]+\.[^@]+")
@@ -49,125 +49,45 @@ def get_account(account_id):
     response = accounts_table.get_item(Key={'AccountId': account_id})
     return response.get('Item')
 
-def get_user(user_id):
+def create_user_update_transaction(user_id, action, username):
     """
-    从DynamoDB中获取用户信息。
+    创建用户更新事务项目(用户条目只保存用户名，成员关系在成员关系表中)。
 
     参数:
     user_id (str): 用户ID
-
-    返回:
-    dict: 用户信息
-    """
-    response = users_table.get_item(Key={'UserId': user_id})
-    return response.get('Item')
-
-def create_user_update_transaction(user_id, account_id, action, username=None):
-    """
-    创建用户更新事务项目。
-
-    参数:
-    user_id (str): 用户ID
-    account_id (str): 账户ID
-    action (str): 操作类型 ("add", "delete", "update")
-    username (str): 用户名 (可选)
+    action (str): 操作类型 ("add", "update")
+    username (str): 用户名
 
     返回:
     dict: 更新事务项目
     """
     if action == 'add':
-        update_expression = "ADD AllowedAccountIds :account_id SET UserName = if_not_exists(UserName, :user_name)"
-        expression_attribute_values = {':account_id': {'SS': [account_id]}, ':user_name': {'S': username}}
-    elif action == 'delete':
-        update_expression = "DELETE AllowedAccountIds :account_id"
-        expression_attribute_values = {':account_id': {'SS': [account_id]}}
+        update_expression = "SET UserName = if_not_exists(UserName, :user_name)"
     else:
-        update_expression = "SET AllowedAccountIds = :account_id, UserName = :user_name"
-        expression_attribute_values = {':account_id': {'SS': [account_id]}, ':user_name': {'S': username}}
+        update_expression = "SET UserName = :user_name"
 
     return {
         'Update': {
             'TableName': USERS_TABLE_NAME,
             'Key': {'UserId': {'S': user_id}},
             'UpdateExpression': update_expression,
-            'ExpressionAttributeValues': expression_attribute_values,
+            'ExpressionAttributeValues': {':user_name': {'S': username}},
         }
     }
 
-def handle_user_updates(user_ids, account_id, add_users, delete_users, update_users):
-    """
-    处理用户更新，生成事务项目。
-
-    参数:
-    user_ids (set): 用户ID集合
-    account_id (str): 账户ID
-    add_users (dict): 添加的用户字典
-    delete_users (dict): 删除的用户字典
-    update_users (dict): 更新的用户字典
-
-    返回:
-    list: 事务项目列表
-    """
-    transactions = []
-    for user_id in user_ids:
-        user = get_user(user_id)
-        if not user:
-            if user_id in delete_users:
-                print(f"User {user_id} not found, skipping delete.")
-                continue  # 如果是删除操作且用户不存在，跳过
-            print(f"User {user_id} not found, creating new entry.")
-
-        if user_id in add_users:
-            transactions.append(create_user_update_transaction(user_id, account_id, 'add', add_users[user_id]))
-        elif user_id in delete_users:
-            transactions.append(create_user_update_transaction(user_id, account_id, 'delete'))
-        elif user_id in update_users:
-            transactions.append(create_user_update_transaction(user_id, account_id, 'update', update_users[user_id]))
-
-    return transactions
-
-def update_account_users(account_id, users):
-    """
-    更新账户的AllowedUsers。
-
-    参数:
-    account_id (str): 账户ID
-    users (dict): 更新后的用户字典
-
-    返回:
-    dict: 更新事务项目
+def handle_account_update(account_id, params):
     """
-    if users:
-        expression_attribute_values = {':val': {'M': {k: {'S': v} for k, v in users.items()}}}
-    else:
-        expression_attribute_values = {':val': {'M': {}}}
-    
-    print(f"Updating AllowedUsers for account {account_id} with: {expression_attribute_values}")
+    处理账户更新，生成成员关系的写入项和用户更新事务项目。
 
-    return {
-        'Update': {
-            'TableName': ACCOUNTS_TABLE_NAME,
-            'Key': {'AccountId': {'S': account_id}},
-            'UpdateExpression': 'SET AllowedUsers = :val',
-            'ExpressionAttributeValues': expression_attribute_values,
-        }
-    }
-
-def handle_account_update(account_id, existing_account, params):
-    """
-    处理账户更新，生成事务项目。
+    只按键读取本次涉及的用户的成员关系，不需要读取或重写账户的全部成员。
 
     参数:
     account_id (str): 账户ID
-    existing_account (dict): 表中的accout_id对应的对象
     params (dict): 更新参数，包含add, delete, update字典
 
     返回:
-    list: 事务项目列表
+    tuple: (要写入的成员关系, 要删除的成员关系, 用户更新事务项目列表)，参数错误时返回错误响应
     """
-    existing_users = existing_account.get('AllowedUsers', {})
-    print(f"Existing AllowedUsers: {existing_users}")
-
     add_users = params.get('add', {})
     delete_users = params.get('delete', {})
     update_users = params.get('update', {})
@@ -176,25 +96,30 @@ def handle_account_update(account_id, existing_account, params):
     if len(user_ids) != len(add_users) + len(delete_users) + len(update_users):
         return create_response(400, "A user can't be in add/update/delete at the same time.")
 
+    existing_users = get_memberships(account_id, user_ids)
+    print(f"Existing members among {len(user_ids)} users: {existing_users}")
+
+    puts = []
+    deletes = []
+    user_transactions = []
     for user_id, username in add_users.items():
         if user_id in existing_users:
-            print(f"User {user_id} already exists in AllowedUsers, skipping add.")
+            print(f"User {user_id} is already a member of {account_id}, skipping add.")
             continue
-        existing_users[user_id] = username
+        puts.append((account_id, user_id, username))
+        user_transactions.append(create_user_update_transaction(user_id, 'add', username))
 
     for user_id in delete_users.keys():
         if user_id not in existing_users:
-            print(f"User {user_id} not found in AllowedUsers, skipping delete.")
+            print(f"User {user_id} is not a member of {account_id}, skipping delete.")
             continue
-        del existing_users[user_id]
+        deletes.append((account_id, user_id))
 
     for user_id, username in update_users.items():
-        existing_users[user_id] = username
+        puts.append((account_id, user_id, username))
+        user_transactions.append(create_user_update_transaction(user_id, 'update', username))
 
-    account_update_transaction = update_account_users(account_id, existing_users)
-    user_update_transactions = handle_user_updates(user_ids, account_id, add_users, delete_users, update_users)
-    
-    return [account_update_transaction] + user_update_transactions
+    return puts, deletes, user_transactions
 
 def lambda_handler(event, context):
     """
@@ -233,10 +158,18 @@ def lambda_handler(event, context):
         print(f"Account ID {account_id} not found.")
         return create_response(404, f'Account ID {account_id} not found.')
 
-    transactions = handle_account_update(account_id, existing_account, params)
-    if isinstance(transactions, dict):  # 检查是否返回错误响应
-        return transactions
-    
+    result = handle_account_update(account_id, params)
+    if isinstance(result, dict):  # 检查是否返回错误响应
+        return result
+    puts, deletes, transactions = result
+
+    try:
+        count = write_memberships(puts=puts, deletes=deletes)
+        print(f"Updated {count} memberships of account {account_id}.")
+    except Exception as e:
+        print(f"Failed to update memberships: {e}")
+        return create_response(500, 'Failed to update account and user information.')
+
     if transactions:
         try:
             for i in range(0, len(transactions), 25):  # DynamoDB事务写入每次最多处理25个项目
@@ -1,5 +1,6 @@
 import json
 import boto3
+from boto3.dynamodb.conditions import Key
 import re
 import os
 import requests
@@ -8,12 +9,15 @@ import requests
 NAME_PREFIX = 'AwsHealthDashboard'
 ACCOUNTS_TABLE_NAME = f'{NAME_PREFIX}ManagementAccounts'
 USERS_TABLE_NAME = f'{NAME_PREFIX}Users'
+ACCOUNT_MEMBERSHIPS_TABLE_NAME = f'{NAME_PREFIX}AccountMemberships'
+USER_ACCOUNTS_INDEX_NAME = 'UserAccountsIndex'
 HEALTH_EVENTS_TABLE_NAME = f'{NAME_PREFIX}HealthEvents'
 
 # 初始化DynamoDB客户端
 dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
 accounts_table = dynamodb.Table(ACCOUNTS_TABLE_NAME)
 users_table = dynamodb.Table(USERS_TABLE_NAME)
+memberships_table = dynamodb.Table(ACCOUNT_MEMBERSHIPS_TABLE_NAME)
 health_table = dynamodb.Table(HEALTH_EVENTS_TABLE_NAME)
 
 # 邮箱格式校验的正则表达式
@@ -75,6 +79,33 @@ def get_user_data(user_id):
     response = users_table.get_item(Key={'UserId': user_id})
     return response.get('Item')
 
+def get_account_users(account_id):
+    """
+    从成员关系表中获取账户的用户。
+
+    参数:
+    account_id (str): 账户ID
+
+    返回:
+    dict: 用户ID -> 用户名
+    """
+    response = memberships_table.query(KeyConditionExpression=Key('AccountId').eq(account_id))
+    return {item['UserId']: item.get('UserName', '') for item in response['Items']}
+
+def get_user_account_ids(user_id):
+    """
+    从成员关系表的反向索引中获取用户允许访问的账户。
+
+    参数:
+    user_id (str): 用户ID
+
+    返回:
+    set: 账户ID集合
+    """
+    response = memberships_table.query(IndexName=USER_ACCOUNTS_INDEX_NAME,
+                                       KeyConditionExpression=Key('UserId').eq(user_id))
+    return {item['AccountId'] for item in response['Items']}
+
 def register_accounts(payload):
     """
     注册账户。
@@ -4,9 +4,11 @@ import json
 from common import (
     accounts_table,
     users_table,
+    memberships_table,
     register_accounts,
     get_account_data,
     get_user_data,
+    get_user_account_ids,
     clean_table,
     get_api_url
 )
@@ -32,12 +34,14 @@ def setup_dynamodb():
     # 清理表中的所有数据
     clean_table(accounts_table)
     clean_table(users_table)
+    clean_table(memberships_table)
 
     yield
 
     # 测试完成后清理表中的所有数据
     clean_table(accounts_table)
     clean_table(users_table)
+    clean_table(memberships_table)
 
 def test_deregister_account_success(setup_dynamodb):
     """
@@ -83,19 +87,19 @@ def test_deregister_account_success(setup_dynamodb):
     # 验证用户表
     user_data = get_user_data("email1@example.com")
     assert user_data is not None
-    assert "AllowedAccounts" not in user_data or "123456789012" not in user_data['AllowedAccounts']
+    assert "123456789012" not in get_user_account_ids("email1@example.com")
 
     user_data = get_user_data("email2@example.com")
     assert user_data is not None
-    assert "AllowedAccounts" not in user_data or "123456789012" not in user_data['AllowedAccounts']
+    assert "123456789012" not in get_user_account_ids("email2@example.com")
 
     user_data = get_user_data("email3@example.com")
     assert user_data is not None
-    assert "AllowedAccounts" not in user_data or "098765432109" not in user_data['AllowedAccounts']
+    assert "098765432109" not in get_user_account_ids("email3@example.com")
 
     user_data = get_user_data("email4@example.com")
     assert user_data is not None
-    assert "AllowedAccounts" not in user_data or "098765432109" not in user_data['AllowedAccounts']
+    assert "098765432109" not in get_user_account_ids("email4@example.com")
 
 def test_deregister_account_invalid_id(setup_dynamodb):
     """
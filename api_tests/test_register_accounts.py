@@ -1,18 +1,21 @@
 import json
 import pytest
-from common import get_account_data, get_user_data, register_accounts, clean_table, accounts_table, users_table
+from common import (get_account_data, get_user_data, get_account_users, get_user_account_ids, register_accounts,
+                    clean_table, accounts_table, users_table, memberships_table)
 
 @pytest.fixture
 def setup_dynamodb():
     # 开始测试前清理已经有的表
     clean_table(accounts_table)
     clean_table(users_table)
+    clean_table(memberships_table)
 
     yield
 
     # 完成测试后清理创建的表
     clean_table(accounts_table)
     clean_table(users_table)
+    clean_table(memberships_table)
 
 def test_register_accounts_success(setup_dynamodb):
     test_payload = {
@@ -52,7 +55,7 @@ def test_register_accounts_success(setup_dynamodb):
         for email in allowed_users.keys():
             user_data = get_user_data(email)
             assert user_data is not None
-            assert account_id in user_data['AllowedAccountIds']
+            assert account_id in get_user_account_ids(email)
 
 def test_register_accounts_invalid_account_id(setup_dynamodb):
     test_payloads = [
@@ -107,9 +110,10 @@ def test_register_accounts_invalid_email_format(setup_dynamodb):
 
     account_data = get_account_data("123456789012")
     assert account_data is not None
-    assert "invalid_email_format" not in account_data['AllowedUsers']
-    assert "email2@.com" not in account_data['AllowedUsers']
-    assert "email3@com" not in account_data['AllowedUsers']
+    account_users = get_account_users("123456789012")
+    assert "invalid_email_format" not in account_users
+    assert "email2@.com" not in account_users
+    assert "email3@com" not in account_users
 
 def test_register_accounts_duplicate_account_id(setup_dynamodb):
     test_payload = {
@@ -145,7 +149,7 @@ def test_register_accounts_existing_user_with_non_empty_allowedaccountids(setup_
 
     user_data = get_user_data("email1@example.com")
     assert user_data is not None
-    assert "123456789012" in user_data['AllowedAccountIds']
+    assert "123456789012" in get_user_account_ids("email1@example.com")
 
     new_payload = {
         "098765432109": {
@@ -161,8 +165,8 @@ def test_register_accounts_existing_user_with_non_empty_allowedaccountids(setup_
 
     user_data = get_user_data("email1@example.com")
     assert user_data is not None
-    assert "123456789012" in user_data['AllowedAccountIds']
-    assert "098765432109" in user_data['AllowedAccountIds']
+    assert "123456789012" in get_user_account_ids("email1@example.com")
+    assert "098765432109" in get_user_account_ids("email1@example.com")
 
 if __name__ == "__main__":
     pytest.main()
@@ -2,9 +2,12 @@ import pytest
 from common import (
     accounts_table,
     users_table,
+    memberships_table,
     register_accounts,
     get_account_data,
     get_user_data,
+    get_account_users,
+    get_user_account_ids,
     clean_table,
     get_api_url
 )
@@ -32,12 +35,14 @@ def setup_dynamodb():
     # 清理表中的所有数据
     clean_table(accounts_table)
     clean_table(users_table)
+    clean_table(memberships_table)
 
     yield
 
     # 测试完成后清理表中的所有数据
     clean_table(accounts_table)
     clean_table(users_table)
+    clean_table(memberships_table)
 
 def test_update_account_success_add_update_delete(setup_dynamodb):
     """
@@ -79,32 +84,31 @@ def test_update_account_success_add_update_delete(setup_dynamodb):
     # 验证更新结果
     account_data = get_account_data("123456789012")
     assert account_data is not None
-    assert account_data['AllowedUsers']['email1@example.com'] == "John Smith"
-    assert "email2@example.com" not in account_data['AllowedUsers']
-    assert account_data['AllowedUsers']['email3@example.com'] == "Alice"
-    assert account_data['AllowedUsers']['email4@example.com'] == "Bob"
+    account_users = get_account_users("123456789012")
+    assert account_users['email1@example.com'] == "John Smith"
+    assert "email2@example.com" not in account_users
+    assert account_users['email3@example.com'] == "Alice"
+    assert account_users['email4@example.com'] == "Bob"
 
     # 验证用户表
     user_data = get_user_data("email1@example.com")
     assert user_data is not None
-    assert "123456789012" in user_data['AllowedAccountIds']
+    assert "123456789012" in get_user_account_ids("email1@example.com")
     assert user_data['UserName'] == "John Smith"
 
-    # email2@example.com被删除了，所以AllowedAccountIds要么不存在了（为空这个key会
-    # 被删除），或对应的accoutId不在其中了
+    # email2@example.com被删除了，用户条目保留，但不再是这个账户的成员
     user_data = get_user_data("email2@example.com")
     assert user_data is not None
-    assert 'AllowedAccountIds' not in user_data or \
-        "123456789012" not in user_data['AllowedAccountIds']
+    assert "123456789012" not in get_user_account_ids("email2@example.com")
 
     user_data = get_user_data("email3@example.com")
     assert user_data is not None
-    assert "123456789012" in user_data['AllowedAccountIds']
+    assert "123456789012" in get_user_account_ids("email3@example.com")
     assert user_data['UserName'] == "Alice"
 
     user_data = get_user_data("email4@example.com")
     assert user_data is not None
-    assert "123456789012" in user_data['AllowedAccountIds']
+    assert "123456789012" in get_user_account_ids("email4@example.com")
     assert user_data['UserName'] == "Bob"
 
 def test_update_account_conflict(setup_dynamodb):
@@ -0,0 +1,136 @@
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+'''
+BatchGetItem 的通用实现：
+- 输入的键先去重，再按每批 100 个键(BatchGetItem 的上限)分批；
+- 多个批次在线程池中并发读取(低级客户端是线程安全的)；
+- UnprocessedKeys 按指数退避(带随机抖动)重试，超过重试次数后把剩下的键返回给调用方；
+- 键和返回的条目都使用普通的 Python 值(和 boto3 resource 一致)，
+  需要原始 AttributeValue 格式时传 deserialize=False。
+'''
+
+# 初始化 DynamoDB 客户端
+dynamodb_client = boto3.client('dynamodb')
+
+type_serializer = TypeSerializer()
+type_deserializer = TypeDeserializer()
+
+BATCH_GET_LIMIT = 100
+BATCH_GET_MAX_WORKERS = int(os.environ.get('BATCH_GET_MAX_WORKERS', '8'))
+BATCH_GET_MAX_RETRIES = int(os.environ.get('BATCH_GET_MAX_RETRIES', '8'))
+# 重试的退避时间(秒)：base * 2^n，最多 max
+BATCH_GET_BACKOFF_BASE = 0.05
+BATCH_GET_BACKOFF_MAX = 2.0
+
+
+class UnprocessedKeysError(Exception):
+    """重试多次后仍有未处理的键。"""
+
+    def __init__(self, table_name, unprocessed_keys):
+        super().__init__(f"{len(unprocessed_keys)} keys of {table_name} were still unprocessed after "
+                         f"{BATCH_GET_MAX_RETRIES} retries")
+        self.table_name = table_name
+        self.unprocessed_keys = unprocessed_keys
+
+
+def key_identity(key):
+    """键的可哈希表示，用于去重和比较。"""
+    return tuple(sorted(key.items()))
+
+
+def serialize_item(item):
+    return {k: type_serializer.serialize(v) for k, v in item.items()}
+
+
+def deserialize_item(item):
+    return {k: type_deserializer.deserialize(v) for k, v in item.items()}
+
+
+def backoff(attempt):
+    """第 attempt 次重试前等待，使用 full jitter 避免多个批次同时重试。"""
+    time.sleep(random.uniform(0, min(BATCH_GET_BACKOFF_MAX, BATCH_GET_BACKOFF_BASE * (2 ** attempt))))
+
+
+def get_chunk(table_name, keys, extra_params):
+    """
+    读取一批(最多100个)键，重试 UnprocessedKeys。
+
+    返回:
+    tuple: (原始格式的条目列表, 重试后仍未处理的键(原始格式))
+    """
+    items = []
+    request_items = {table_name: {'Keys': keys, **extra_params}}
+    attempt = 0
+    while True:
+        response = dynamodb_client.batch_get_item(RequestItems=request_items)
+        items.extend(response.get('Responses', {}).get(table_name, []))
+        request_items = response.get('UnprocessedKeys')
+        if not request_items:
+            return items, []
+        if attempt >= BATCH_GET_MAX_RETRIES:
+            return items, request_items[table_name]['Keys']
+        backoff(attempt)
+        attempt += 1
+
+
+def batch_get_items(table_name, keys, projection=None, expression_attribute_names=None,
+                    consistent_read=False, deserialize=True):
+    """
+    批量读取任意数量的键。
+
+    参数:
+    table_name (str): 表名
+    keys (list): 键的列表，例如 [{'AccountId': '123'}]，重复的键只读一次
+    projection (str, optional): ProjectionExpression
+    expression_attribute_names (dict, optional): ProjectionExpression 中用到的属性名占位符
+    consistent_read (bool): 是否强一致读
+    deserialize (bool): 返回的条目是否转换成普通的 Python 值
+
+    返回:
+    tuple: (条目列表, 重试后仍未处理的键列表)，顺序不保证和输入一致
+    """
+    unique_keys = list({key_identity(key): key for key in keys}.values())
+    if not unique_keys:
+        return [], []
+
+    extra_params = {}
+    if projection:
+        extra_params['ProjectionExpression'] = projection
+    if expression_attribute_names:
+        extra_params['ExpressionAttributeNames'] = expression_attribute_names
+    if consistent_read:
+        extra_params['ConsistentRead'] = True
+
+    serialized_keys = [serialize_item(key) for key in unique_keys]
+    chunks = [serialized_keys[i:i + BATCH_GET_LIMIT] for i in range(0, len(serialized_keys), BATCH_GET_LIMIT)]
+
+    if len(chunks) == 1:
+        results = [get_chunk(table_name, chunks[0], extra_params)]
+    else:
+        with ThreadPoolExecutor(max_workers=min(len(chunks), BATCH_GET_MAX_WORKERS)) as executor:
+            results = list(executor.map(lambda chunk: get_chunk(table_name, chunk, extra_params), chunks))
+
+    items = [item for chunk_items, _ in results for item in chunk_items]
+    unprocessed_keys = [deserialize_item(key) for _, chunk_unprocessed in results for key in chunk_unprocessed]
+    if deserialize:
+        items = [deserialize_item(item) for item in items]
+    return items, unprocessed_keys
+
+
+def batch_get_all(table_name, keys, **kwargs):
+    """
+    和 batch_get_items 相同，但要求所有键都被处理(找不到的键不算失败)。
+
+    异常:
+    UnprocessedKeysError: 重试后仍有未处理的键
+    """
+    items, unprocessed_keys = batch_get_items(table_name, keys, **kwargs)
+    if unprocessed_keys:
+        raise UnprocessedKeysError(table_name, unprocessed_keys)
+    return items
@@ -0,0 +1,272 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+try:
+    # 本地开发时使用
+    from common.constants import DATA_GENERATION_KEY
+except ImportError:
+    # 部署到 Lambda 时使用
+    from constants import DATA_GENERATION_KEY
+
+
+class TTLCache:
+    """
+    进程内的 TTL + LRU 缓存。
+
+    Lambda 容器在热启动时会复用模块级对象，所以把这个缓存放在模块级，
+    就可以在同一个容器的多次调用之间复用查询结果。
+
+    - 每个条目有过期时间(ttl 秒)，过期即失效；
+    - 条目数超过 max_size 时，淘汰最久未使用的条目；
+    - 每个条目可以带一个 generation(数据版本号)，读取时传入的版本号和
+      写入时的不一致，则视为失效(数据已被更新)。
+    """
+
+    def __init__(self, max_size=128, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, generation=None):
+        """
+        获取缓存条目，不存在、过期或者版本号不一致时返回 None。
+        """
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at, entry_generation = entry
+            if expires_at < time.monotonic() or entry_generation != generation:
+                del self._items[key]
+                self.misses += 1
+                return None
+
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, generation=None):
+        """写入缓存条目，必要时淘汰最久未使用的条目。"""
+        with self._lock:
+            self._items[key] = (value, time.monotonic() + self.ttl, generation)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key=None):
+        """删除指定条目；不传 key 则清空整个缓存。"""
+        with self._lock:
+            if key is None:
+                self._items.clear()
+            else:
+                self._items.pop(key, None)
+
+    def stats(self):
+        """返回命中/未命中/淘汰计数，便于打印或放到响应里。"""
+        return {
+            'size': len(self._items),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+
+class SizedLRUCache:
+    """
+    按字节数限制大小的进程内 LRU 缓存。
+
+    和 TTLCache 一样放在模块级，在热启动的容器中复用。条目大小差别很大时
+    (比如带长描述的事件详情)，按条目数限制不能控制内存，所以按调用方给出的
+    字节数限制：总字节数超过 max_bytes 时淘汰最久未使用的条目。
+
+    - 每个条目有过期时间(ttl 秒)，作为兜底；
+    - 读取时可以传入 validate(value)，返回 False 的条目视为失效并删除。
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024, ttl=3600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _remove(self, key):
+        _, size, _ = self._items.pop(key)
+        self._bytes -= size
+
+    def get(self, key, validate=None):
+        """获取缓存条目，不存在、过期或者没有通过 validate 时返回 None。"""
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, _, expires_at = entry
+            if expires_at < time.monotonic() or (validate is not None and not validate(value)):
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, size):
+        """写入缓存条目(size 为调用方估算的字节数)，必要时淘汰最久未使用的条目。"""
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+            self._items[key] = (value, size, time.monotonic() + self.ttl)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._items))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, key=None):
+        """删除指定条目；不传 key 则清空整个缓存。"""
+        with self._lock:
+            if key is None:
+                self._items.clear()
+                self._bytes = 0
+            elif key in self._items:
+                self._remove(key)
+
+    def stats(self):
+        """返回命中/未命中/淘汰计数和占用的字节数，便于打印或放到响应里。"""
+        return {
+            'size': len(self._items),
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+class SingleFlight:
+    """
+    合并进程内并发的相同请求。
+
+    同一个 key 的调用正在执行时，后来的调用等待并共享它的结果(或异常)，不重复执行；
+    执行结束后立即移除，不缓存结果。
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """
+        执行 func，或者等待正在执行的相同 key 的调用。
+
+        返回:
+        tuple: (func 的结果, 是否共享了其它调用的结果)
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = func()
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+def make_cache_key(*parts):
+    """
+    把若干部分(集合、字典、列表等)规整成一个稳定的字符串缓存键。
+    集合会被排序，字典按键排序，保证语义相同的请求得到相同的键。
+    """
+    def normalize(obj):
+        if isinstance(obj, (set, frozenset)):
+            return sorted(normalize(x) for x in obj)
+        if isinstance(obj, dict):
+            return {str(k): normalize(v) for k, v in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return [normalize(x) for x in obj]
+        return obj
+
+    return json.dumps([normalize(p) for p in parts], sort_keys=True, default=str)
+
+
+def compute_etag(generation, *parts):
+    """
+    根据数据版本号和规整后的请求内容计算 ETag。
+
+    数据只在 fetch_health_events 写入后才会变化(版本号加一)，所以版本号相同、
+    请求相同，响应一定相同，不需要先查询和序列化响应体再计算摘要。
+
+    返回弱 ETag(W/"...")：同样的数据可能以 gzip 或不压缩、JSON 或 NDJSON 返回，字节并不相同。
+    响应中有失败的部分时调用方不应该带上 ETag，否则客户端会一直拿着不完整的结果。
+    """
+    digest = hashlib.sha1(make_cache_key(generation, *parts).encode('utf-8')).hexdigest()
+    return f'W/"{generation}-{digest[:16]}"'
+
+
+def get_data_generation(accounts_table):
+    """
+    读取当前的数据版本号。
+
+    数据版本号存放在管理账户表中一个特殊的条目里(AccountId 为 DATA_GENERATION_KEY)，
+    每次 fetch_health_events 成功写入后加一。查询侧只需要一次 get_item 就能判断
+    缓存是否还有效。
+
+    参数:
+    accounts_table: 管理账户表(boto3 Table 对象)
+
+    返回:
+    int: 当前数据版本号，条目不存在时返回 0
+    """
+    response = accounts_table.get_item(
+        Key={'AccountId': DATA_GENERATION_KEY},
+        ProjectionExpression='Generation'
+    )
+    return int(response.get('Item', {}).get('Generation', 0))
+
+
+def bump_data_generation(accounts_table):
+    """
+    数据版本号加一，使所有查询侧的缓存失效。
+
+    参数:
+    accounts_table: 管理账户表(boto3 Table 对象)
+
+    返回:
+    int: 新的数据版本号
+    """
+    response = accounts_table.update_item(
+        Key={'AccountId': DATA_GENERATION_KEY},
+        UpdateExpression='ADD Generation :one',
+        ExpressionAttributeValues={':one': 1},
+        ReturnValues='UPDATED_NEW'
+    )
+    return int(response['Attributes']['Generation'])
@@ -5,8 +5,27 @@ LAMBDA_ROLE = f'{NAME_PREFIX}LambdaRole'
 
 ACCOUNTS_TABLE_NAME = f'{NAME_PREFIX}ManagementAccounts'
 USERS_TABLE_NAME = f'{NAME_PREFIX}Users'
+# 管理账户和用户的关系，每个 (AccountId, UserId) 一行
+ACCOUNT_MEMBERSHIPS_TABLE_NAME = f'{NAME_PREFIX}AccountMemberships'
 
 HEALTH_EVENTS_TABLE_NAME = f'{NAME_PREFIX}HealthEvents'
 EVENT_DETAILS_TABLE_NAME = f'{NAME_PREFIX}EventDetails'
 AFFECTED_ACCOUNTS_TABLE_NAME = f'{NAME_PREFIX}AffectedAccounts'
-AFFECTED_ENTITIES_TABLE_NAME = f'{NAME_PREFIX}AffectedEntities'
\ No newline at end of file
+AFFECTED_ENTITIES_TABLE_NAME = f'{NAME_PREFIX}AffectedEntities'
+EVENT_ROLLUPS_TABLE_NAME = f'{NAME_PREFIX}EventRollups'
+SEARCH_INDEX_TABLE_NAME = f'{NAME_PREFIX}SearchIndex'
+ENTITY_INDEX_TABLE_NAME = f'{NAME_PREFIX}EntityIndex'
+TAG_INDEX_TABLE_NAME = f'{NAME_PREFIX}TagIndex'
+BEDROCK_INTERPRETATIONS_TABLE_NAME = f'{NAME_PREFIX}BedrockInterpretations'
+
+# 预生成 Bedrock 解读的队列(fetch_health_events 写入，query_bedrock 的 worker_handler 消费)
+INTERPRETATION_QUEUE_NAME = f'{NAME_PREFIX}InterpretationQueue'
+
+# 受影响账户表上的反向索引：成员账户(AccountId) -> 事件(StartTime, EventArn)
+MEMBER_ACCOUNT_INDEX_NAME = 'MemberAccountIndex'
+
+# 成员关系表上的反向索引：用户(UserId) -> 允许访问的管理账户(AccountId)
+USER_ACCOUNTS_INDEX_NAME = 'UserAccountsIndex'
+
+# 管理账户表中存放数据版本号的特殊条目的 AccountId (不是合法的12位帐号ID，不会和注册的帐号冲突)
+DATA_GENERATION_KEY = '#DataGeneration'
@@ -0,0 +1,267 @@
+import time
+
+import boto3
+from boto3.dynamodb.types import TypeDeserializer
+
+try:
+    # 本地开发时使用
+    from common.constants import ENTITY_INDEX_TABLE_NAME, TAG_INDEX_TABLE_NAME
+    from common.health_events import convert_datetime_to_string
+except ImportError:
+    # 部署到 Lambda 时使用
+    from constants import ENTITY_INDEX_TABLE_NAME, TAG_INDEX_TABLE_NAME
+    from health_events import convert_datetime_to_string
+
+'''
+受影响实体的反向索引：资源标识 -> 事件。
+
+AffectedEntities 表只按 EventArn 分区，回答"实例 i-0abc / 桶 X 有没有受到影响"需要扫描整个表。
+这个索引表在写入受影响实体时同步维护，每个实体的 EntityValue 和实体ARN 各一个条目：
+- Scope(分区键):
+  - ARN: `ARN#arn:partition:service:region:account`，即 ARN 中资源之前的部分；
+  - 其它标识(实例ID、桶名等): `VALUE#标识`
+- ResourceKey(排序键): `资源部分#事件ARN#成员账户ID`，ARN 的资源部分用 begins_with 做前缀匹配
+- 以及事件的 StartTime、Service、EventTypeCode 等字段，查询时不需要再读事件表。
+
+资源标识统一去掉首尾空白并转成小写。
+
+另有一个标签的倒排索引：标签 -> (事件, 成员账户, 实体)，回答"影响打了 app=payments 标签的资源的事件"：
+- Tag(分区键): `key=value`
+- EventKey(排序键): `StartTime#事件ARN#成员账户ID#实体`，按时间窗口查询时作为范围条件
+事件的 StartTime 变化后(比如重新安排的计划内变更)，旧 StartTime 下的条目在写入新条目时删除。
+'''
+
+# 初始化 DynamoDB 客户端
+dynamodb = boto3.resource('dynamodb')
+dynamodb_client = boto3.client('dynamodb')
+entity_index_table = dynamodb.Table(ENTITY_INDEX_TABLE_NAME)
+tag_index_table = dynamodb.Table(TAG_INDEX_TABLE_NAME)
+
+type_deserializer = TypeDeserializer()
+
+# ARN 的格式: arn:partition:service:region:account-id:resource
+ARN_PARTS = 6
+
+
+def normalize_resource(identifier):
+    return (identifier or '').strip().lower()
+
+
+def parse_resource(identifier):
+    """
+    把资源标识解析成 (Scope, 资源部分)。
+
+    ARN 返回 ('ARN#arn:aws:ec2:us-east-1:123456789012', 'instance/i-0abc')，
+    其它标识返回 ('VALUE#i-0abc', '')。
+
+    异常:
+    ValueError: 标识为空，或者是不完整的 ARN(没有写到账户ID之后，无法定位分区)
+    """
+    value = normalize_resource(identifier)
+    if not value:
+        raise ValueError("Empty resource identifier")
+    if value.startswith('arn:'):
+        parts = value.split(':', ARN_PARTS - 1)
+        if len(parts) < ARN_PARTS:
+            raise ValueError(f"ARN prefix must include the account ID part: {identifier}")
+        return 'ARN#' + ':'.join(parts[:ARN_PARTS - 1]), parts[ARN_PARTS - 1]
+    return f'VALUE#{value}', ''
+
+
+def build_entity_index_items(entities, account_id, events_by_arn, expiration_time):
+    """
+    为一批受影响实体生成索引条目。
+
+    参数:
+    entities (list): Health API 返回的受影响实体(带 eventArn、awsAccountId)
+    account_id (str): 管理账户ID
+    events_by_arn (dict): 事件ARN -> Health API 返回的事件，用于冗余事件的基本信息
+    expiration_time (int): 条目的过期时间(TTL)
+    """
+    items = {}
+    for entity in entities:
+        event = events_by_arn.get(entity['eventArn'], {})
+        member_account_id = entity.get('awsAccountId') or ''
+        for identifier in {normalize_resource(entity.get('entityValue')), normalize_resource(entity.get('entityArn'))}:
+            if not identifier:
+                continue
+            try:
+                scope, resource = parse_resource(identifier)
+            except ValueError:
+                # 不完整的 ARN 当作普通标识
+                scope, resource = f'VALUE#{identifier}', ''
+            resource_key = f"{resource}#{entity['eventArn']}#{member_account_id}"
+            items[(scope, resource_key)] = {
+                'Scope': scope, # 分区键
+                'ResourceKey': resource_key, # 排序键
+                'EntityValue': entity.get('entityValue', ''),
+                'EventArn': entity['eventArn'],
+                'AccountId': member_account_id,
+                'ManagementAccountId': account_id,
+                'StartTime': convert_datetime_to_string(event.get('startTime', '')),
+                'Service': event.get('service', ''),
+                'EventTypeCode': event.get('eventTypeCode', ''),
+                'EventTypeCategory': event.get('eventTypeCategory', ''),
+                'Region': event.get('region', ''),
+                'StatusCode': entity.get('statusCode', ''),
+                'ExpirationTime': expiration_time
+            }
+    return list(items.values())
+
+
+def index_affected_entities(entities, account_id, events_by_arn, expiration_time):
+    """把一批受影响实体写入资源索引，返回写入的条目数。"""
+    start = time.time()
+    items = build_entity_index_items(entities, account_id, events_by_arn, expiration_time)
+    with entity_index_table.batch_writer(overwrite_by_pkeys=['Scope', 'ResourceKey']) as batch:
+        for item in items:
+            batch.put_item(Item=item)
+
+    cost_time = time.time() - start
+    print(f"Indexed {len(entities)} affected entities into {len(items)} resource index items in {cost_time:.2f} seconds.")
+    return len(items)
+
+
+def query_resource(identifier, exact=False, start_from=None, start_to=None):
+    """
+    查询影响某个资源的全部索引条目(自动翻页)。
+
+    ARN 默认按前缀匹配(例如 arn:aws:ec2:us-east-1:123456789012:instance/ 匹配该账户该区域的所有实例)，
+    exact 为 true 时只匹配完整的 ARN；其它标识总是精确匹配。
+    使用低级客户端(线程安全)，可以在线程池中并发查询多个资源。
+
+    参数:
+    identifier (str): 资源标识
+    exact (bool): ARN 是否精确匹配
+    start_from, start_to (str, optional): 按事件 StartTime 过滤
+
+    返回:
+    list: 索引条目
+    """
+    scope, resource = parse_resource(identifier)
+    key_condition = 'Scope = :scope'
+    values = {':scope': {'S': scope}}
+    prefix = f'{resource}#' if exact else resource
+    if scope.startswith('ARN#') and prefix:
+        key_condition += ' AND begins_with(ResourceKey, :prefix)'
+        values[':prefix'] = {'S': prefix}
+
+    params = {
+        'TableName': ENTITY_INDEX_TABLE_NAME,
+        'KeyConditionExpression': key_condition,
+        'ExpressionAttributeValues': values,
+    }
+    time_conditions = []
+    if start_from:
+        time_conditions.append('StartTime >= :start_from')
+        values[':start_from'] = {'S': start_from}
+    if start_to:
+        time_conditions.append('StartTime <= :start_to')
+        values[':start_to'] = {'S': start_to}
+    if time_conditions:
+        params['FilterExpression'] = ' AND '.join(time_conditions)
+
+    items = []
+    for page in dynamodb_client.get_paginator('query').paginate(**params):
+        items.extend({k: type_deserializer.deserialize(v) for k, v in item.items()} for item in page['Items'])
+    return items
+
+
+def format_tag(key, value):
+    return f'{str(key).strip()}={str(value).strip()}'
+
+
+def parse_tag(tag):
+    """把 `key=value` 解析并规整成索引中的格式，没有 `=` 时抛出 ValueError。"""
+    key, separator, value = str(tag).partition('=')
+    if not separator or not key.strip():
+        raise ValueError(f"Tag must be in the form key=value: {tag}")
+    return format_tag(key, value)
+
+
+def build_tag_index_items(entities, account_id, events_by_arn, expiration_time):
+    """为一批受影响实体的每个标签生成标签索引条目。"""
+    items = {}
+    for entity in entities:
+        tags = entity.get('tags') or {}
+        if not tags:
+            continue
+        event = events_by_arn.get(entity['eventArn'], {})
+        start_time = convert_datetime_to_string(event.get('startTime', ''))
+        member_account_id = entity.get('awsAccountId') or ''
+        entity_id = entity.get('entityValue') or entity.get('entityArn', '')
+        event_key = f"{start_time}#{entity['eventArn']}#{member_account_id}#{entity_id}"
+        for key, value in tags.items():
+            tag = format_tag(key, value)
+            items[(tag, event_key)] = {
+                'Tag': tag, # 分区键
+                'EventKey': event_key, # 排序键
+                'EventArn': entity['eventArn'],
+                'AccountId': member_account_id,
+                'ManagementAccountId': account_id,
+                'EntityValue': entity_id,
+                'StartTime': start_time,
+                'Service': event.get('service', ''),
+                'EventTypeCode': event.get('eventTypeCode', ''),
+                'Region': event.get('region', ''),
+                'ExpirationTime': expiration_time
+            }
+    return list(items.values())
+
+
+def index_entity_tags(entities, account_id, events_by_arn, expiration_time, previous_entities=None,
+                      previous_events_by_arn=None):
+    """
+    把一批受影响实体的标签写入标签索引。
+
+    previous_entities 为 StartTime 变化的事件在写入前的受影响实体(和 entities 的格式相同)，
+    previous_events_by_arn 为这些事件旧的 {'startTime': ...}。旧条目中新条目没有覆盖的被删除。
+
+    返回:
+    int: 写入和删除的条目数
+    """
+    start = time.time()
+    items = build_tag_index_items(entities, account_id, events_by_arn, expiration_time)
+    keys = {(item['Tag'], item['EventKey']) for item in items}
+    stale_keys = {(item['Tag'], item['EventKey']) for item in build_tag_index_items(
+        previous_entities or [], account_id, previous_events_by_arn or {}, expiration_time)} - keys
+
+    with tag_index_table.batch_writer(overwrite_by_pkeys=['Tag', 'EventKey']) as batch:
+        for item in items:
+            batch.put_item(Item=item)
+        for tag, event_key in stale_keys:
+            batch.delete_item(Key={'Tag': tag, 'EventKey': event_key})
+
+    cost_time = time.time() - start
+    print(f"Indexed {len(items)} entity tags, removed {len(stale_keys)} stale tag items in {cost_time:.2f} seconds.")
+    return len(items) + len(stale_keys)
+
+
+def query_tag(tag, start_from=None, start_to=None):
+    """
+    查询带有某个标签的全部实体(自动翻页)，StartTime 窗口作为排序键的范围条件。
+    使用低级客户端(线程安全)，可以在线程池中并发查询多个标签。
+    """
+    key_condition = 'Tag = :tag'
+    values = {':tag': {'S': tag}}
+    # 排序键以 StartTime 开头，'~' 比 StartTime 中可能出现的字符都大。
+    # 键条件中不能出现空字符串，只有一端时用 >= 或 <=
+    if start_from:
+        values[':start_from'] = {'S': start_from}
+    if start_to:
+        values[':start_to'] = {'S': f'{start_to}~'}
+    if start_from and start_to:
+        key_condition += ' AND EventKey BETWEEN :start_from AND :start_to'
+    elif start_from:
+        key_condition += ' AND EventKey >= :start_from'
+    elif start_to:
+        key_condition += ' AND EventKey <= :start_to'
+
+    items = []
+    for page in dynamodb_client.get_paginator('query').paginate(
+        TableName=TAG_INDEX_TABLE_NAME,
+        KeyConditionExpression=key_condition,
+        ExpressionAttributeValues=values
+    ):
+        items.extend({k: type_deserializer.deserialize(v) for k, v in item.items()} for item in page['Items'])
+    return items
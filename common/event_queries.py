@@ -0,0 +1,239 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import boto3
+from boto3.dynamodb.conditions import Key
+
+try:
+    # 本地开发时使用
+    from common.constants import EVENT_DETAILS_TABLE_NAME, AFFECTED_ACCOUNTS_TABLE_NAME, AFFECTED_ENTITIES_TABLE_NAME
+    from common.batch_get import batch_get_items
+    from common.cache import SizedLRUCache
+except ImportError:
+    # 部署到 Lambda 时使用
+    from constants import EVENT_DETAILS_TABLE_NAME, AFFECTED_ACCOUNTS_TABLE_NAME, AFFECTED_ENTITIES_TABLE_NAME
+    from batch_get import batch_get_items
+    from cache import SizedLRUCache
+
+'''
+事件详情、受影响账户、受影响实体的数据库查询逻辑。
+
+供 query_event_details、query_affected_accounts、query_affected_entities 三个接口，
+以及把三者合并成一次请求的 query_event_bundle 共用。
+'''
+
+# 初始化 DynamoDB 客户端
+# query_event_bundle 会在不同的线程里并发执行这三类查询。低级客户端是线程安全的，
+# resource 不是，所以受影响实体使用独立 session 创建的 resource
+dynamodb_client = boto3.client('dynamodb')
+affected_entities_table = boto3.session.Session().resource('dynamodb').Table(AFFECTED_ENTITIES_TABLE_NAME)
+
+# 并发查询受影响账户的线程数上限
+AFFECTED_ACCOUNTS_MAX_WORKERS = int(os.environ.get('AFFECTED_ACCOUNTS_MAX_WORKERS', '16'))
+
+# 事件详情缓存(按字节数限制大小)，在热启动的容器中复用。
+# 已关闭的事件基本不再变化，直接使用缓存；其它事件只有在客户端传入的 LastUpdatedTime
+# 和缓存中的一致时才使用缓存。TTL 只是兜底
+details_cache = SizedLRUCache(
+    max_bytes=int(os.environ.get('EVENT_DETAILS_CACHE_MAX_BYTES', str(16 * 1024 * 1024))),
+    ttl=int(os.environ.get('EVENT_DETAILS_CACHE_TTL_SECONDS', '3600'))
+)
+
+
+def get_cached_event_details(event_arns, last_updated_times=None):
+    """
+    从缓存中读取事件详情。
+
+    参数:
+    event_arns (list): 事件ARN的列表
+    last_updated_times (dict, optional): 事件ARN -> 客户端已知的 LastUpdatedTime(例如来自 query_health_events 的结果)
+
+    返回:
+    tuple: (缓存命中的详情列表, 需要查询数据库的事件ARN列表)
+    """
+    last_updated_times = last_updated_times or {}
+    cached = []
+    missing = []
+    for arn in event_arns:
+        detail = details_cache.get(arn, validate=lambda detail: (
+            detail['status_code'] == 'closed'
+            or (arn in last_updated_times and last_updated_times[arn] == detail['last_updated_time'])
+        ))
+        if detail is None:
+            missing.append(arn)
+        else:
+            cached.append(detail)
+    return cached, missing
+
+
+def fetch_event_details(event_arns, last_updated_times=None):
+    """
+    批量获取指定的事件ARN列表对应的详情。
+
+    先查缓存(见 details_cache)，没有命中的再从数据库读取。重复的ARN只读一次；
+    超过 100 个ARN时分批并发读取，未处理的键会带退避重试(见 batch_get.py)。
+
+    参数:
+    event_arns (list): 事件ARN的列表
+    last_updated_times (dict, optional): 事件ARN -> 客户端已知的 LastUpdatedTime，用于验证未关闭事件的缓存
+
+    返回:
+    tuple: 包含成功结果列表和失败事件ARN列表的元组
+    """
+    failed_event_arns = []
+    result, event_arns = get_cached_event_details(list(dict.fromkeys(event_arns)), last_updated_times)
+    if not event_arns:
+        print(f"All {len(result)} event details served from cache")
+        return result, failed_event_arns
+
+    try:
+        # 批量获取
+        print(f"Fetching event details for {len(event_arns)} ARNs ({len(result)} served from cache)")
+        items, unprocessed_keys = batch_get_items(
+            EVENT_DETAILS_TABLE_NAME, [{'EventArn': arn} for arn in event_arns], deserialize=False)
+
+        # 获取成功的项目
+        for item in items:
+            # 请保持跟lambda /fetch_health_events中写入event_details表的结构一样
+            event_detail = {
+                'event_arn': item['EventArn']['S'],
+                'event_type_category': item.get('EventTypeCategory', {}).get('S', ''),
+                'region': item.get('Region', {}).get('S', ''),
+                'service': item.get('Service', {}).get('S', ''),
+                'end_time': item.get('EndTime', {}).get('S', ''),
+                'availability_zone': item.get('AvailabilityZone', {}).get('S', ''),
+                'status_code': item.get('StatusCode', {}).get('S', ''),
+                'event_scope_code': item.get('EventScopeCode', {}).get('S', ''),
+                'aws_account_id': item.get('AwsAccountId', {}).get('S', ''),
+                'last_updated_time': item.get('LastUpdatedTime', {}).get('S', ''),
+                'event_type_code': item.get('EventTypeCode', {}).get('S', ''),
+                'start_time': item.get('StartTime', {}).get('S', ''),
+                'latest_description': item.get('LatestDescription', {}).get('S', ''),
+                'event_metadata': item.get('EventMetadata', {}).get('M', {})
+            }
+            result.append(event_detail)
+            details_cache.put(event_detail['event_arn'], event_detail, len(json.dumps(event_detail, default=str)))
+        print(f"Successfully retrieved {len(items)} items")
+
+        # 重试后仍未处理的项目
+        unprocessed_event_arns = {key['EventArn'] for key in unprocessed_keys}
+        for arn in unprocessed_event_arns:
+            failed_event_arns.append({
+                'event_arn': arn,
+                'reason': '未处理的键，可能是由于请求容量限制'
+            })
+        if unprocessed_event_arns:
+            print(f"Unprocessed ARNs: {sorted(unprocessed_event_arns)}")
+
+        # 添加因找不到而失败的项目
+        found_event_arns = {item['event_arn'] for item in result}
+        for arn in event_arns:
+            if arn not in found_event_arns and arn not in unprocessed_event_arns:
+                failed_event_arns.append({'event_arn': arn, 'reason': '未找到对应的项'})
+                print(f"Event ARN not found: {arn}")
+
+    except Exception as e:
+        error_message = str(e)
+        failed_event_arns.extend([{'event_arn': arn, 'reason': error_message} for arn in event_arns])
+        print(f"Exception occurred: {error_message}")
+
+    return result, failed_event_arns
+
+
+def query_affected_accounts_for_event(event_arn, counts_only=False):
+    """
+    查询一个事件的全部受影响账户(自动翻页，单个事件的账户超过 1MB 时也不会被截断)。
+
+    counts_only 为 true 时使用 Select='COUNT'，只返回账户数，不传输账户列表。
+    """
+    params = {
+        'TableName': AFFECTED_ACCOUNTS_TABLE_NAME,
+        'KeyConditionExpression': 'EventArn = :arn',
+        'ExpressionAttributeValues': {':arn': {'S': event_arn}},
+    }
+    if counts_only:
+        params['Select'] = 'COUNT'
+    else:
+        params['ProjectionExpression'] = 'AccountId'
+
+    count = 0
+    accounts = []
+    for page in dynamodb_client.get_paginator('query').paginate(**params):
+        count += page['Count']
+        accounts.extend(item['AccountId']['S'] for item in page.get('Items', []))
+    return count if counts_only else accounts
+
+def get_affected_accounts(event_arns, counts_only=False):
+    """
+    根据给定的事件ARN列表，从DynamoDB中查询相关的受影响账户。
+
+    每个事件一个 Query，在线程池中并发执行(低级客户端是线程安全的)。
+
+    参数:
+    event_arns (list): 事件ARN的列表
+    counts_only (bool): 为 true 时只返回每个事件的受影响账户数
+
+    返回:
+    tuple: (键为事件ARN、值为受影响账户ID列表(counts_only 时为账户数)的字典,
+            查询失败的事件列表 [{'event_arn': ..., 'reason': ...}]，这些事件在字典中为空列表(或 0))
+    """
+    affected_accounts_dict = {}
+    failed_event_arns = []
+    event_arns = list(dict.fromkeys(event_arns))
+    if not event_arns:
+        return affected_accounts_dict, failed_event_arns
+
+    with ThreadPoolExecutor(max_workers=min(len(event_arns), AFFECTED_ACCOUNTS_MAX_WORKERS)) as executor:
+        futures = {executor.submit(query_affected_accounts_for_event, arn, counts_only): arn for arn in event_arns}
+        for future in as_completed(futures):
+            arn = futures[future]
+            try:
+                affected_accounts_dict[arn] = future.result()
+            except Exception as e:
+                print(f"Error fetching accounts for EventArn {arn}: {str(e)}")
+                affected_accounts_dict[arn] = 0 if counts_only else []
+                failed_event_arns.append({'event_arn': arn, 'reason': str(e)})
+
+    print(f"Fetched affected accounts for {len(event_arns)} EventArns (counts_only={counts_only}), "
+          f"{len(failed_event_arns)} failed")
+    return {arn: affected_accounts_dict[arn] for arn in event_arns}, failed_event_arns
+
+def query_affected_entities(filters):
+    """
+    根据给定的过滤条件从 DynamoDB 中查询受影响的实体。
+
+    参数:
+    filters (list): 过滤条件的列表，每个元素是一个包含 EventArn 和/或 AccountId 的字典。
+
+    返回:
+    list: 符合条件的所有实体项列表
+    """
+    matched_entities = []
+
+    for filter_item in filters:
+        try:
+            # 根据 filters 构建查询条件
+            key_condition = Key('EventArn').eq(filter_item['EventArn']) if 'EventArn' in filter_item else None
+            account_condition = Key('AccountId').eq(filter_item['AccountId']) if 'AccountId' in filter_item else None
+            
+            # 构建查询表达式
+            if key_condition and account_condition:
+                response = affected_entities_table.query(
+                    KeyConditionExpression=key_condition & account_condition
+                )
+            elif key_condition:
+                response = affected_entities_table.query(
+                    KeyConditionExpression=key_condition
+                )
+            else:
+                continue
+
+            # 添加查询到的实体到结果集中
+            matched_entities.extend(response.get('Items', []))
+            print(f"Query successful for filter: {filter_item}. Retrieved {len(response.get('Items', []))} items.")
+
+        except Exception as e:
+            print(f"Error querying entities for filter {filter_item}: {str(e)}")
+
+    return matched_entities
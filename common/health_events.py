@@ -0,0 +1,385 @@
+import os
+import random
+import time
+import zlib
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+import boto3
+from boto3.dynamodb.types import TypeSerializer
+from botocore.exceptions import ClientError
+
+try:
+    # 本地开发时使用
+    from common.constants import HEALTH_EVENTS_TABLE_NAME, EVENT_ROLLUPS_TABLE_NAME
+    from common.batch_get import batch_get_all
+except ImportError:
+    # 部署到 Lambda 时使用
+    from constants import HEALTH_EVENTS_TABLE_NAME, EVENT_ROLLUPS_TABLE_NAME
+    from batch_get import batch_get_all
+
+'''
+健康事件的条目结构和写入逻辑。fetch_health_events 写入事件并维护汇总计数，
+query_health_events 的混合模式用同样的结构(build_event_item)表示 API 返回的增量事件。
+
+分片：
+超大的管理账户可以在管理账户表的条目上配置 EventShardCount / EventShardStrategy，
+把事件分散到多个分区键上，避免写入和查询都集中在同一个分区：
+- hash: 分区键为 `管理账户ID#N`，N = crc32(EventArn) % EventShardCount；
+- month: 分区键为 `管理账户ID#YYYY-MM`，按事件 StartTime 所在的月份分片。
+  StartTime 改到其它月份的事件在写入时移动到新的分区(删除旧条目，见 get_existing_events)。
+没有配置(或 EventShardCount 为 1 的 hash)时分区键就是管理账户ID，和原来一样。
+每个条目都带 ManagementAccountId 属性，查询时据此还原出管理账户ID。
+已有数据的迁移见 deploy/data_collection/migrate_event_shards.py。
+'''
+
+# 初始化 DynamoDB 客户端
+dynamodb = boto3.resource('dynamodb')
+events_table = dynamodb.Table(HEALTH_EVENTS_TABLE_NAME)
+dynamodb_client = boto3.client('dynamodb')
+
+type_serializer = TypeSerializer()
+
+LOOKBACK_DAYS = int(os.environ.get('LOOKBACK_DAYS', '90'))
+
+SHARD_STRATEGIES = ('hash', 'month')
+
+# 按月分片且没有指定时间范围时，查询覆盖的时间窗口：
+# 过去 LOOKBACK_DAYS 天，加上未来这么多天(计划内变更类事件的 StartTime 可能在未来)
+MONTH_SHARD_FUTURE_DAYS = int(os.environ.get('MONTH_SHARD_FUTURE_DAYS', '365'))
+
+# TransactWriteItems 一次最多 100 个操作
+TRANSACT_WRITE_LIMIT = 100
+# 事务因为并发写入同一个事件(条件检查失败)或事务冲突被取消时，重新读取已有事件后重试的次数
+EVENT_WRITE_MAX_ATTEMPTS = int(os.environ.get('EVENT_WRITE_MAX_ATTEMPTS', '5'))
+EVENT_WRITE_BACKOFF_BASE = 0.1
+EVENT_WRITE_BACKOFF_MAX = 2.0
+
+# get_existing_events 读取的字段：分区键、汇总的维度，以及判断事件有没有变化的字段
+EXISTING_EVENT_PROJECTION = ('AccountId, EventArn, StartTime, Service, #region, EventTypeCategory, StatusCode, '
+                             'LastUpdatedTime, ExpirationTime')
+
+def get_expiration_time():
+    """条目的过期时间(TTL)，LOOKBACK_DAYS 天之后。"""
+    return int((datetime.now(timezone.utc) + timedelta(days=LOOKBACK_DAYS)).timestamp())
+
+def get_day_expiration_time(start_time):
+    """
+    按事件开始的那一天计算过期时间(TTL)：那一天之后 LOOKBACK_DAYS + 1 天，即事件离开拉取窗口的时候。
+
+    事件条目和同一天的汇总条目使用同一个过期时间，由 TTL 一起删除，汇总计数不会因为事件过期而偏大。
+    """
+    day = datetime.strptime(convert_datetime_to_string(start_time)[:10], '%Y-%m-%d').replace(tzinfo=timezone.utc)
+    return int((day + timedelta(days=LOOKBACK_DAYS + 1)).timestamp())
+
+def convert_datetime_to_string(obj):
+    """
+    递归地将 datetime 对象转换为字符串。
+    """
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            if isinstance(value, datetime):
+                obj[key] = value.isoformat()  # 转换为 ISO 格式的字符串
+            elif isinstance(value, (dict, list)):
+                convert_datetime_to_string(value)
+    elif isinstance(obj, list):
+        for index, value in enumerate(obj):
+            if isinstance(value, datetime):
+                obj[index] = value.isoformat()
+            elif isinstance(value, (dict, list)):
+                convert_datetime_to_string(value)
+    elif isinstance(obj, datetime):
+        return obj.isoformat()
+    
+    return obj
+
+def get_shard_config(account_item):
+    """
+    从管理账户表的条目中读出分片配置。
+
+    返回:
+    dict: {'strategy': 'hash' 或 'month', 'count': hash 分片数}
+    """
+    account_item = account_item or {}
+    strategy = account_item.get('EventShardStrategy') or 'hash'
+    if strategy not in SHARD_STRATEGIES:
+        raise ValueError(f"Invalid event shard strategy: {strategy}. Must be one of {list(SHARD_STRATEGIES)}")
+    return {'strategy': strategy, 'count': max(int(account_item.get('EventShardCount', 1)), 1)}
+
+def event_partition_key(account_id, event_arn, start_time, shard_config=None):
+    """计算一个事件在 HealthEvents 表中的分区键。"""
+    if not shard_config:
+        return account_id
+    if shard_config['strategy'] == 'month':
+        return f'{account_id}#{convert_datetime_to_string(start_time)[:7]}'
+    if shard_config['count'] <= 1:
+        return account_id
+    return f'{account_id}#{zlib.crc32(event_arn.encode("utf-8")) % shard_config["count"]}'
+
+def event_partition_keys(account_id, shard_config=None, start_from=None, start_to=None):
+    """
+    列出查询一个管理账户时需要读取的全部分区键。
+
+    参数:
+    account_id (str): 管理账户ID
+    shard_config (dict, optional): get_shard_config 的返回值
+    start_from, start_to (str, optional): StartTime 的范围，按月分片时只读取范围内的月份
+
+    返回:
+    list: 分区键列表
+    """
+    if not shard_config:
+        return [account_id]
+    if shard_config['strategy'] == 'hash':
+        if shard_config['count'] <= 1:
+            return [account_id]
+        return [f'{account_id}#{shard}' for shard in range(shard_config['count'])]
+
+    now = datetime.now(timezone.utc)
+    first_month = convert_datetime_to_string(start_from or now - timedelta(days=LOOKBACK_DAYS))[:7]
+    last_month = convert_datetime_to_string(start_to or now + timedelta(days=MONTH_SHARD_FUTURE_DAYS))[:7]
+    year, month = int(first_month[:4]), int(first_month[5:7])
+    keys = []
+    while f'{year:04d}-{month:02d}' <= last_month:
+        keys.append(f'{account_id}#{year:04d}-{month:02d}')
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return keys
+
+def build_event_item(event, account_id, shard_config=None):
+    """
+    把 Health API 返回的事件转换成 HealthEvents 表中的条目。
+    过期时间按事件开始的那一天计算，和汇总条目一致(见 get_day_expiration_time)。
+
+    API文档
+    https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/health/client/describe_events_for_organization.html
+    """
+    return {
+        'AccountId': event_partition_key(account_id, event['arn'], event['startTime'], shard_config), # 分区键
+        'EventArn': event['arn'], # 排序键
+        'ManagementAccountId': account_id,
+        'Service': event['service'],
+        'EventTypeCode': event['eventTypeCode'],
+        'EventTypeCategory': event['eventTypeCategory'],
+        'EventScopeCode': event['eventScopeCode'],
+        'Region': event['region'],
+        'AvailabilityZone': event.get('availabilityZone', ''),
+        'StartTime': convert_datetime_to_string(event['startTime']),
+        'EndTime': convert_datetime_to_string(event.get('endTime', '')),
+        'LastUpdatedTime': convert_datetime_to_string(event['lastUpdatedTime']),
+        'StatusCode': event['statusCode'],
+         # 表示这个item过期的时间（dynamodb会自动清除）， 通过enable_ttl注册这个字段
+        'ExpirationTime': get_day_expiration_time(event['startTime'])
+    }
+
+def to_management_item(item):
+    """把 HealthEvents 表中的条目的 AccountId 还原成管理账户ID(分片的分区键对调用方透明)。"""
+    management_account_id = item.get('ManagementAccountId')
+    if management_account_id and item.get('AccountId') != management_account_id:
+        item = {**item, 'AccountId': management_account_id}
+    return item
+
+def serialize_item(item):
+    return {k: type_serializer.serialize(v) for k, v in item.items()}
+
+def write_events_with_rollups(events, account_id, shard_config=None):
+    """
+    写入健康事件，并增量维护汇总计数。
+
+    每个事件的写入和它对汇总计数的增量放在同一个 TransactWriteItems 中，要么一起生效，要么都不生效；
+    事件的写入带有条件：表中的事件仍是之前读到的状态(新事件则是还不存在)。
+    所以中途失败后重新运行不会漏掉计数，并发写入同一个事件(比如重叠的两次拉取)也不会重复计数：
+    条件不满足的事务被取消，重新读取这些事件后再计算增量并重试。
+    和表中完全相同(LastUpdatedTime 和过期时间都没变)的事件不再重写。
+    汇总表始终按管理账户ID分区，不受事件分片的影响。
+
+    返回:
+    tuple: (写入的事件数, 本次新写入的事件列表)
+    """
+    start_time = time.time()
+    events_by_arn = {event['arn']: event for event in events}
+    pending = list(events_by_arn.values())
+    events_count = 0
+    created_arns = []
+
+    for attempt in range(EVENT_WRITE_MAX_ATTEMPTS):
+        if attempt:
+            time.sleep(random.uniform(0, min(EVENT_WRITE_BACKOFF_MAX, EVENT_WRITE_BACKOFF_BASE * (2 ** attempt))))
+        existing_events = get_existing_events(account_id, pending, shard_config, consistent_read=attempt > 0)
+        plans = {}
+        for event in pending:
+            plan = plan_event_write(event, account_id, shard_config, existing_events.get(event['arn']))
+            if plan:
+                plans[event['arn']] = plan
+
+        failed_arns = []
+        for chunk in chunk_event_writes(plans):
+            try:
+                transact_event_chunk(account_id, chunk)
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'TransactionCanceledException':
+                    raise
+                reasons = {reason.get('Code') for reason in e.response.get('CancellationReasons', [])} - {'None'}
+                print(f"Transaction of {len(chunk)} events for management account {account_id} was canceled: {reasons}")
+                failed_arns.extend(arn for arn, _, _ in chunk)
+                continue
+            events_count += len(chunk)
+            created_arns.extend(arn for arn, _, _ in chunk if arn not in existing_events)
+
+        if not failed_arns:
+            break
+        pending = [events_by_arn[arn] for arn in failed_arns]
+    else:
+        raise RuntimeError(f"{len(pending)} events of management account {account_id} still conflicted after "
+                           f"{EVENT_WRITE_MAX_ATTEMPTS} attempts")
+
+    cost_time = time.time() - start_time
+    print(f"Wrote {events_count} of {len(events_by_arn)} events with rollups into DynamoDB "
+          f"for management account {account_id} in {cost_time:.2f} seconds.")
+    return events_count, [events_by_arn[arn] for arn in created_arns]
+
+def get_existing_events(account_id, events, shard_config=None, consistent_read=False):
+    """
+    批量读取表中已存在的事件(只取汇总和比较需要的字段)，用于计算汇总计数的增量和写入的条件。
+
+    按月分片时分区键随 StartTime 变化，StartTime 改到其它月份的事件(比如重新安排的计划内变更)
+    旧条目还在原来的月份分区中。新位置上找不到的事件，再到查询窗口内的其它月份分区中找。
+
+    返回:
+    dict: 键为事件ARN，值为表中的事件条目(AccountId 为条目实际所在的分区键)
+    """
+    partition_keys = {event['arn']: event_partition_key(account_id, event['arn'], event['startTime'], shard_config)
+                      for event in events}
+    existing_events = {item['EventArn']: item for item in get_event_items(
+        [{'AccountId': partition_key, 'EventArn': arn} for arn, partition_key in partition_keys.items()],
+        consistent_read)}
+
+    if shard_config and shard_config['strategy'] == 'month':
+        month_keys = event_partition_keys(account_id, shard_config)
+        keys = [{'AccountId': month_key, 'EventArn': arn} for arn, partition_key in partition_keys.items()
+                if arn not in existing_events for month_key in month_keys if month_key != partition_key]
+        for item in get_event_items(keys, consistent_read):
+            existing_events.setdefault(item['EventArn'], item)
+    return existing_events
+
+def get_event_items(keys, consistent_read=False):
+    return batch_get_all(HEALTH_EVENTS_TABLE_NAME, keys, projection=EXISTING_EVENT_PROJECTION,
+                         expression_attribute_names={'#region': 'Region'}, consistent_read=consistent_read)
+
+def rollup_dimensions(start_time, service, region, category, status):
+    """汇总计数的维度：(天, 服务, 区域, 类别, 状态)。"""
+    return (convert_datetime_to_string(start_time)[:10], service, region, category, status)
+
+def item_dimensions(item):
+    """HealthEvents 表中的条目对应的汇总维度。"""
+    return rollup_dimensions(item['StartTime'], item['Service'], item['Region'], item['EventTypeCategory'],
+                             item['StatusCode'])
+
+def unchanged_condition(item):
+    """写入条件：表中的事件的维度仍是之前读到的值(没有被并发的写入修改)。"""
+    return {
+        'ConditionExpression': 'StartTime = :old_start AND Service = :old_service AND #region = :old_region '
+                               'AND EventTypeCategory = :old_category AND StatusCode = :old_status',
+        'ExpressionAttributeNames': {'#region': 'Region'},
+        'ExpressionAttributeValues': serialize_item({
+            ':old_start': item['StartTime'],
+            ':old_service': item['Service'],
+            ':old_region': item['Region'],
+            ':old_category': item['EventTypeCategory'],
+            ':old_status': item['StatusCode']
+        })
+    }
+
+def plan_event_write(event, account_id, shard_config, old_item):
+    """
+    计算一个事件的写入操作和它对汇总计数的增量。
+
+    同一个事件会被反复拉取(比如状态从 open 变成 closed)，所以不能简单地加一：
+    - 新事件：条件为条目不存在，新维度 +1；
+    - 维度发生变化的已有事件：条件为维度仍是读到的值，旧维度 -1，新维度 +1；
+    - 维度没变的已有事件：同样的条件，计数不变；
+    - 分区键变化的已有事件(按月分片、StartTime 改到了其它月份)：带同样的条件删除旧条目，
+      新条目的条件为还不存在，旧维度 -1，新维度 +1。
+
+    返回:
+    tuple: (TransactWriteItems 的操作列表, {维度元组: 计数增量})；事件和表中相同、不需要写入时返回 None
+    """
+    item = build_event_item(event, account_id, shard_config)
+    new_dims = item_dimensions(item)
+    if old_item is None:
+        put = {'TableName': HEALTH_EVENTS_TABLE_NAME, 'Item': serialize_item(item),
+               'ConditionExpression': 'attribute_not_exists(EventArn)'}
+        return [{'Put': put}], {new_dims: 1}
+
+    if old_item['AccountId'] == item['AccountId'] and old_item.get('LastUpdatedTime') == item['LastUpdatedTime'] \
+            and old_item.get('ExpirationTime') == item['ExpirationTime']:
+        return None
+    old_dims = item_dimensions(old_item)
+    deltas = {} if old_dims == new_dims else {old_dims: -1, new_dims: 1}
+    if old_item['AccountId'] != item['AccountId']:
+        delete = {'TableName': HEALTH_EVENTS_TABLE_NAME,
+                  'Key': serialize_item({'AccountId': old_item['AccountId'], 'EventArn': old_item['EventArn']}),
+                  **unchanged_condition(old_item)}
+        put = {'TableName': HEALTH_EVENTS_TABLE_NAME, 'Item': serialize_item(item),
+               'ConditionExpression': 'attribute_not_exists(EventArn)'}
+        return [{'Delete': delete}, {'Put': put}], deltas
+
+    put = {'TableName': HEALTH_EVENTS_TABLE_NAME, 'Item': serialize_item(item), **unchanged_condition(old_item)}
+    return [{'Put': put}], deltas
+
+def chunk_event_writes(plans):
+    """
+    把各个事件的写入分批，每批的事件操作数加上涉及的汇总条目数不超过 TRANSACT_WRITE_LIMIT。
+    同一个汇总条目在一个事务中只能出现一次，所以同一批的增量按维度合并。
+
+    返回:
+    generator: 每批为 [(事件ARN, 操作列表, 增量), ...]
+    """
+    chunk, action_count, rollup_keys = [], 0, set()
+    for arn, (actions, deltas) in plans.items():
+        keys = rollup_keys | set(deltas)
+        if chunk and action_count + len(actions) + len(keys) > TRANSACT_WRITE_LIMIT:
+            yield chunk
+            chunk, action_count, keys = [], 0, set(deltas)
+        chunk.append((arn, actions, deltas))
+        action_count += len(actions)
+        rollup_keys = keys
+    if chunk:
+        yield chunk
+
+def transact_event_chunk(account_id, chunk):
+    """在一个事务中写入一批事件，并更新它们涉及的汇总计数。"""
+    rollup_deltas = defaultdict(int)
+    for _, _, deltas in chunk:
+        for dims, delta in deltas.items():
+            rollup_deltas[dims] += delta
+    transact_items = [action for _, actions, _ in chunk for action in actions]
+    transact_items.extend(build_rollup_update(account_id, dims, delta)
+                          for dims, delta in rollup_deltas.items() if delta != 0)
+    dynamodb_client.transact_write_items(TransactItems=transact_items)
+
+def build_rollup_update(account_id, dims, delta):
+    """
+    汇总计数的增量(原子的 ADD，不需要读-改-写)，作为 TransactWriteItems 中的一个 Update。
+    汇总条目的过期时间和这一天的事件条目相同，事件被 TTL 删除时汇总条目也一起删除。
+    """
+    day, service, region, category, status = dims
+    return {'Update': {
+        'TableName': EVENT_ROLLUPS_TABLE_NAME,
+        'Key': serialize_item({
+            'AccountId': account_id, # 分区键
+            'RollupKey': f'{day}#{service}#{region}#{category}#{status}' # 排序键
+        }),
+        'UpdateExpression': 'ADD EventCount :delta '
+                            'SET #day = :day, Service = :service, #region = :region, '
+                            'EventTypeCategory = :category, StatusCode = :status, ExpirationTime = :exp',
+        'ExpressionAttributeNames': {'#day': 'Day', '#region': 'Region'},
+        'ExpressionAttributeValues': serialize_item({
+            ':delta': delta,
+            ':day': day,
+            ':service': service,
+            ':region': region,
+            ':category': category,
+            ':status': status,
+            ':exp': get_day_expiration_time(day)
+        })
+    }}
@@ -0,0 +1,50 @@
+import os
+import time
+from datetime import datetime, timezone
+
+import boto3
+
+try:
+    # 本地开发时使用
+    from common.constants import BEDROCK_INTERPRETATIONS_TABLE_NAME
+except ImportError:
+    # 部署到 Lambda 时使用
+    from constants import BEDROCK_INTERPRETATIONS_TABLE_NAME
+
+'''
+Bedrock 解读结果的持久化缓存。
+
+同一个事件被多个用户打开时，输入(事件描述、受影响实体、模型、Prompt 版本)完全相同，
+生成的解读也可以复用。缓存键由调用方根据这些输入计算(见 api/query_bedrock)，
+这里只负责读写 BedrockInterpretations 表：
+- InterpretationKey(分区键): 输入的哈希
+- Result: 模型生成的结果
+- ModelId、PromptVersion、CreatedAt: 便于排查
+- ExpirationTime: TTL，过期后由 DynamoDB 自动删除
+'''
+
+# 初始化 DynamoDB 客户端
+dynamodb = boto3.resource('dynamodb')
+interpretations_table = dynamodb.Table(BEDROCK_INTERPRETATIONS_TABLE_NAME)
+
+INTERPRETATION_TTL_DAYS = int(os.environ.get('INTERPRETATION_TTL_DAYS', '30'))
+
+
+def get_interpretation(cache_key):
+    """读取缓存的解读结果，不存在或已过期(TTL 删除有延迟)时返回 None。"""
+    item = interpretations_table.get_item(Key={'InterpretationKey': cache_key}).get('Item')
+    if not item or int(item.get('ExpirationTime', 0)) < time.time():
+        return None
+    return item['Result']
+
+
+def put_interpretation(cache_key, result, model_id, prompt_version):
+    """写入解读结果。"""
+    interpretations_table.put_item(Item={
+        'InterpretationKey': cache_key, # 分区键
+        'Result': result,
+        'ModelId': model_id,
+        'PromptVersion': prompt_version,
+        'CreatedAt': datetime.now(timezone.utc).isoformat(),
+        'ExpirationTime': int(time.time()) + INTERPRETATION_TTL_DAYS * 24 * 3600
+    })
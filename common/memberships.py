@@ -0,0 +1,125 @@
+import boto3
+from boto3.dynamodb.types import TypeDeserializer
+
+try:
+    # 本地开发时使用
+    from common.constants import ACCOUNT_MEMBERSHIPS_TABLE_NAME, USER_ACCOUNTS_INDEX_NAME, USERS_TABLE_NAME
+    from common.batch_get import batch_get_all
+except ImportError:
+    # 部署到 Lambda 时使用
+    from constants import ACCOUNT_MEMBERSHIPS_TABLE_NAME, USER_ACCOUNTS_INDEX_NAME, USERS_TABLE_NAME
+    from batch_get import batch_get_all
+
+'''
+管理账户和用户的成员关系。
+
+之前成员关系冗余存放在两处：管理账户条目的 AllowedUsers 映射，和用户条目的 AllowedAccountIds 集合。
+用户多的组织会让管理账户条目接近 400 KB 的上限，并且每次修改都要重写整个映射。
+现在每个 (管理账户, 用户) 一行：
+- AccountId(分区键): 管理账户ID
+- UserId(排序键): 用户ID(邮箱)
+- UserName: 用户在这个管理账户下的显示名
+反向索引 USER_ACCOUNTS_INDEX_NAME 按 (UserId, AccountId) 查询用户允许访问的管理账户。
+用户条目(Users 表)只保存用户自己的信息(UserName)。
+
+升级后、运行 deploy/data_collection/backfill_account_memberships.py 之前，成员关系表还是空的。
+这段时间内没有成员关系的用户按旧的 AllowedAccountIds 判断权限(见 get_user_account_ids)，
+否则原来受限的用户会被当成可以访问全部账户。回填脚本加 --remove-legacy 删除旧属性后不再回退。
+'''
+
+# 初始化 DynamoDB 客户端
+dynamodb = boto3.resource('dynamodb')
+dynamodb_client = boto3.client('dynamodb')
+memberships_table = dynamodb.Table(ACCOUNT_MEMBERSHIPS_TABLE_NAME)
+users_table = dynamodb.Table(USERS_TABLE_NAME)
+
+type_deserializer = TypeDeserializer()
+
+
+def query_all(**params):
+    """用低级客户端查询成员关系表(自动翻页，线程安全)。"""
+    items = []
+    for page in dynamodb_client.get_paginator('query').paginate(TableName=ACCOUNT_MEMBERSHIPS_TABLE_NAME, **params):
+        items.extend({k: type_deserializer.deserialize(v) for k, v in item.items()} for item in page['Items'])
+    return items
+
+
+def get_user_account_ids(user_id):
+    """
+    通过反向索引查询用户允许访问的管理账户。
+    没有成员关系时回退到用户条目上旧的 AllowedAccountIds(成员关系回填之前)。
+
+    返回:
+    list: 管理账户ID列表(升序)
+    """
+    items = query_all(
+        IndexName=USER_ACCOUNTS_INDEX_NAME,
+        KeyConditionExpression='UserId = :user_id',
+        ExpressionAttributeValues={':user_id': {'S': user_id}}
+    )
+    if items:
+        return [item['AccountId'] for item in items]
+    return get_legacy_user_account_ids(user_id)
+
+
+def get_legacy_user_account_ids(user_id):
+    """读取用户条目上旧的 AllowedAccountIds 集合，没有时返回空列表。"""
+    item = users_table.get_item(Key={'UserId': user_id}, ProjectionExpression='AllowedAccountIds').get('Item') or {}
+    account_ids = sorted(item.get('AllowedAccountIds', []))
+    if account_ids:
+        print(f"No memberships for user {user_id}, falling back to the legacy AllowedAccountIds: {account_ids}")
+    return account_ids
+
+
+def get_account_members(account_id):
+    """
+    查询管理账户的全部成员。
+
+    返回:
+    dict: 用户ID -> 用户名
+    """
+    items = query_all(
+        KeyConditionExpression='AccountId = :account_id',
+        ExpressionAttributeValues={':account_id': {'S': account_id}}
+    )
+    return {item['UserId']: item.get('UserName', '') for item in items}
+
+
+def get_memberships(account_id, user_ids):
+    """
+    按键批量读取管理账户中指定用户的成员关系。
+
+    返回:
+    dict: 是成员的用户ID -> 用户名
+    """
+    items = batch_get_all(ACCOUNT_MEMBERSHIPS_TABLE_NAME,
+                          [{'AccountId': account_id, 'UserId': user_id} for user_id in user_ids])
+    return {item['UserId']: item.get('UserName', '') for item in items}
+
+
+def write_memberships(puts=(), deletes=()):
+    """
+    批量写入成员关系(BatchWriteItem，每批 25 个，未处理的条目由 batch_writer 自动重试)。
+
+    参数:
+    puts (iterable): (管理账户ID, 用户ID, 用户名) 的列表，已存在时覆盖用户名
+    deletes (iterable): (管理账户ID, 用户ID) 的列表
+
+    返回:
+    int: 写入的条目数
+    """
+    count = 0
+    with memberships_table.batch_writer(overwrite_by_pkeys=['AccountId', 'UserId']) as batch:
+        for account_id, user_id, user_name in puts:
+            batch.put_item(Item={'AccountId': account_id, 'UserId': user_id, 'UserName': user_name or ''})
+            count += 1
+        for account_id, user_id in deletes:
+            batch.delete_item(Key={'AccountId': account_id, 'UserId': user_id})
+            count += 1
+    return count
+
+
+def delete_account_memberships(account_id):
+    """删除管理账户的全部成员关系，返回删除的条目数。"""
+    user_ids = list(get_account_members(account_id))
+    return write_memberships(deletes=[(account_id, user_id) for user_id in user_ids])
@@ -0,0 +1,98 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    # 本地开发时使用
+    from common.cache import TTLCache
+    from common.memberships import get_user_account_ids
+except ImportError:
+    # 部署到 Lambda 时使用
+    from cache import TTLCache
+    from memberships import get_user_account_ids
+
+
+# 用户权限缓存，TTL 很短，权限变更最多延迟这么久生效
+permission_cache = TTLCache(
+    max_size=int(os.environ.get('PERMISSION_CACHE_MAX_ENTRIES', '1024')),
+    ttl=int(os.environ.get('PERMISSION_CACHE_TTL_SECONDS', '60'))
+)
+
+# 批量查询多个用户时并发查询的线程数
+PERMISSION_QUERY_MAX_WORKERS = int(os.environ.get('PERMISSION_QUERY_MAX_WORKERS', '8'))
+
+
+def get_allowed_accounts(user_id):
+    """
+    获取用户允许访问的账户信息(带缓存)。
+
+    参数:
+    user_id (str): 用户 ID
+
+    返回:
+    list: 允许访问的账户信息列表，每个元素是一个包含 AccountId 的字典
+    """
+    return batch_get_allowed_accounts([user_id])[user_id]
+
+
+def batch_get_allowed_accounts(user_ids):
+    """
+    批量获取多个用户允许访问的账户信息(带缓存)。
+
+    缓存中没有的用户并发查询成员关系表的反向索引(每个用户一次 Query)，没有成员关系的用户返回空列表。
+
+    参数:
+    user_ids (list): 用户 ID 列表
+
+    返回:
+    dict: 键为用户 ID，值为允许访问的账户信息列表
+    """
+    result = {}
+    missing_user_ids = []
+    for user_id in dict.fromkeys(user_ids):
+        allowed_accounts = permission_cache.get(user_id)
+        if allowed_accounts is None:
+            missing_user_ids.append(user_id)
+        else:
+            result[user_id] = allowed_accounts
+
+    if missing_user_ids:
+        with ThreadPoolExecutor(max_workers=min(len(missing_user_ids), PERMISSION_QUERY_MAX_WORKERS)) as executor:
+            account_ids_by_user = dict(zip(missing_user_ids, executor.map(get_user_account_ids, missing_user_ids)))
+
+    for user_id in missing_user_ids:
+        allowed_accounts = [{'AccountId': account_id} for account_id in account_ids_by_user[user_id]]
+        result[user_id] = allowed_accounts
+        permission_cache.put(user_id, allowed_accounts)
+        print(f"Allowed accounts for user {user_id}: {allowed_accounts}")
+
+    return result
+
+
+def resolve_account_ids(user_id, account_ids=None):
+    """
+    根据用户权限确定要查询的管理账户。
+
+    - 没有指定 account_ids 时，返回用户允许访问的全部管理账户；
+    - 用户没有配置允许访问的账户时，和 query_health_events 一样视为可以访问指定的全部账户；
+    - 否则只保留用户有权限访问的账户。
+
+    参数:
+    user_id (str): 用户 ID
+    account_ids (list, optional): 请求中指定的管理账户ID列表
+
+    返回:
+    list: 最终要查询的管理账户ID列表
+    """
+    allowed_account_ids = {acc['AccountId'] for acc in get_allowed_accounts(user_id)}
+
+    if not account_ids:
+        return sorted(allowed_account_ids)
+
+    if not allowed_account_ids:
+        print(f"No allowed accounts specified for user {user_id}. Assuming access to all accounts.")
+        return list(account_ids)
+
+    unauthorized_accounts = set(account_ids) - allowed_account_ids
+    if unauthorized_accounts:
+        print(f"Warning: Skipped {unauthorized_accounts}. Because User {user_id} is not authorized to access these accounts.")
+    return [account_id for account_id in account_ids if account_id in allowed_account_ids]
@@ -0,0 +1,57 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶，用于把调用速率限制在配额之内。
+
+    令牌以 rate 个/秒的速度补充，最多积累 capacity 个；每次调用前 acquire 一个令牌。
+    只在当前进程内生效，多个 Lambda 实例共享同一个配额时，需要按并发数分摊 rate。
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def try_acquire(self):
+        """有令牌时取走一个并返回 True，否则立即返回 False。"""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def acquire(self, timeout=None):
+        """
+        等待并取走一个令牌。
+
+        参数:
+        timeout (float, optional): 最多等待的秒数，None 表示一直等待
+
+        返回:
+        bool: 是否取到了令牌
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
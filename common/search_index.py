@@ -0,0 +1,183 @@
+import re
+import time
+from collections import defaultdict
+
+import boto3
+from boto3.dynamodb.types import Binary, TypeDeserializer
+
+try:
+    # 本地开发时使用
+    from common.constants import SEARCH_INDEX_TABLE_NAME
+except ImportError:
+    # 部署到 Lambda 时使用
+    from constants import SEARCH_INDEX_TABLE_NAME
+
+'''
+事件描述的全文倒排索引。
+
+索引表的每个条目是一个倒排项(一个词项在一个事件中的出现)：
+- Term: 词项(分区键)
+- Bucket: `事件 StartTime 所在的日期#事件ARN`，如 2024-08-01#arn:...(排序键)，按时间过滤时用日期做范围条件
+- StartTime, ManagementAccountId
+- Positions: 词项在事件中的位置列表，用于短语匹配。按差分后的 varint 编码成二进制
+  (见 encode_positions)，一个位置通常只占一个字节，比 DynamoDB 的数字列表小得多
+
+每个倒排项单独写入，并发的拉取不会互相覆盖，条目大小也不会随常用词的文档数增长。
+事件描述变化后，不再出现的词项对应的倒排项会被删除。
+
+写入由 fetch_health_events 的 insert_event_details 维护，查询由 search_events 完成。
+'''
+
+# 初始化 DynamoDB 客户端
+dynamodb = boto3.resource('dynamodb')
+dynamodb_client = boto3.client('dynamodb')
+search_index_table = dynamodb.Table(SEARCH_INDEX_TABLE_NAME)
+
+type_deserializer = TypeDeserializer()
+
+TOKEN_REGEX = re.compile(r'[a-z0-9]+')
+
+STOP_WORDS = frozenset([
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'been', 'by', 'can', 'for', 'from', 'has', 'have',
+    'if', 'in', 'into', 'is', 'it', 'its', 'of', 'on', 'or', 'our', 'that', 'the', 'their', 'this',
+    'to', 'was', 'we', 'were', 'will', 'with', 'you', 'your',
+])
+
+# 元数据词项的位置和描述之间留出间隔，避免短语跨越描述和元数据匹配
+METADATA_POSITION_GAP = 2
+
+# 参与索引的元数据字段
+METADATA_FIELDS = ('Service', 'EventTypeCode', 'EventTypeCategory', 'Region')
+
+
+def tokenize(text):
+    """把文本切分成小写的词项列表(去掉停用词，但保留原始位置，用于短语匹配)。"""
+    return [(position, token) for position, token in enumerate(TOKEN_REGEX.findall((text or '').lower()))
+            if token not in STOP_WORDS]
+
+
+def build_document_terms(item):
+    """
+    计算一个事件详情条目的 {词项: [位置, ...]}。
+    索引内容为 LatestDescription 加上关键元数据(服务、事件类型、类别、区域)。
+    """
+    terms = defaultdict(list)
+    tokens = tokenize(item.get('LatestDescription', ''))
+    for position, token in tokens:
+        terms[token].append(position)
+
+    position = (tokens[-1][0] if tokens else 0) + METADATA_POSITION_GAP
+    for field in METADATA_FIELDS:
+        for offset, token in tokenize(item.get(field, '')):
+            terms[token].append(position + offset)
+        position += len(TOKEN_REGEX.findall((item.get(field) or '').lower())) + METADATA_POSITION_GAP
+    return terms
+
+
+def encode_positions(positions):
+    """把升序的位置列表编码成差分 varint(每个字节低 7 位为数据，最高位表示后面还有字节)。"""
+    data = bytearray()
+    previous = 0
+    for position in positions:
+        delta = position - previous
+        previous = position
+        while delta >= 0x80:
+            data.append((delta & 0x7f) | 0x80)
+            delta >>= 7
+        data.append(delta)
+    return bytes(data)
+
+
+def decode_positions(data):
+    """encode_positions 的逆操作，返回位置列表。"""
+    if isinstance(data, Binary):
+        data = data.value
+    positions = []
+    current = delta = shift = 0
+    for byte in bytes(data):
+        delta |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        current += delta
+        positions.append(current)
+        delta = shift = 0
+    return positions
+
+
+def posting_keys(item):
+    """一个事件详情条目的全部倒排项的键 {(Term, Bucket): 位置列表}。"""
+    bucket = f"{(item.get('StartTime') or '')[:10]}#{item['EventArn']}"
+    return {(term, bucket): positions for term, positions in build_document_terms(item).items()}
+
+
+def index_event_details(account_id, items, expiration_time, previous_items=None):
+    """
+    把一批事件详情条目加入倒排索引。
+
+    每个 (词项, 事件) 写一个倒排项(BatchWriteItem)，重新拉取的事件覆盖自己的倒排项；
+    previous_items 中旧描述有、新描述没有的词项，对应的倒排项被删除。
+
+    参数:
+    account_id (str): 管理账户ID
+    items (list): EventDetails 表中的条目
+    expiration_time (int): 倒排项的过期时间(TTL)
+    previous_items (dict, optional): 事件ARN -> 写入前 EventDetails 表中的条目
+
+    返回:
+    int: 写入和删除的倒排项数量
+    """
+    start = time.time()
+    puts = {}
+    stale_keys = set()
+    for item in items:
+        keys = posting_keys(item)
+        for (term, bucket), positions in keys.items():
+            puts[(term, bucket)] = {
+                'Term': term, # 分区键
+                'Bucket': bucket, # 排序键
+                'StartTime': item.get('StartTime') or '',
+                'ManagementAccountId': account_id,
+                'Positions': encode_positions(positions),
+                'ExpirationTime': expiration_time
+            }
+        previous_item = (previous_items or {}).get(item['EventArn'])
+        if previous_item:
+            stale_keys.update(posting_keys(previous_item).keys() - keys.keys())
+
+    with search_index_table.batch_writer(overwrite_by_pkeys=['Term', 'Bucket']) as batch:
+        for posting in puts.values():
+            batch.put_item(Item=posting)
+        for term, bucket in stale_keys:
+            batch.delete_item(Key={'Term': term, 'Bucket': bucket})
+
+    cost_time = time.time() - start
+    print(f"Indexed {len(items)} event details into {len(puts)} postings, removed {len(stale_keys)} stale postings "
+          f"in {cost_time:.2f} seconds.")
+    return len(puts) + len(stale_keys)
+
+
+def query_term(term, start_day, end_day):
+    """
+    查询一个词项在 [start_day, end_day] 之间的全部倒排项(自动翻页)。
+    使用低级客户端(线程安全)，可以在线程池中并发查询多个词项。
+
+    返回:
+    dict: {事件ARN: [StartTime, 管理账户ID, 位置列表]}
+    """
+    postings = {}
+    # Bucket 以日期开头，'~' 比 '#' 和事件ARN中的字符都大，覆盖 end_day 当天的全部倒排项
+    for page in dynamodb_client.get_paginator('query').paginate(
+        TableName=SEARCH_INDEX_TABLE_NAME,
+        KeyConditionExpression='Term = :term AND Bucket BETWEEN :start_day AND :end_day',
+        ExpressionAttributeValues={
+            ':term': {'S': term},
+            ':start_day': {'S': start_day},
+            ':end_day': {'S': f'{end_day}~'}
+        }
+    ):
+        for raw_item in page['Items']:
+            item = {k: type_deserializer.deserialize(v) for k, v in raw_item.items()}
+            event_arn = item['Bucket'].split('#', 1)[1]
+            postings[event_arn] = [item['StartTime'], item['ManagementAccountId'], decode_positions(item['Positions'])]
+    return postings
@@ -1,4 +1,44 @@
+import base64
 import json
+import os
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+
+# orjson 是可选依赖(需要打包进 Lambda Layer)，没有安装时回退到标准库
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 响应体小于这个字节数时不压缩(压缩收益不明显)
+MIN_COMPRESS_SIZE = 1024
+
+# 生成NDJSON/JSON响应体时，每次输出的条目数
+CHUNK_ITEMS = 500
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+# JSON 编码器: 'auto'(有 orjson 就用 orjson), 'orjson' 或 'stdlib'
+JSON_ENCODER = os.environ.get('JSON_ENCODER', 'auto')
+
+def get_header(event, name):
+    """
+    从API Gateway的代理事件中读取请求头(大小写不敏感)。
+
+    参数:
+    event (dict): 原始事件字典(未经 parse_event 解析)
+    name (str): 请求头名称
+
+    返回:
+    str: 请求头的值，不存在时返回空字符串
+    """
+    headers = (event or {}).get('headers') or {}
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value or ''
+    return ''
 
 def parse_event(event):
     """
@@ -12,15 +52,171 @@ def parse_event(event):
     """
     if 'body' in event:
         try:
-            body = json.loads(event['body'])
+            body = event['body'] or ''
+            # API Gateway 配置了 binary media types 后，请求体会以 base64 编码传入
+            if event.get('isBase64Encoded'):
+                body = base64.b64decode(body).decode('utf-8')
+            body = json.loads(body)
             if 'body' in body:
                 body = json.loads(body['body'])
             return body
-        except json.JSONDecodeError:
+        except (json.JSONDecodeError, ValueError):
             return {}
     return event
 
-def create_response(status_code, message, data=None):
+def encode_next_token(offset):
+    """把分页的偏移量编码成不透明的 next_token。"""
+    return base64.urlsafe_b64encode(json.dumps({'offset': offset}).encode('utf-8')).decode('ascii')
+
+def decode_next_token(token):
+    """
+    解析 encode_next_token 生成的 next_token，没有 token 时返回 0。
+
+    异常:
+    ValueError, KeyError, TypeError: token 格式不正确或偏移量为负数
+    """
+    if not token:
+        return 0
+    offset = int(json.loads(base64.urlsafe_b64decode(token.encode('ascii')))['offset'])
+    if offset < 0:
+        raise ValueError(f"Invalid next_token offset: {offset}")
+    return offset
+
+def json_dump_default(obj):
+    """
+    JSON 编码的 default 钩子：
+    - boto3 resource 层返回的 Decimal 转成 int/float；
+    - DynamoDB 的 String Set 等集合转成列表；
+    - datetime(Health API 直接返回的事件中会有)转成 ISO 格式字符串。
+    """
+    if isinstance(obj, Decimal):
+        as_int = int(obj)
+        return as_int if as_int == obj else float(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def convert_decimals(obj):
+    """
+    递归地把 Decimal/集合/datetime 一次性转换成可以直接 JSON 编码的类型。
+
+    对需要反复编码的数据(比如缓存中的查询结果)，先转换一次，之后每次编码都不再经过 default 钩子。
+    """
+    obj_type = type(obj)
+    if obj_type is dict:
+        return {k: convert_decimals(v) for k, v in obj.items()}
+    if obj_type is list:
+        return [convert_decimals(v) for v in obj]
+    if obj_type is str or obj_type is int or obj_type is bool or obj is None:
+        return obj
+    if isinstance(obj, (list, tuple)):
+        return [convert_decimals(v) for v in obj]
+    return json_dump_default(obj) if isinstance(obj, (Decimal, set, frozenset, datetime, date)) else obj
+
+def stdlib_json_dumps(obj):
+    """标准库实现：紧凑分隔符、不转义非ASCII、跳过循环引用检查，走 C 加速的编码路径。"""
+    return json.dumps(obj, default=json_dump_default, ensure_ascii=False,
+                      check_circular=False, separators=(',', ':'))
+
+def orjson_dumps(obj):
+    """orjson 实现：Decimal/集合 等不原生支持的类型交给 default 钩子。"""
+    return orjson.dumps(obj, default=json_dump_default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+def get_json_encoder(name=None):
+    """
+    根据名字选择 JSON 编码函数。
+
+    参数:
+    name (str, optional): 'auto'、'orjson' 或 'stdlib'，默认取环境变量 JSON_ENCODER
+
+    返回:
+    callable: 输入对象，返回 JSON 字符串的函数
+    """
+    name = name or JSON_ENCODER
+    if name == 'orjson' or (name == 'auto' and orjson is not None):
+        if orjson is None:
+            print("orjson is not available, falling back to stdlib json encoder.")
+            return stdlib_json_dumps
+        return orjson_dumps
+    return stdlib_json_dumps
+
+json_dumps = get_json_encoder()
+
+def iter_json_chunks(body):
+    """生成 JSON 响应体(一次性编码，走最快的编码路径)。"""
+    yield json_dumps(body)
+
+def iter_ndjson_chunks(body, ndjson_key):
+    """
+    分块生成 NDJSON 响应体：
+    第一行是除列表字段外的其它字段(message 等)，之后每个列表元素占一行。
+    """
+    items = body.get(ndjson_key) or []
+    header = {k: v for k, v in body.items() if k != ndjson_key}
+    header['ndjson_key'] = ndjson_key
+    header['count'] = len(items)
+    yield json_dumps(header) + '\n'
+
+    for i in range(0, len(items), CHUNK_ITEMS):
+        yield ''.join(json_dumps(item) + '\n' for item in items[i:i+CHUNK_ITEMS])
+
+def encode_body(chunks, gzip_enabled):
+    """
+    把分块生成的响应体编码为最终的 body。
+
+    返回:
+    tuple: (body 字符串, 是否 base64 编码, 原始字节数, 编码后字节数)
+    """
+    if not gzip_enabled:
+        body = ''.join(chunks)
+        size = len(body.encode('utf-8'))
+        return body, False, size, size
+
+    # wbits=31 表示输出 gzip 格式，边生成边压缩，不需要先拼出完整的字符串
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    raw_size = 0
+    compressed = []
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        raw_size += len(data)
+        compressed.append(compressor.compress(data))
+    compressed.append(compressor.flush())
+    payload = b''.join(compressed)
+    return base64.b64encode(payload).decode('ascii'), True, raw_size, len(payload)
+
+CORS_ALLOW_HEADERS = "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,If-None-Match"
+CORS_EXPOSE_HEADERS = "ETag,Content-Encoding,X-Compression-Ratio,X-Cache-Stats"
+
+def format_cache_stats(stats):
+    """把缓存的 stats() 格式化成响应头的值，如 `size=12, bytes=3456, hits=10, misses=2, evictions=0`。"""
+    return ', '.join(f'{key}={value}' for key, value in stats.items())
+
+def etag_matches(request_event, etag):
+    """判断请求头 If-None-Match 是否和给定的 ETag 匹配(支持逗号分隔的多个值和弱校验前缀 W/)。"""
+    if_none_match = get_header(request_event, 'If-None-Match')
+    if not if_none_match or not etag:
+        return False
+    candidates = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+    return '*' in candidates or etag.removeprefix('W/') in candidates
+
+def not_modified_response(etag):
+    """创建 304 Not Modified 响应(没有响应体)。"""
+    return {
+        'statusCode': 304,
+        'headers': {
+            "ETag": etag,
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Headers": CORS_ALLOW_HEADERS,
+            "Access-Control-Expose-Headers": CORS_EXPOSE_HEADERS,
+            "Access-Control-Allow-Methods": "OPTIONS,GET,POST",
+        },
+        'body': ''
+    }
+
+def create_response(status_code, message, data=None, request_event=None, ndjson_key=None, etag=None,
+                    extra_headers=None):
     """
     创建API响应。
 
@@ -28,6 +224,12 @@ def create_response(status_code, message, data=None):
     status_code (int): HTTP状态码
     message (str): 响应消息
     data (dict, optional): 包含其他信息的可选字典
+    request_event (dict, optional): 原始请求事件(未经 parse_event 解析)。提供时会根据请求头：
+        - Accept-Encoding 包含 gzip 时，压缩响应体并 base64 编码(需要 API Gateway 配置 binary media types)；
+        - Accept 包含 application/x-ndjson 且提供了 ndjson_key 时，以 NDJSON 格式返回。
+    ndjson_key (str, optional): data 中的列表字段名，NDJSON 模式下逐行输出这个列表的元素
+    etag (str, optional): 响应的 ETag，客户端下次可以通过 If-None-Match 做条件请求
+    extra_headers (dict, optional): 额外的响应头(比如 X-Cache-Stats)，不在 ETag 覆盖的响应体中
 
     返回:
     dict: 包含状态码、消息和可选数据的字典
@@ -38,22 +240,51 @@ def create_response(status_code, message, data=None):
     if data is not None:
         body.update(data)
 
-    def json_dump_default(obj):
-        from decimal import Decimal
-        if isinstance(obj, Decimal):
-            if obj.to_integral_value() == obj:
-                return int(obj)
-            else:
-                return float(obj)
-        return obj
-    
+    headers = {
+        "Content-Type": "application/json",
+        "Access-Control-Allow-Origin": "*",  # 允许所有来源访问
+        "Access-Control-Allow-Headers": CORS_ALLOW_HEADERS,
+        "Access-Control-Allow-Methods": "OPTIONS,GET,POST",  # 允许的HTTP方法
+    }
+    if etag:
+        headers["ETag"] = etag
+        headers["Access-Control-Expose-Headers"] = CORS_EXPOSE_HEADERS
+    if extra_headers:
+        headers.update(extra_headers)
+        headers["Access-Control-Expose-Headers"] = CORS_EXPOSE_HEADERS
+
+    if request_event is None:
+        return {
+            'statusCode': status_code,
+            'headers': headers,
+            'body': json_dumps(body)
+        }
+
+    if ndjson_key and NDJSON_CONTENT_TYPE in get_header(request_event, 'Accept'):
+        headers['Content-Type'] = NDJSON_CONTENT_TYPE
+        chunks = iter_ndjson_chunks(body, ndjson_key)
+    else:
+        chunks = iter_json_chunks(body)
+
+    accept_gzip = 'gzip' in get_header(request_event, 'Accept-Encoding').lower()
+    if accept_gzip:
+        # 先生成一次，太小的响应不值得压缩
+        chunks = list(chunks)
+        accept_gzip = sum(len(chunk) for chunk in chunks) >= MIN_COMPRESS_SIZE
+
+    encoded_body, is_base64, raw_size, encoded_size = encode_body(chunks, accept_gzip)
+
+    headers["Vary"] = "Accept, Accept-Encoding"
+    headers["Access-Control-Expose-Headers"] = CORS_EXPOSE_HEADERS
+    if is_base64:
+        headers["Content-Encoding"] = "gzip"
+        ratio = raw_size / encoded_size if encoded_size else 1.0
+        headers["X-Compression-Ratio"] = f"{ratio:.2f}"
+        print(f"Response body compressed: {raw_size} -> {encoded_size} bytes, ratio {ratio:.2f}")
+
     return {
         'statusCode': status_code,
-        'headers': {
-            "Content-Type": "application/json",
-            "Access-Control-Allow-Origin": "*",  # 允许所有来源访问
-            "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token",
-            "Access-Control-Allow-Methods": "OPTIONS,GET,POST",  # 允许的HTTP方法
-        },
-        'body': json.dumps(body, default=json_dump_default)
-    }
\ No newline at end of file
+        'headers': headers,
+        'isBase64Encoded': is_base64,
+        'body': encoded_body
+    }
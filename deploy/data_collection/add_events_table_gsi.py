@@ -12,17 +12,9 @@ NAME_PREFIX = 'AwsHealthDashboard'
 HEALTH_EVENTS_TABLE_NAME = f'{NAME_PREFIX}HealthEvents'
 
 # 根据查询场景需求，给HEALTH_EVENTS_TABLE_NAME加二级索引
+# 原来的 GSI2(awsAccountIds) 从来没有条目写入这个属性，已去掉：
+# 按成员账户查询使用受影响账户表上的反向索引 MemberAccountIndex
 GSI_DEFINITIONS = [
-    {
-        'IndexName': 'GSI2',
-        'KeySchema': [
-            {'AttributeName': 'awsAccountIds', 'KeyType': 'HASH'},
-            {'AttributeName': 'StartTime', 'KeyType': 'RANGE'}
-        ],
-        'Projection': {
-            'ProjectionType': 'ALL'
-        }
-    },
     {
         'IndexName': 'GSI3',
         'KeySchema': [
@@ -84,7 +76,6 @@ def add_gsi_if_not_exists(table_name, gsi_definition):
     response = dynamodb_client.update_table(
         TableName=table_name,
         AttributeDefinitions=[
-            {'AttributeName': 'awsAccountIds', 'AttributeType': 'S'},
             {'AttributeName': 'EventTypeCode', 'AttributeType': 'S'},
             {'AttributeName': 'Region', 'AttributeType': 'S'},
             {'AttributeName': 'Service', 'AttributeType': 'S'},
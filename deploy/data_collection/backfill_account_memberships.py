@@ -0,0 +1,80 @@
+import argparse
+import os
+import sys
+
+import boto3
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from common.constants import ACCOUNTS_TABLE_NAME, USERS_TABLE_NAME, ACCOUNT_MEMBERSHIPS_TABLE_NAME, DATA_GENERATION_KEY
+
+'''
+这是一个幂等的脚本，把旧的成员关系(管理账户条目的 AllowedUsers 映射、用户条目的 AllowedAccountIds 集合)
+迁移到成员关系表 AccountMemberships 中。之后的注册、更新、注销和权限检查只使用成员关系表。
+
+加上 --remove-legacy 时，迁移后删除这两个旧属性。
+
+用法:
+python backfill_account_memberships.py [--remove-legacy]
+'''
+
+dynamodb = boto3.resource('dynamodb')
+accounts_table = dynamodb.Table(ACCOUNTS_TABLE_NAME)
+users_table = dynamodb.Table(USERS_TABLE_NAME)
+memberships_table = dynamodb.Table(ACCOUNT_MEMBERSHIPS_TABLE_NAME)
+
+def scan_all(table, **kwargs):
+    while True:
+        response = table.scan(**kwargs)
+        yield from response.get('Items', [])
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def load_memberships():
+    """返回 ({(AccountId, UserId): UserName}, 带 AllowedUsers 的账户ID列表, 带 AllowedAccountIds 的用户ID列表)。"""
+    memberships = {}
+    legacy_accounts = []
+    account_ids = set()
+    for item in scan_all(accounts_table):
+        if item['AccountId'] == DATA_GENERATION_KEY:
+            continue
+        account_ids.add(item['AccountId'])
+        if 'AllowedUsers' in item:
+            legacy_accounts.append(item['AccountId'])
+        for user_id, user_name in item.get('AllowedUsers', {}).items():
+            memberships[(item['AccountId'], user_id)] = user_name
+
+    # 用户条目中有、但账户条目中没有的关系(两处不一致时)，只保留仍然注册着的账户
+    legacy_users = []
+    for item in scan_all(users_table):
+        if 'AllowedAccountIds' in item:
+            legacy_users.append(item['UserId'])
+        for account_id in item.get('AllowedAccountIds', []):
+            if account_id in account_ids:
+                memberships.setdefault((account_id, item['UserId']), item.get('UserName', ''))
+
+    print(f"Loaded {len(memberships)} memberships of {len(account_ids)} accounts")
+    return memberships, legacy_accounts, legacy_users
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill the AccountMemberships table')
+    parser.add_argument('--remove-legacy', action='store_true',
+                        help='Remove AllowedUsers/AllowedAccountIds after the backfill')
+    args = parser.parse_args()
+
+    memberships, legacy_accounts, legacy_users = load_memberships()
+    with memberships_table.batch_writer(overwrite_by_pkeys=['AccountId', 'UserId']) as batch:
+        for (account_id, user_id), user_name in memberships.items():
+            batch.put_item(Item={'AccountId': account_id, 'UserId': user_id, 'UserName': user_name or ''})
+    print(f"Backfilled {len(memberships)} memberships")
+
+    if args.remove_legacy:
+        for account_id in legacy_accounts:
+            accounts_table.update_item(Key={'AccountId': account_id}, UpdateExpression='REMOVE AllowedUsers')
+        for user_id in legacy_users:
+            users_table.update_item(Key={'UserId': user_id}, UpdateExpression='REMOVE AllowedAccountIds')
+        print(f"Removed legacy attributes from {len(legacy_accounts)} accounts and {len(legacy_users)} users")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import os
+import sys
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from common.constants import HEALTH_EVENTS_TABLE_NAME, AFFECTED_ACCOUNTS_TABLE_NAME
+
+'''
+这是一个幂等的脚本，用于给已有的受影响账户条目补上 StartTime 和 ManagementAccountId，
+使它们出现在反向索引 MemberAccountIndex 中(之后新写入的条目由 fetch_health_events 直接带上这两个属性)。
+
+用法:
+python backfill_member_account_index.py
+'''
+
+dynamodb = boto3.resource('dynamodb')
+events_table = dynamodb.Table(HEALTH_EVENTS_TABLE_NAME)
+affected_accounts_table = dynamodb.Table(AFFECTED_ACCOUNTS_TABLE_NAME)
+
+def scan_all(table, **kwargs):
+    while True:
+        response = table.scan(**kwargs)
+        yield from response.get('Items', [])
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def load_event_refs():
+    """返回 {EventArn: (管理账户ID, StartTime)}。"""
+    refs = {}
+    for item in scan_all(events_table, ProjectionExpression='AccountId, EventArn, StartTime, ManagementAccountId'):
+        management_account_id = item.get('ManagementAccountId', item['AccountId'])
+        refs[item['EventArn']] = (management_account_id, item['StartTime'])
+    print(f"Loaded {len(refs)} events")
+    return refs
+
+def main():
+    event_refs = load_event_refs()
+    updated = 0
+    missing = 0
+    with affected_accounts_table.batch_writer() as batch:
+        for item in scan_all(affected_accounts_table, FilterExpression=Attr('StartTime').not_exists()):
+            ref = event_refs.get(item['EventArn'])
+            if not ref:
+                missing += 1
+                continue
+            item['ManagementAccountId'], item['StartTime'] = ref
+            batch.put_item(Item=item)
+            updated += 1
+    print(f"Backfilled {updated} affected accounts, {missing} skipped because their events no longer exist")
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,8 @@ from aws_cdk import (
     aws_dynamodb as dynamodb,
     aws_events as events,
     aws_events_targets as targets,
+    aws_sqs as sqs,
+    aws_lambda_event_sources as lambda_event_sources,
     Duration,
     RemovalPolicy,
     CfnOutput
@@ -23,10 +25,19 @@ from constants import (
     NAME_PREFIX, LAMBDA_ROLE,
     ACCOUNTS_TABLE_NAME,
     USERS_TABLE_NAME,
+    ACCOUNT_MEMBERSHIPS_TABLE_NAME,
     HEALTH_EVENTS_TABLE_NAME,
     EVENT_DETAILS_TABLE_NAME,
     AFFECTED_ACCOUNTS_TABLE_NAME,
     AFFECTED_ENTITIES_TABLE_NAME,
+    EVENT_ROLLUPS_TABLE_NAME,
+    SEARCH_INDEX_TABLE_NAME,
+    ENTITY_INDEX_TABLE_NAME,
+    TAG_INDEX_TABLE_NAME,
+    BEDROCK_INTERPRETATIONS_TABLE_NAME,
+    INTERPRETATION_QUEUE_NAME,
+    MEMBER_ACCOUNT_INDEX_NAME,
+    USER_ACCOUNTS_INDEX_NAME,
 )
 
 DEPLOY_ENVIRONMENT = os.getenv('DEPLOY_ENVIRONMENT', 'dev')  # 开发用'dev'， 生产用'prod'
@@ -45,20 +56,34 @@ class AwsHealthDashboard(Stack):
         # 创建DynamoDB表
         self.accounts_table = self.create_management_accounts_table()
         self.user_table = self.create_users_table()
+        self.memberships_table = self.create_account_memberships_table()
         # 几个健康事件相关的表
         self.health_table = self.create_health_events_table()
         self.event_details_table = self.create_event_details_table()
         self.affected_accounts_table = self.create_affected_accounts_table()
         self.affected_entities_table = self.create_affected_entities_table()
+        self.event_rollups_table = self.create_event_rollups_table()
+        self.search_index_table = self.create_search_index_table()
+        self.entity_index_table = self.create_entity_index_table()
+        self.tag_index_table = self.create_tag_index_table()
+        # Bedrock 解读结果的缓存
+        self.interpretations_table = self.create_interpretations_table()
 
         # 创建Lambda角色，并授予访问DynamoDB表的权限
         self.lambda_role = self.create_lambda_role()
 
+        # 预生成 Bedrock 解读的队列
+        self.interpretation_queue = self.create_interpretation_queue()
+
         # 创建API Gateway
         self.api = apigw.RestApi(
             self, f'{NAME_PREFIX}Api',
             rest_api_name=f'{NAME_PREFIX} Service',
-            description='AWS Health Dashboard API'
+            description='AWS Health Dashboard API',
+            # 允许Lambda返回base64编码的gzip响应体(见 common/utils.py 的 create_response)。
+            # 注意：这样配置后请求体也会以base64编码传给Lambda，由 parse_event 负责解码
+            # OPTIONS 的 MockIntegration 需要 CONVERT_TO_TEXT，见 register_lambda
+            binary_media_types=['*/*']
         )
 
         # 注册Lambda函数及其方法
@@ -85,7 +110,8 @@ class AwsHealthDashboard(Stack):
             'fetch_health_events',
             methods=['POST'],
             environment={
-                'LOOKBACK_DAYS': '90'
+                'LOOKBACK_DAYS': '90',
+                'INTERPRETATION_QUEUE_URL': self.interpretation_queue.queue_url
             },
             timeout=Duration.minutes(15)   # 设置Lambda函数的超时时间为15分钟
         )
@@ -122,6 +148,41 @@ class AwsHealthDashboard(Stack):
             timeout=Duration.minutes(15)
         )
 
+        # 注册一次查询事件详情、受影响账户和受影响实体的Lambda函数
+        self.query_event_bundle_lambda = self.register_lambda(
+            'query_event_bundle',
+            'query_event_bundle',
+            methods=['POST']
+        )
+
+        # 注册按资源标识查询事件的Lambda函数
+        self.query_events_by_resource_lambda = self.register_lambda(
+            'query_events_by_resource',
+            'query_events_by_resource',
+            methods=['POST']
+        )
+
+        # 注册按实体标签查询事件的Lambda函数
+        self.query_events_by_tags_lambda = self.register_lambda(
+            'query_events_by_tags',
+            'query_events_by_tags',
+            methods=['POST']
+        )
+
+        # 注册查询事件统计(分面计数)的Lambda函数
+        self.query_event_summary_lambda = self.register_lambda(
+            'query_event_summary',
+            'query_event_summary',
+            methods=['POST']
+        )
+
+        # 注册全文搜索事件的Lambda函数
+        self.search_events_lambda = self.register_lambda(
+            'search_events',
+            'search_events',
+            methods=['POST']
+        )
+
         self.query_bedrock = self.register_lambda(
             'query_bedrock',
             'query_bedrock',
@@ -129,6 +190,9 @@ class AwsHealthDashboard(Stack):
             timeout=Duration.minutes(15)
         )
 
+        # 消费解读队列，预先生成新事件的解读
+        self.interpretation_worker = self.create_interpretation_worker()
+
         # 创建EventBridge规则以触发fetch_health_events Lambda函数
         self.create_eventbridge_rule()
 
@@ -150,7 +214,7 @@ class AwsHealthDashboard(Stack):
         # 剩下的放在 deploy/data_collection/add_events_table_gsi.py中
         gsi_definitions = [
             ('GSI1', 'AccountId', 'StartTime'),
-            # ('GSI2', 'awsAccountIds', 'StartTime'),
+            # 成员账户的查询使用受影响账户表上的 MEMBER_ACCOUNT_INDEX_NAME，不需要 GSI2
             # ('GSI3', 'EventTypeCode', 'StartTime'),
             # ('GSI4', 'Region', 'StartTime'),
             # ('GSI5', 'Service', 'StartTime'),
@@ -191,6 +255,15 @@ class AwsHealthDashboard(Stack):
             billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST  # 按需计费
         )
 
+        # 反向索引：查询"影响成员账户X的事件"时按 (AccountId, StartTime) 直接 Query
+        table.add_global_secondary_index(
+            index_name=MEMBER_ACCOUNT_INDEX_NAME,
+            partition_key=dynamodb.Attribute(name='AccountId', type=dynamodb.AttributeType.STRING),
+            sort_key=dynamodb.Attribute(name='StartTime', type=dynamodb.AttributeType.STRING),
+            projection_type=dynamodb.ProjectionType.INCLUDE,
+            non_key_attributes=['ManagementAccountId']
+        )
+
         return table
 
     def create_affected_entities_table(self):
@@ -206,6 +279,91 @@ class AwsHealthDashboard(Stack):
 
         return table
 
+    def create_event_rollups_table(self):
+        """
+        创建用于存储事件汇总计数的DynamoDB表。
+        每个条目是一个 管理账户 × 天 × (服务, 区域, 类别, 状态) 的计数，由fetch_health_events写入时增量维护。
+        """
+        table = dynamodb.Table(
+            self, f'{NAME_PREFIX}EventRollupsTable',
+            table_name=EVENT_ROLLUPS_TABLE_NAME,
+            partition_key=dynamodb.Attribute(name='AccountId', type=dynamodb.AttributeType.STRING),
+            # 形如 2024-08-01#EC2#us-east-1#issue#closed
+            sort_key=dynamodb.Attribute(name='RollupKey', type=dynamodb.AttributeType.STRING),
+            removal_policy=REMOVAL_POLICY,
+            time_to_live_attribute='ExpirationTime',
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST  # 按需计费
+        )
+
+        return table
+
+    def create_search_index_table(self):
+        """
+        创建用于存储事件描述全文倒排索引的DynamoDB表。
+        每个条目是一个词项在一个事件中的倒排项，排序键以日期开头，见 common/search_index.py。
+        """
+        table = dynamodb.Table(
+            self, f'{NAME_PREFIX}SearchIndexTable',
+            table_name=SEARCH_INDEX_TABLE_NAME,
+            partition_key=dynamodb.Attribute(name='Term', type=dynamodb.AttributeType.STRING),
+            sort_key=dynamodb.Attribute(name='Bucket', type=dynamodb.AttributeType.STRING),
+            removal_policy=REMOVAL_POLICY,
+            time_to_live_attribute='ExpirationTime',
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST  # 按需计费
+        )
+
+        return table
+
+    def create_entity_index_table(self):
+        """
+        创建受影响实体的反向索引表(资源标识 -> 事件)。
+        分区键为 ARN 中资源之前的部分或者非 ARN 的标识，见 common/entity_index.py。
+        """
+        table = dynamodb.Table(
+            self, f'{NAME_PREFIX}EntityIndexTable',
+            table_name=ENTITY_INDEX_TABLE_NAME,
+            partition_key=dynamodb.Attribute(name='Scope', type=dynamodb.AttributeType.STRING),
+            sort_key=dynamodb.Attribute(name='ResourceKey', type=dynamodb.AttributeType.STRING),
+            removal_policy=REMOVAL_POLICY,
+            time_to_live_attribute='ExpirationTime',
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST  # 按需计费
+        )
+
+        return table
+
+    def create_tag_index_table(self):
+        """
+        创建受影响实体的标签倒排索引表(key=value -> 事件、账户、实体)。
+        排序键以事件的 StartTime 开头，见 common/entity_index.py。
+        """
+        table = dynamodb.Table(
+            self, f'{NAME_PREFIX}TagIndexTable',
+            table_name=TAG_INDEX_TABLE_NAME,
+            partition_key=dynamodb.Attribute(name='Tag', type=dynamodb.AttributeType.STRING),
+            sort_key=dynamodb.Attribute(name='EventKey', type=dynamodb.AttributeType.STRING),
+            removal_policy=REMOVAL_POLICY,
+            time_to_live_attribute='ExpirationTime',
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST  # 按需计费
+        )
+
+        return table
+
+    def create_interpretations_table(self):
+        """
+        创建Bedrock解读结果的缓存表。
+        分区键为解读输入(描述、实体、模型、Prompt版本)的哈希，见 common/interpretations.py。
+        """
+        table = dynamodb.Table(
+            self, f'{NAME_PREFIX}BedrockInterpretationsTable',
+            table_name=BEDROCK_INTERPRETATIONS_TABLE_NAME,
+            partition_key=dynamodb.Attribute(name='InterpretationKey', type=dynamodb.AttributeType.STRING),
+            removal_policy=REMOVAL_POLICY,
+            time_to_live_attribute='ExpirationTime',
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST  # 按需计费
+        )
+
+        return table
+
     def create_management_accounts_table(self):
         """创建用于存储管理账户的DynamoDB表。"""
         table = dynamodb.Table(
@@ -226,6 +384,29 @@ class AwsHealthDashboard(Stack):
         )
         return table
 
+    def create_account_memberships_table(self):
+        """
+        创建管理账户和用户的成员关系表，每个 (AccountId, UserId) 一行，见 common/memberships.py。
+        """
+        table = dynamodb.Table(
+            self, f'{NAME_PREFIX}AccountMembershipsTable',
+            table_name=ACCOUNT_MEMBERSHIPS_TABLE_NAME,
+            partition_key=dynamodb.Attribute(name='AccountId', type=dynamodb.AttributeType.STRING),
+            sort_key=dynamodb.Attribute(name='UserId', type=dynamodb.AttributeType.STRING),
+            removal_policy=REMOVAL_POLICY,
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST  # 按需计费
+        )
+
+        # 反向索引：查询"用户X允许访问的管理账户"时按 UserId 直接 Query
+        table.add_global_secondary_index(
+            index_name=USER_ACCOUNTS_INDEX_NAME,
+            partition_key=dynamodb.Attribute(name='UserId', type=dynamodb.AttributeType.STRING),
+            sort_key=dynamodb.Attribute(name='AccountId', type=dynamodb.AttributeType.STRING),
+            projection_type=dynamodb.ProjectionType.KEYS_ONLY
+        )
+
+        return table
+
     def create_lambda_role(self):
         """创建Lambda函数的IAM角色，并授予访问DynamoDB表的权限。"""
         role = iam.Role(
@@ -253,10 +434,16 @@ class AwsHealthDashboard(Stack):
 
         self.accounts_table.grant_read_write_data(role)
         self.user_table.grant_read_write_data(role)
+        self.memberships_table.grant_read_write_data(role)
         self.health_table.grant_read_write_data(role)
         self.event_details_table.grant_read_write_data(role)
         self.affected_accounts_table.grant_read_write_data(role)
         self.affected_entities_table.grant_read_write_data(role)
+        self.event_rollups_table.grant_read_write_data(role)
+        self.search_index_table.grant_read_write_data(role)
+        self.entity_index_table.grant_read_write_data(role)
+        self.tag_index_table.grant_read_write_data(role)
+        self.interpretations_table.grant_read_write_data(role)
 
         # 添加DynamoDB TTL操作的权限
         role.add_to_policy(iam.PolicyStatement(
@@ -267,10 +454,16 @@ class AwsHealthDashboard(Stack):
                 resources=[
                     self.accounts_table.table_arn, 
                     self.user_table.table_arn,
+                    self.memberships_table.table_arn,
                     self.health_table.table_arn, 
                     self.event_details_table.table_arn,
                     self.affected_accounts_table.table_arn,
-                    self.affected_entities_table.table_arn
+                    self.affected_entities_table.table_arn,
+                    self.event_rollups_table.table_arn,
+                    self.search_index_table.table_arn,
+                    self.entity_index_table.table_arn,
+                    self.tag_index_table.table_arn,
+                    self.interpretations_table.table_arn
                 ]
             )
         )
@@ -318,12 +511,15 @@ class AwsHealthDashboard(Stack):
                 integration_responses=[apigw.IntegrationResponse(
                     status_code="200",
                     response_parameters={
-                        "method.response.header.Access-Control-Allow-Headers": "'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token'",
+                        "method.response.header.Access-Control-Allow-Headers": "'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,If-None-Match'",
                         "method.response.header.Access-Control-Allow-Origin": "'*'",
                         "method.response.header.Access-Control-Allow-Methods": "'" + ",".join(methods) + "'"
                     }
                 )],
-                request_templates={"application/json": '{"statusCode": 200}'}
+                request_templates={"application/json": '{"statusCode": 200}'},
+                # binary_media_types 为 */* 时请求会被当作二进制透传，映射模板不会生效；
+                # 转换成文本后 {"statusCode": 200} 模板才会应用，CORS 预检才能返回 200
+                content_handling=apigw.ContentHandling.CONVERT_TO_TEXT
             ),
             method_responses=[apigw.MethodResponse(
                 status_code="200",
@@ -373,6 +569,60 @@ class AwsHealthDashboard(Stack):
 
         return lambda_function
     
+    def create_interpretation_queue(self):
+        """创建预生成解读的SQS队列，多次处理失败的消息进入死信队列。"""
+        dead_letter_queue = sqs.Queue(
+            self, f'{NAME_PREFIX}InterpretationDeadLetterQueue',
+            queue_name=f'{INTERPRETATION_QUEUE_NAME}DLQ',
+            retention_period=Duration.days(14),
+            removal_policy=REMOVAL_POLICY
+        )
+        queue = sqs.Queue(
+            self, f'{NAME_PREFIX}InterpretationQueue',
+            queue_name=INTERPRETATION_QUEUE_NAME,
+            # 不小于 worker 的超时时间，处理中的消息不会被重复投递
+            visibility_timeout=Duration.minutes(30),
+            dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=5, queue=dead_letter_queue),
+            removal_policy=REMOVAL_POLICY
+        )
+        queue.grant_send_messages(self.lambda_role)
+        return queue
+
+    def create_interpretation_worker(self):
+        """
+        创建预生成解读的Lambda函数(query_bedrock 中的 worker_handler)，由解读队列触发。
+        预留并发数限制了同时调用 Bedrock 的实例数，每个实例内再用令牌桶限速，见 api/query_bedrock/lambda.py。
+        """
+        reserved_concurrency = 2
+        worker_concurrency = 2
+        worker = _lambda.Function(
+            self, f'{NAME_PREFIX}InterpretationWorkerFunction',
+            function_name=f'{NAME_PREFIX}InterpretationWorker',
+            runtime=_lambda.Runtime.PYTHON_3_11,
+            handler="lambda.worker_handler",
+            code=_lambda.Code.from_asset(os.path.join(os.path.dirname(__file__), '../../../api/query_bedrock')),
+            role=self.lambda_role,
+            environment={
+                "INTERPRETATION_WORKER_CONCURRENCY": str(worker_concurrency),
+                # Bedrock 每分钟的调用配额按预留并发数分摊
+                "INTERPRETATION_RATE_PER_MINUTE": str(20 / reserved_concurrency),
+                # 每次调用的读超时远小于函数的 5 分钟超时，一批中有多条消息时不会被一次慢调用拖到超时
+                "BEDROCK_READ_TIMEOUT": "60",
+                "PYTHONPATH": "/opt"  # 设置 PYTHONPATH 指向 Lambda Layer 的挂载点
+            },
+            timeout=Duration.minutes(5),
+            reserved_concurrent_executions=reserved_concurrency,
+            layers=[self.common_layer]
+        )
+        # 每批的消息数不超过实例内的并发数，一批消息同时开始处理，
+        # 最慢的消息(等待令牌 + 重试的模型调用，见 INTERPRETATION_MESSAGE_BUDGET_MS)也在函数超时之前结束
+        worker.add_event_source(lambda_event_sources.SqsEventSource(
+            self.interpretation_queue,
+            batch_size=worker_concurrency,
+            report_batch_item_failures=True
+        ))
+        return worker
+
     def create_eventbridge_rule(self):
         """创建EventBridge规则以触发fetch_health_events Lambda函数。"""
         rule = events.Rule(
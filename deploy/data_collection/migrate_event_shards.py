@@ -0,0 +1,104 @@
+import argparse
+import os
+import sys
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+
+# 复用 common/ 中的分区键计算逻辑，保证迁移后的分区键和写入/查询两侧一致
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from common.cache import bump_data_generation
+from common.constants import ACCOUNTS_TABLE_NAME, HEALTH_EVENTS_TABLE_NAME
+from common.health_events import SHARD_STRATEGIES, get_shard_config, event_partition_key
+
+'''
+这是一个幂等的脚本，用于修改某个管理账户在HEALTH_EVENTS_TABLE_NAME中的分片方式，并迁移已有数据。
+
+步骤：
+1. 扫描出该管理账户的全部事件(包括未分片的和任意分片方式下的条目)；
+2. 按新的分片配置计算分区键，分区键变化的条目先写入新位置(旧条目暂时保留)；
+3. 更新管理账户表上的 EventShardStrategy / EventShardCount，查询侧从此读取新位置；
+4. 删除旧位置的条目，并把数据版本号加一，使查询侧的缓存失效。
+
+在第3步之前查询读的是旧位置，之后读的是新位置，两边的数据都是完整的。
+请避开 fetch_health_events 的定时运行时间执行，否则迁移期间写入的事件可能落在旧位置。
+
+用法:
+python migrate_event_shards.py 123456789012 --strategy hash --shards 8
+python migrate_event_shards.py 123456789012 --strategy month
+python migrate_event_shards.py 123456789012 --strategy hash --shards 1   # 还原成不分片
+'''
+
+dynamodb = boto3.resource('dynamodb')
+accounts_table = dynamodb.Table(ACCOUNTS_TABLE_NAME)
+events_table = dynamodb.Table(HEALTH_EVENTS_TABLE_NAME)
+
+def scan_account_events(account_id):
+    """扫描出一个管理账户的全部事件条目(一次性的迁移操作，用 Scan 保证不漏掉任何分片)。"""
+    filter_expression = (Attr('AccountId').eq(account_id)
+                         | Attr('AccountId').begins_with(f'{account_id}#')
+                         | Attr('ManagementAccountId').eq(account_id))
+    items = []
+    kwargs = {'FilterExpression': filter_expression}
+    while True:
+        response = events_table.scan(**kwargs)
+        items.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return items
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def migrate_account(account_id, shard_config, dry_run=False):
+    account_item = accounts_table.get_item(Key={'AccountId': account_id}).get('Item')
+    if not account_item:
+        print(f"Management account {account_id} is not registered. Skipping.")
+        return
+
+    print(f"Current shard config of {account_id}: {get_shard_config(account_item)}, new shard config: {shard_config}")
+    items = scan_account_events(account_id)
+
+    moved_items = []
+    stale_keys = []
+    for item in items:
+        partition_key = event_partition_key(account_id, item['EventArn'], item['StartTime'], shard_config)
+        if item['AccountId'] == partition_key and item.get('ManagementAccountId') == account_id:
+            continue
+        moved_items.append({**item, 'AccountId': partition_key, 'ManagementAccountId': account_id})
+        if item['AccountId'] != partition_key:
+            stale_keys.append({'AccountId': item['AccountId'], 'EventArn': item['EventArn']})
+
+    print(f"Scanned {len(items)} events, {len(moved_items)} to rewrite, {len(stale_keys)} to delete.")
+    if dry_run:
+        return
+
+    with events_table.batch_writer() as batch:
+        for item in moved_items:
+            batch.put_item(Item=item)
+
+    accounts_table.update_item(
+        Key={'AccountId': account_id},
+        UpdateExpression='SET EventShardStrategy = :strategy, EventShardCount = :count',
+        ExpressionAttributeValues={':strategy': shard_config['strategy'], ':count': shard_config['count']}
+    )
+
+    with events_table.batch_writer(overwrite_by_pkeys=['AccountId', 'EventArn']) as batch:
+        for key in stale_keys:
+            batch.delete_item(Key=key)
+
+    generation = bump_data_generation(accounts_table)
+    print(f"Migrated management account {account_id}, bumped data generation to {generation}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Change the event shard config of a management account.')
+    parser.add_argument('account_ids', nargs='+', help='management account IDs')
+    parser.add_argument('--strategy', choices=SHARD_STRATEGIES, default='hash')
+    parser.add_argument('--shards', type=int, default=1, help='number of hash shards (ignored for month)')
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    shard_config = get_shard_config({'EventShardStrategy': args.strategy, 'EventShardCount': args.shards})
+    for account_id in args.account_ids:
+        migrate_account(account_id, shard_config, args.dry_run)
+
+if __name__ == "__main__":
+    main()
@@ -12,7 +12,7 @@ const EventDetails = ({ eventArn, eventDetails, failedEventArns, bedrockState, o
         const eventDesc = eventDetails[eventArn].latest_description;
         const affectedEntities = eventDetails[eventArn].affected_entities || [];
 
-        const response = await queryBedrock(eventDesc, affectedEntities);
+        const response = await queryBedrock(eventDesc, affectedEntities, eventArn);
 
         if (response.error) {
           // 处理错误情况
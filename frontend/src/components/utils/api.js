@@ -89,12 +89,16 @@ const mapFailedEventArns = (failedEvents) => {
   }, {});
 };
 
-export const queryBedrock = async (eventDesc, affectedEntities = []) => {
+export const queryBedrock = async (eventDesc, affectedEntities = [], eventArn = null) => {
   try {
     const requestData = {
       event_desc: eventDesc,
       affected_entities: affectedEntities,
     };
+    // 带上 event_arn 时后端从数据库读取描述和受影响实体，可以命中预生成的解读
+    if (eventArn) {
+      requestData.event_arn = eventArn;
+    }
 
     console.log('Calling queryBedrock with data:', requestData);
 
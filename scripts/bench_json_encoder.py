@@ -0,0 +1,109 @@
+import os
+import sys
+import time
+import json
+import random
+from decimal import Decimal
+
+# 将 common 目录添加到 sys.path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from common.utils import json_dump_default, stdlib_json_dumps, convert_decimals, orjson
+
+'''
+对比 create_response 使用的几种 JSON 编码方式的耗时:
+- legacy: 原先的 json.dumps(body, default=...)，每个 Decimal 都在函数内部 import 后再转换
+- stdlib: common/utils.py 中优化后的标准库编码
+- stdlib+convert: 先用 convert_decimals 一次性转换(缓存的查询结果就是这样)，再编码
+- orjson: 安装了 orjson 时才会测试
+
+用法: python scripts/bench_json_encoder.py [条目数，默认10000]
+'''
+
+SERVICES = ['EC2', 'RDS', 'LAMBDA', 'S3', 'ELASTICLOADBALANCING', 'EKS']
+REGIONS = ['us-east-1', 'us-west-2', 'eu-west-1', 'ap-northeast-1', 'global']
+CATEGORIES = ['issue', 'accountNotification', 'scheduledChange']
+STATUSES = ['open', 'closed', 'upcoming']
+
+def legacy_json_dumps(body):
+    def json_dump_default(obj):
+        from decimal import Decimal
+        if isinstance(obj, Decimal):
+            if obj.to_integral_value() == obj:
+                return int(obj)
+            else:
+                return float(obj)
+        return obj
+    return json.dumps(body, default=json_dump_default)
+
+def make_events(n):
+    """生成和 HealthEvents 表中条目结构一致的事件(boto3 resource 层返回的数字都是 Decimal)。"""
+    events = []
+    for i in range(n):
+        service = random.choice(SERVICES)
+        region = random.choice(REGIONS)
+        events.append({
+            'AccountId': f'{random.randint(10**11, 10**12 - 1)}',
+            'EventArn': f'arn:aws:health:{region}::event/{service}/AWS_{service}_OPERATIONAL_ISSUE/AWS_{service}_OPERATIONAL_ISSUE_{i:08d}',
+            'Service': service,
+            'EventTypeCode': f'AWS_{service}_OPERATIONAL_ISSUE',
+            'EventTypeCategory': random.choice(CATEGORIES),
+            'EventScopeCode': 'ACCOUNT_SPECIFIC',
+            'Region': region,
+            'AvailabilityZone': '',
+            'StartTime': '2024-08-01T10:00:00+00:00',
+            'EndTime': '2024-08-01T12:00:00+00:00',
+            'LastUpdatedTime': '2024-08-01T12:30:00+00:00',
+            'StatusCode': random.choice(STATUSES),
+            'ExpirationTime': Decimal(1730000000 + i),
+        })
+    return events
+
+def make_entities(n):
+    """生成和 AffectedEntities 表中条目结构一致的实体。"""
+    return [{
+        'EventArn': f'arn:aws:health:us-east-1::event/EC2/AWS_EC2_INSTANCE_RETIREMENT_SCHEDULED/{i // 50:06d}',
+        'AccountId': f'{random.randint(10**11, 10**12 - 1)}',
+        'EntityId': f'arn:aws:ec2:us-east-1:123456789012:instance/i-{i:017x}',
+        'EntityValue': f'i-{i:017x}',
+        'EntityUrl': '',
+        'LastUpdatedTime': '2024-08-01T12:30:00+00:00',
+        'EntityType': 'AWS::EC2::Instance',
+        'StatusCode': 'IMPAIRED',
+        'Tags': {'app': 'payments', 'env': 'prod', 'cost': Decimal('12.5')},
+    } for i in range(n)]
+
+def bench(name, func, payload, rounds=5):
+    best = float('inf')
+    size = 0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        size = len(func(payload))
+        best = min(best, time.perf_counter() - start)
+    print(f"  {name:<16} {best * 1000:8.2f} ms  ({size} chars)")
+    return best
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    random.seed(42)
+    payloads = {
+        f'{n} health events': {'message': 'ok', 'all_events': make_events(n)},
+        f'{n} affected entities': {'message': 'ok', 'affected_entities': make_entities(n)},
+    }
+
+    for name, payload in payloads.items():
+        print(f"{name}:")
+        baseline = bench('legacy', legacy_json_dumps, payload)
+        bench('stdlib', stdlib_json_dumps, payload)
+        converted = convert_decimals(payload)
+        bench('stdlib+convert', stdlib_json_dumps, converted)
+        if orjson is not None:
+            orjson_dumps = lambda obj: orjson.dumps(obj, default=json_dump_default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+            bench('orjson', orjson_dumps, payload)
+            bench('orjson+convert', orjson_dumps, converted)
+        else:
+            print("  orjson           not installed, skipped")
+        print(f"  (legacy baseline {baseline * 1000:.2f} ms)")
+
+if __name__ == "__main__":
+    main()
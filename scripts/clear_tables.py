@@ -28,10 +28,16 @@ def clear_all_tables():
     table_names = [
         'AwsHealthDashboardAffectedAccounts',
         'AwsHealthDashboardAffectedEntities',
+        'AwsHealthDashboardEventRollups',
+        'AwsHealthDashboardSearchIndex',
+        'AwsHealthDashboardEntityIndex',
+        'AwsHealthDashboardTagIndex',
+        'AwsHealthDashboardBedrockInterpretations',
         'AwsHealthDashboardEventDetails',
         'AwsHealthDashboardHealthEvents',
         'AwsHealthDashboardManagementAccounts',
-        'AwsHealthDashboardUsers'
+        'AwsHealthDashboardUsers',
+        'AwsHealthDashboardAccountMemberships'
     ]
 
     for table_name in table_names: